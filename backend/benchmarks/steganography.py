@@ -0,0 +1,207 @@
+"""
+Benchmark encode_text_in_image / decode_text_from_image on synthetic images.
+
+Each case (image size, mode, density, payload size) runs in a fresh process so
+that its peak RSS is not inflated by earlier cases. Results are written as JSON
+and can be compared against an earlier run:
+
+    python -m backend.benchmarks.steganography --output bench.json
+    python -m backend.benchmarks.steganography --output new.json --compare bench.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+import PIL
+from PIL import Image
+
+from backend.utils.steganography import (
+    decode_text_from_image,
+    encode_text_in_image,
+    peak_buffer_bytes,
+)
+
+DEFAULT_MEGAPIXELS = [0.1, 1, 5, 12, 50]
+DEFAULT_MODES = ["RGB", "RGBA"]
+DEFAULT_DENSITIES = ["R:1", "RGB:2"]
+DEFAULT_PAYLOAD_BYTES = [100, 10_000, 100_000]
+
+_WORDS = (
+    "the culprit was seen near market wearing black jacket blue jeans tall "
+    "incident reported evening street bus stop threatened phone messages"
+).split()
+
+
+def synthetic_image(megapixels: float, mode: str, seed: int = 0) -> Image.Image:
+    """Random-noise image of roughly `megapixels` with a 4:3 aspect ratio."""
+    width = max(1, int((megapixels * 1e6 * 4 / 3) ** 0.5))
+    height = max(1, int(megapixels * 1e6 / width))
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (height, width, len(mode)), dtype=np.uint8)
+    return Image.fromarray(pixels)
+
+
+def synthetic_report(size: int, seed: int = 0) -> str:
+    """Prose-like text of `size` characters, compressible like real reports."""
+    rng = np.random.default_rng(seed)
+    words = rng.choice(_WORDS, size=size // 4 + 1)
+    return " ".join(words)[:size]
+
+
+def percentiles(samples):
+    return {
+        f"p{q}": float(np.percentile(samples, q) * 1000) for q in (50, 90, 99)
+    } | {"mean": float(np.mean(samples) * 1000)}
+
+
+def run_case(case: dict) -> dict:
+    """Run one benchmark case; meant to be called in a fresh worker process."""
+    channels, bits_per_channel = case["density"].split(":")
+    image = synthetic_image(case["megapixels"], case["mode"])
+    text = synthetic_report(case["payload_bytes"])
+    pixels = image.size[0] * image.size[1]
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    try:
+        encoded = encode_text_in_image(image, text, channels, int(bits_per_channel))
+    except ValueError as e:
+        return case | {"skipped": str(e)}
+
+    encode_times, decode_times = [], []
+    for _ in range(case["repeat"]):
+        start = time.perf_counter()
+        encode_text_in_image(image, text, channels, int(bits_per_channel))
+        encode_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        decoded = decode_text_from_image(encoded)
+        decode_times.append(time.perf_counter() - start)
+    assert decoded == text, "round trip failed"
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss_unit = 1 if sys.platform == "darwin" else 1024
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return case | {
+        "width": image.size[0],
+        "height": image.size[1],
+        "encode_ms": percentiles(encode_times),
+        "decode_ms": percentiles(decode_times),
+        "encode_mp_per_s": pixels / 1e6 / float(np.median(encode_times)),
+        "decode_mp_per_s": pixels / 1e6 / float(np.median(decode_times)),
+        "peak_rss_mb": peak_rss * rss_unit / 2**20,
+        "rss_above_image_mb": (peak_rss - baseline_rss) * rss_unit / 2**20,
+        "peak_tile_buffer_mb": peak_buffer_bytes(image) / 2**20,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def case_id(result: dict) -> str:
+    return (
+        f"{result['megapixels']}MP {result['mode']} {result['density']} "
+        f"{result['payload_bytes']}B"
+    )
+
+
+def compare(results, baseline_path: str, threshold: float) -> bool:
+    """Print p50 latency ratios against a baseline run; return True on regression."""
+    with open(baseline_path) as baseline_file:
+        baseline = {case_id(r): r for r in json.load(baseline_file)["results"] if "skipped" not in r}
+
+    regressed = False
+    for result in results:
+        old = baseline.get(case_id(result))
+        if "skipped" in result or old is None:
+            continue
+        for op in ("encode_ms", "decode_ms"):
+            ratio = result[op]["p50"] / old[op]["p50"]
+            flag = ""
+            if ratio > 1 + threshold:
+                flag, regressed = "  REGRESSION", True
+            print(f"{case_id(result):<28} {op[:6]} p50 x{ratio:.2f}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--megapixels", type=float, nargs="+", default=DEFAULT_MEGAPIXELS)
+    parser.add_argument("--modes", nargs="+", default=DEFAULT_MODES)
+    parser.add_argument(
+        "--densities", nargs="+", default=DEFAULT_DENSITIES,
+        help="CHANNELS:BITS pairs, e.g. R:1 RGB:2",
+    )
+    parser.add_argument("--payload-bytes", type=int, nargs="+", default=DEFAULT_PAYLOAD_BYTES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default="bench_steganography.json")
+    parser.add_argument("--compare", help="earlier JSON result to compare against")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1,
+        help="relative p50 slowdown reported as a regression",
+    )
+    args = parser.parse_args()
+
+    cases = [
+        {
+            "megapixels": megapixels,
+            "mode": mode,
+            "density": density,
+            "payload_bytes": payload_bytes,
+            "repeat": args.repeat,
+        }
+        for megapixels in args.megapixels
+        for mode in args.modes
+        for density in args.densities
+        for payload_bytes in args.payload_bytes
+    ]
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for case in cases:
+        # One process per case keeps ru_maxrss specific to that case
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(run_case, case).result()
+        results.append(result)
+        if "skipped" in result:
+            print(f"{case_id(result):<28} skipped: {result['skipped']}")
+        else:
+            print(
+                f"{case_id(result):<28} encode p50 {result['encode_ms']['p50']:8.1f} ms "
+                f"({result['encode_mp_per_s']:7.1f} MP/s)  decode p50 "
+                f"{result['decode_ms']['p50']:8.1f} ms  peak RSS {result['peak_rss_mb']:7.1f} MB"
+            )
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pillow": PIL.__version__,
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Benchmark similarity search over synthetic embedding corpora.
+
+Measures latency percentiles, throughput and recall@k against an exact ranking
+for the full-scan path of find_similar_culprits and for the local index with
+and without quantization. Each corpus size runs in a fresh process, against an
+in-memory stand-in for complains2 or, with --mongo-uri, a scratch collection on
+a local mongod. Results are written as JSON:
+
+    python -m backend.benchmarks.vector_search --sizes 1000 10000 100000
+    python -m backend.benchmarks.vector_search --sizes 1000000 --variants ivf ivf-int8 ivf-pq
+    python -m backend.benchmarks.vector_search --mongo-uri mongodb://localhost:27017
+
+A corpus of N vectors takes about N * 768 * 8 bytes of memory in the stand-in,
+about 6 GB for a million.
+"""
+
+import argparse
+import bisect
+import json
+import multiprocessing
+import platform
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+from bson import ObjectId
+
+from backend import config, db
+from backend.benchmarks.steganography import git_commit, percentiles
+from backend.utils.embedding import similarity_scores
+from backend.utils.vector_codec import pack_embedding
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+# Search paths: the exact scan, and the local index storing floats, int8 or PQ codes
+VARIANTS = {"scan": None, "ivf": "", "ivf-int8": "int8", "ivf-pq": "pq"}
+COLLECTION, FIELD = db.VECTOR_INDEXES["culprits"]
+_CENTRES = 256
+_INSERT_BATCH = 10_000
+
+
+def synthetic_corpus(size: int, dimensions: int = 768, seed: int = 0) -> np.ndarray:
+    """Unit vectors scattered around random centres, like embeddings of similar reports."""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(_CENTRES, dimensions)).astype(np.float32)
+    corpus = np.empty((size, dimensions), dtype=np.float32)
+    for start in range(0, size, _INSERT_BATCH):
+        count = min(_INSERT_BATCH, size - start)
+        block = centres[rng.integers(0, _CENTRES, count)]
+        block += 0.3 * rng.normal(size=(count, dimensions)).astype(np.float32)
+        corpus[start:start + count] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    return corpus
+
+
+def synthetic_queries(corpus: np.ndarray, count: int, seed: int = 1) -> np.ndarray:
+    """Perturbed corpus vectors, as a new description of a known culprit would be."""
+    rng = np.random.default_rng(seed)
+    queries = corpus[rng.choice(len(corpus), count, replace=False)]
+    queries = queries + 0.05 * rng.normal(size=queries.shape).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def exact_top_k(corpus: np.ndarray, queries: np.ndarray, k: int, block: int = 16) -> np.ndarray:
+    """Rows of the exact top k for every query, scored in blocks of queries."""
+    top = np.empty((len(queries), k), dtype=np.int64)
+    for start in range(0, len(queries), block):
+        scores = similarity_scores(queries[start:start + block], corpus)
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1, kind="stable")
+        top[start:start + len(scores)] = np.take_along_axis(best, order, axis=1)
+    return top
+
+
+class _Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def __iter__(self):
+        return iter(self.docs)
+
+    def sort(self, key, direction):
+        # Documents are kept in _id order, the only sort the search code asks for
+        return self
+
+    def batch_size(self, size):
+        return self
+
+
+class InMemoryCollection:
+    """
+    Stand-in for complains2 supporting only the queries the search paths issue:
+    a scan for documents with an embedding, and _id $gt and $in lookups, with
+    inclusion or exclusion projections.
+    """
+
+    name = COLLECTION
+
+    def __init__(self):
+        self.docs = {}
+        self.ids = []
+
+    def insert_many(self, docs, ordered=True):
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+            self.docs[doc["_id"]] = doc
+            self.ids.append(doc["_id"])
+
+    def find(self, query=None, projection=None):
+        query = query or {}
+        id_query = query.get("_id", {})
+        if "$in" in id_query:
+            ids = [id_ for id_ in id_query["$in"] if id_ in self.docs]
+        elif "$gt" in id_query:
+            ids = self.ids[bisect.bisect_right(self.ids, id_query["$gt"]):]
+        else:
+            ids = self.ids
+        # Other conditions are all {"$exists": True}
+        required = [key for key in query if key != "_id"]
+        docs = (self.docs[id_] for id_ in ids)
+        docs = (doc for doc in docs if all(key in doc for key in required))
+        if projection and any(projection.values()):
+            docs = ({key: doc[key] for key in ("_id", *projection) if key in doc} for doc in docs)
+        elif projection:
+            docs = ({key: value for key, value in doc.items() if key not in projection} for doc in docs)
+        return _Cursor(docs)
+
+    def drop(self):
+        self.docs.clear()
+        self.ids.clear()
+
+
+def open_database(case: dict):
+    """The database the search code will see: the stand-in or a scratch mongod database."""
+    if not case["mongo_uri"]:
+        return {COLLECTION: InMemoryCollection()}
+    from pymongo import MongoClient
+
+    database = MongoClient(case["mongo_uri"])[case["mongo_database"]]
+    database[COLLECTION].drop()
+    return database
+
+
+def run_size(case: dict) -> list:
+    """Benchmark every variant on one corpus size; meant to run in a fresh worker process."""
+    size, k = case["size"], case["k"]
+    corpus = synthetic_corpus(size, case["dimensions"])
+    queries = synthetic_queries(corpus, min(case["queries"], size))
+    truth = exact_top_k(corpus, queries, k)
+
+    database = open_database(case)
+    collection = database[COLLECTION]
+    ids = []
+    for start in range(0, size, _INSERT_BATCH):
+        docs = [
+            {FIELD: pack_embedding(vector) if case["storage"] == "packed" else vector.tolist()}
+            for vector in corpus[start:start + _INSERT_BATCH]
+        ]
+        collection.insert_many(docs, ordered=False)
+        ids.extend(str(doc["_id"]) for doc in docs)
+
+    # Point the search code at the benchmark corpus and a scratch index directory
+    db.get_database = lambda: database
+    config.EMBEDDING_DIMENSIONS = case["dimensions"]
+    config.VECTOR_INDEX_DIR = tempfile.mkdtemp(prefix="vector-bench-")
+    config.VECTOR_INDEX_PROBES = case["probes"]
+
+    results = []
+    for variant in case["variants"]:
+        result = {key: case[key] for key in ("size", "dimensions", "k", "storage", "probes")}
+        result |= {"variant": variant, "backend": "mongod" if case["mongo_uri"] else "in-memory"}
+        if variant == "scan" and size > case["max_scan_size"]:
+            results.append(result | {"skipped": f"scan limited to {case['max_scan_size']} vectors"})
+            continue
+
+        if variant == "scan":
+            result["index_bytes"] = 0
+
+            def search(query):
+                return db.scan_top_matches(collection, FIELD, query, k=k)
+        else:
+            config.VECTOR_INDEX_QUANTIZATION = VARIANTS[variant]
+            start = time.perf_counter()
+            try:
+                index = db.build_vector_index("culprits")
+            except ValueError as e:
+                results.append(result | {"skipped": str(e)})
+                continue
+            result["build_seconds"] = time.perf_counter() - start
+            stored = index.vectors if index.quantizer is None else index.codes
+            result["index_bytes"] = int(stored.nbytes + index.norms.nbytes)
+
+            def search(query):
+                return db.search_vector_index("culprits", query, k=k)
+
+        search(queries[0])
+        times, found = [], 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            matches = search(query)
+            times.append(time.perf_counter() - start)
+            found += len({str(doc["_id"]) for doc in matches} & {ids[row] for row in expected})
+        results.append(result | {
+            "queries": len(queries),
+            "latency_ms": percentiles(times),
+            "qps": len(times) / sum(times),
+            "recall": found / truth.size,
+        })
+
+    collection.drop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--variants", nargs="+", choices=list(VARIANTS), default=list(VARIANTS))
+    parser.add_argument("--dimensions", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--probes", type=int, default=config.VECTOR_INDEX_PROBES)
+    parser.add_argument(
+        "--storage", choices=["packed", "array"], default="packed",
+        help="embeddings as packed binary vectors or BSON arrays like culprit_embedding",
+    )
+    parser.add_argument(
+        "--max-scan-size", type=int, default=100_000,
+        help="largest corpus the exact scan is run on",
+    )
+    parser.add_argument("--mongo-uri", help="run against this mongod instead of the stand-in")
+    parser.add_argument("--mongo-database", default="vector_benchmark")
+    parser.add_argument("--output", default="bench_vector_search.json")
+    args = parser.parse_args()
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for size in args.sizes:
+        case = {
+            "size": size,
+            "variants": args.variants,
+            "dimensions": args.dimensions,
+            "queries": args.queries,
+            "k": args.k,
+            "probes": args.probes,
+            "storage": args.storage,
+            "max_scan_size": args.max_scan_size,
+            "mongo_uri": args.mongo_uri,
+            "mongo_database": args.mongo_database,
+        }
+        # One process per corpus keeps memory from earlier corpora out of the way
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            size_results = executor.submit(run_size, case).result()
+        results.extend(size_results)
+        for result in size_results:
+            label = f"{result['size']:>9} {result['variant']:<9}"
+            if "skipped" in result:
+                print(f"{label} skipped: {result['skipped']}")
+            else:
+                print(
+                    f"{label} p50 {result['latency_ms']['p50']:8.2f} ms  "
+                    f"p99 {result['latency_ms']['p99']:8.2f} ms  {result['qps']:8.1f} QPS  "
+                    f"recall@{result['k']} {result['recall']:.3f}  "
+                    f"index {result['index_bytes'] / 2**20:8.1f} MB"
+                )
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Maintenance commands for the backend database.
+
+    python -m backend.cli build-index culprits
+    python -m backend.cli build-index all
+    python -m backend.cli ingest-docs path/to/texts
+    python -m backend.cli migrate-embeddings --dtype float16
+    python -m backend.cli evaluate-quantization culprits --queries 200
+    python -m backend.cli reembed culprits --source truncate
+    python -m backend.cli ensure-indexes
+    python -m backend.cli index-duplicates
+"""
+
+import argparse
+
+import numpy as np
+
+from backend import config, db
+from backend.utils.common import read_files_from_directory
+from backend.utils.quantization import evaluate_recall
+
+
+def build_index(args):
+    names = list(db.VECTOR_INDEXES) if args.name == "all" else [args.name]
+    for name in names:
+        index = db.build_vector_index(name)
+        if index is None:
+            print(f"{name}: database connection is not available")
+            continue
+        print(f"{name}: indexed {len(index)} embeddings in {index.n_lists} lists")
+
+
+def ingest_docs(args):
+    stats = db.upload_embeddings_to_mongo(
+        read_files_from_directory(args.directory),
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+    )
+    if stats is None:
+        print("Database connection is not available")
+        return
+    print(
+        f"Inserted {stats['inserted']} of {stats['files']} documents in {stats['seconds']:.2f}s "
+        f"(embedding {stats['embed_per_second']:.1f} docs/s, "
+        f"insert {stats['insert_per_second']:.1f} docs/s, {stats['failed']} failed)"
+    )
+
+
+def migrate_embeddings(args):
+    counts = db.migrate_document_embeddings(args.dtype, args.batch_size)
+    if counts is None:
+        print("Database connection is not available")
+        return
+    print(
+        f"Migrated {counts['migrated']} embeddings, skipped {counts['skipped']} "
+        f"already packed, {counts['failed']} failed"
+    )
+
+
+def evaluate_quantization(args):
+    loaded = db.load_stored_embeddings(args.name)
+    if loaded is None:
+        print("Database connection is not available")
+        return
+    _, embeddings = loaded
+    if len(embeddings) == 0:
+        print(f"{args.name}: no embeddings stored")
+        return
+
+    # Stored embeddings double as queries, as searches come from similar texts
+    rng = np.random.default_rng(0)
+    queries = embeddings[rng.choice(len(embeddings), min(args.queries, len(embeddings)), replace=False)]
+    report = evaluate_recall(
+        embeddings, queries, k=args.k, rerank_factor=args.rerank_factor,
+        pq_subvectors=config.VECTOR_INDEX_PQ_SUBVECTORS,
+    )
+    print(f"{args.name}: {len(embeddings)} embeddings, {len(queries)} queries, recall@{args.k}")
+    print(f"{'quantization':<14}{'bytes/vector':>14}{'recall':>10}{'re-ranked':>12}")
+    for row in report:
+        print(
+            f"{row['quantization']:<14}{row['bytes_per_vector']:>14}"
+            f"{row['recall']:>10.3f}{row['recall_reranked']:>12.3f}"
+        )
+
+
+def reembed(args):
+    names = list(db.VECTOR_INDEXES) if args.name == "all" else [args.name]
+    for name in names:
+        counts = db.reembed_vectors(name, args.source, args.batch_size)
+        if counts is None:
+            print("Database connection is not available")
+            return
+        print(
+            f"{name}: re-embedded {counts['reembedded']} at {config.EMBEDDING_DIMENSIONS} "
+            f"dimensions, skipped {counts['skipped']}, {counts['failed']} failed"
+        )
+    print("Run ensure-indexes to update the Atlas vector search index to the new size")
+
+
+def ensure_indexes(args):
+    if not db.ensure_search_indexes():
+        print("Database connection is not available")
+        return
+    print("Search indexes are in place")
+
+
+def index_duplicates(args):
+    counts = db.index_duplicate_reports(args.rebuild, args.batch_size)
+    if counts is None:
+        print("Database connection is not available")
+        return
+    print(
+        f"Indexed {counts['indexed']} complaints, {counts['duplicates']} flagged as duplicates, "
+        f"{counts['cleared']} no longer duplicates"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser(
+        "build-index", help="build a local ANN index over stored embeddings"
+    )
+    build_parser.add_argument("name", choices=[*db.VECTOR_INDEXES, "all"])
+    build_parser.set_defaults(func=build_index)
+
+    ingest_parser = subparsers.add_parser(
+        "ingest-docs", help="embed every file in a directory into doc_embedding"
+    )
+    ingest_parser.add_argument("directory")
+    ingest_parser.add_argument("--batch-size", type=int, help="texts per embedding request")
+    ingest_parser.add_argument("--concurrency", type=int, help="requests in flight per stage")
+    ingest_parser.set_defaults(func=ingest_docs)
+
+    migrate_parser = subparsers.add_parser(
+        "migrate-embeddings", help="rewrite pickled document embeddings as packed vectors"
+    )
+    migrate_parser.add_argument("--dtype", choices=["float32", "float16"])
+    migrate_parser.add_argument("--batch-size", type=int, default=1000)
+    migrate_parser.set_defaults(func=migrate_embeddings)
+
+    evaluate_parser = subparsers.add_parser(
+        "evaluate-quantization", help="report memory and recall of quantized embeddings"
+    )
+    evaluate_parser.add_argument("name", choices=list(db.VECTOR_INDEXES))
+    evaluate_parser.add_argument("--queries", type=int, default=100)
+    evaluate_parser.add_argument("--k", type=int, default=10)
+    evaluate_parser.add_argument(
+        "--rerank-factor", type=int, default=config.VECTOR_INDEX_RERANK_FACTOR
+    )
+    evaluate_parser.set_defaults(func=evaluate_quantization)
+
+    reembed_parser = subparsers.add_parser(
+        "reembed", help="rewrite stored embeddings at EMBEDDING_DIMENSIONS"
+    )
+    reembed_parser.add_argument("name", choices=[*db.VECTOR_INDEXES, "all"])
+    reembed_parser.add_argument(
+        "--source", choices=["truncate", "text"], default="truncate",
+        help="truncate stored vectors, or embed the stored text again "
+             "(documents keep only a 500-character preview)",
+    )
+    reembed_parser.add_argument("--batch-size", type=int, default=1000)
+    reembed_parser.set_defaults(func=reembed)
+
+    indexes_parser = subparsers.add_parser(
+        "ensure-indexes", help="create the 2dsphere and vector search indexes on complains2"
+    )
+    indexes_parser.set_defaults(func=ensure_indexes)
+
+    duplicates_parser = subparsers.add_parser(
+        "index-duplicates", help="add duplicate signatures to complaints and flag existing copies"
+    )
+    duplicates_parser.add_argument(
+        "--rebuild", action="store_true", help="recompute every signature, e.g. after changing its size"
+    )
+    duplicates_parser.add_argument("--batch-size", type=int, default=1000)
+    duplicates_parser.set_defaults(func=index_duplicates)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
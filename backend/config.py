@@ -0,0 +1,113 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Steganography output
+# zlib level used when serializing encoded images to PNG: 0 is fastest, 9 is smallest
+PNG_COMPRESS_LEVEL = int(os.getenv("PNG_COMPRESS_LEVEL", "6"))
+# Directory for encoded images when a request opts in to saving them
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "output")
+
+# Image worker pool
+# Processes for CPU-bound image work; 0 runs it on a single background thread instead
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(os.cpu_count() or 1)))
+# Tasks that may wait for a free worker before requests are rejected with 503
+IMAGE_QUEUE_SIZE = int(os.getenv("IMAGE_QUEUE_SIZE", "32"))
+# Seconds a request waits for its image task before it is answered with 504
+IMAGE_TASK_TIMEOUT = float(os.getenv("IMAGE_TASK_TIMEOUT", "30"))
+# Images accepted by a single batch request, counting those inside zip archives
+MAX_BATCH_IMAGES = int(os.getenv("MAX_BATCH_IMAGES", "256"))
+# Total bytes of the images in a batch request, after extracting zip archives
+MAX_BATCH_BYTES = int(os.getenv("MAX_BATCH_BYTES", str(512 << 20)))
+
+# Result cache for /encode and /decode
+# Bytes of results kept in memory per process; 0 disables the memory tier
+RESULT_CACHE_MEMORY_BYTES = int(os.getenv("RESULT_CACHE_MEMORY_BYTES", str(64 << 20)))
+# Bytes of results kept on disk and shared between processes; 0 disables the disk tier
+RESULT_CACHE_DISK_BYTES = int(os.getenv("RESULT_CACHE_DISK_BYTES", str(512 << 20)))
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join("cache", "results"))
+
+# Embedding cache in front of the Gemini embedding API
+# Bytes of embeddings kept in memory per process; 0 disables the memory tier
+EMBEDDING_CACHE_MEMORY_BYTES = int(os.getenv("EMBEDDING_CACHE_MEMORY_BYTES", str(16 << 20)))
+# Bytes of embeddings kept on disk and shared between processes; 0 disables the disk tier
+EMBEDDING_CACHE_DISK_BYTES = int(os.getenv("EMBEDDING_CACHE_DISK_BYTES", str(256 << 20)))
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", os.path.join("cache", "embeddings"))
+# Seconds before a cached embedding is fetched again, e.g. after a model update
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", str(30 * 24 * 3600)))
+# Components kept per embedding, e.g. 256 or 384 to shrink storage and search; at most 768.
+# Changing it requires `python -m backend.cli reembed` and `ensure-indexes` afterwards
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "768"))
+# Embedding backend: "gemini" (remote API), "hashing" (local, no model files) or "onnx"
+# (local model). Vectors from different backends are not comparable, so switching
+# requires `python -m backend.cli reembed all --source text`
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "gemini")
+# Directory holding model.onnx and tokenizer.json for the "onnx" backend
+EMBEDDING_ONNX_MODEL_DIR = os.getenv("EMBEDDING_ONNX_MODEL_DIR", os.path.join("models", "embedding"))
+# Texts sent per embedding API request; the Gemini API accepts at most 100
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+# Embedding requests and Mongo writes each kept in flight during document ingestion
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "4"))
+# Storage format of document embeddings: "float32", or "float16" at half the size
+EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "float32")
+
+# Documents fetched per round trip, and scored together, by exact similarity scans
+SCAN_BATCH_SIZE = int(os.getenv("SCAN_BATCH_SIZE", "2000"))
+
+# Atlas vector search
+# Name of the $vectorSearch index on complains2.culprit_embedding
+VECTOR_SEARCH_INDEX = os.getenv("VECTOR_SEARCH_INDEX", "culpritIndex2")
+# Default candidates the approximate search considers; raised to at least the results asked for
+VECTOR_SEARCH_CANDIDATES = int(os.getenv("VECTOR_SEARCH_CANDIDATES", "100"))
+# Ceiling for the candidate count when ambiguous matches widen the search;
+# equal to VECTOR_SEARCH_CANDIDATES disables widening
+VECTOR_SEARCH_MAX_CANDIDATES = int(os.getenv("VECTOR_SEARCH_MAX_CANDIDATES", "1600"))
+# Matches fetched per result asked for and re-ranked exactly on their stored vectors
+VECTOR_SEARCH_RERANK_FACTOR = int(os.getenv("VECTOR_SEARCH_RERANK_FACTOR", "4"))
+# Exact score gap between the last result and the next match below which the candidates
+# are doubled; scores span about 0.07 for unit vectors of 768 dimensions
+VECTOR_SEARCH_SCORE_GAP = float(os.getenv("VECTOR_SEARCH_SCORE_GAP", "0.002"))
+# Fraction of searches repeated as an exact scan to log their true recall; 0 disables
+VECTOR_SEARCH_RECALL_SAMPLE_RATE = float(os.getenv("VECTOR_SEARCH_RECALL_SAMPLE_RATE", "0"))
+# Most _ids a geo radius may resolve to before /find-match scores its matches with a
+# filtered scan instead; the ids travel as one $in list inside the 16 MB BSON limit
+VECTOR_SEARCH_MAX_GEO_IDS = int(os.getenv("VECTOR_SEARCH_MAX_GEO_IDS", "100000"))
+# Largest k accepted by /find-match
+MAX_MATCH_RESULTS = int(os.getenv("MAX_MATCH_RESULTS", "100"))
+
+# Local vector indexes for similarity search
+# Directory holding the memory-mapped index snapshots built with `python -m backend.cli build-index`
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", os.path.join("cache", "indexes"))
+# k-means lists per index; 0 picks about sqrt(number of embeddings)
+VECTOR_INDEX_LISTS = int(os.getenv("VECTOR_INDEX_LISTS", "0"))
+# Lists scanned per query: higher improves recall, lower improves latency
+VECTOR_INDEX_PROBES = int(os.getenv("VECTOR_INDEX_PROBES", "8"))
+# Compressed codes kept in memory instead of float vectors: "", "int8" (4x) or "pq" (~30x)
+VECTOR_INDEX_QUANTIZATION = os.getenv("VECTOR_INDEX_QUANTIZATION", "")
+# Bytes per vector with "pq"; must divide the embedding size, 0 uses one byte per 8 dimensions
+VECTOR_INDEX_PQ_SUBVECTORS = int(os.getenv("VECTOR_INDEX_PQ_SUBVECTORS", "0"))
+# Quantized searches fetch this many times more candidates for the exact re-rank
+VECTOR_INDEX_RERANK_FACTOR = int(os.getenv("VECTOR_INDEX_RERANK_FACTOR", "4"))
+# ...and candidates down to this far below the score threshold
+VECTOR_INDEX_RERANK_MARGIN = float(os.getenv("VECTOR_INDEX_RERANK_MARGIN", "0.01"))
+# Documents inserted, updated or deleted since the snapshot that trigger a rebuild merging them in
+VECTOR_SNAPSHOT_MERGE_SIZE = int(os.getenv("VECTOR_SNAPSHOT_MERGE_SIZE", "1000"))
+# Seconds between checks for a merge in each server process; 0 disables the checks
+VECTOR_SNAPSHOT_MERGE_INTERVAL = float(os.getenv("VECTOR_SNAPSHOT_MERGE_INTERVAL", "300"))
+# Follow collection change streams so writes from other processes are searchable within seconds
+VECTOR_CHANGE_STREAMS = os.getenv("VECTOR_CHANGE_STREAMS", "true").lower() == "true"
+# Seconds to wait before reopening a change stream that failed
+VECTOR_CHANGE_STREAM_RETRY = float(os.getenv("VECTOR_CHANGE_STREAM_RETRY", "5"))
+
+# Near-duplicate complaint detection
+# Estimated share of common text shingles at which a new complaint counts as a copy
+DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", "0.8"))
+# "flag" stores copies with duplicate_of set and keeps them out of vector search,
+# "merge" appends them to the original complaint instead of storing them
+DUPLICATE_ACTION = os.getenv("DUPLICATE_ACTION", "flag")
+# MinHash signature entries and LSH band size; changing either requires
+# `python -m backend.cli index-duplicates --rebuild`
+DUPLICATE_PERMUTATIONS = int(os.getenv("DUPLICATE_PERMUTATIONS", "128"))
+DUPLICATE_BAND_ROWS = int(os.getenv("DUPLICATE_BAND_ROWS", "8"))
@@ -1,12 +1,43 @@
+import fcntl
+import heapq
 import os
-import pickle
 import logging  
-from bson import Binary
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from bson import ObjectId
 from dotenv import load_dotenv
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError, OperationFailure, PyMongoError
+from pymongo.operations import UpdateOne
 from pymongo.operations import SearchIndexModel
 
-from backend.utils.embedding import generate_text_embedding, compute_similarity
+from backend import config
+from backend.utils.dedup import (
+    MinHasher,
+    estimated_similarity,
+    pack_signature,
+    unpack_signature,
+)
+from backend.utils.embedding import (
+    exact_similarity_scores,
+    fit_dimensions,
+    generate_text_embedding,
+    generate_text_embeddings,
+    similarity_percentages,
+    similarity_scores,
+)
+from backend.utils.vector_codec import (
+    is_packed_embedding,
+    pack_embedding,
+    unpack_embedding,
+    unpickle_legacy_embedding,
+)
+from backend.utils.vector_index import DeltaSegment, IVFIndex
 from backend.logger import CustomFormatter
 
 load_dotenv()
@@ -15,6 +46,36 @@ print("MONGO_ENDPOINT:", os.getenv("MONGO_ENDPOINT"))
 # Initialize db_client as None globally to cache the connection
 db_client = None
 
+# Local ANN indexes by name: (collection, embedding field) they are built from
+VECTOR_INDEXES = {
+    "culprits": ("complains2", "culprit_embedding"),
+    "documents": ("doc_embedding", "embedding"),
+}
+# Text each index's embeddings were generated from, for re-embedding
+EMBEDDED_TEXT_FIELDS = {"culprits": "culprit", "documents": "content"}
+# Loaded index snapshots by name
+_vector_indexes = {}
+# Delta segments by name: the snapshot they extend, the segment and the newest _id polled
+_vector_deltas = {}
+_vector_deltas_lock = threading.Lock()
+# Indexes followed by a change stream, which makes polling for inserts unnecessary
+_watched_indexes = set()
+_watcher_threads = {}
+# Server error code for $changeStream on a standalone mongod
+_CHANGE_STREAMS_UNSUPPORTED = 40573
+# Mean Earth radius, converting geo search radii to the radians $centerSphere takes
+EARTH_RADIUS_KM = 6378.1
+# Complaint fields compared when looking for resubmitted reports
+DUPLICATE_TEXT_FIELDS = ("name", "location", "culprit", "relationship_to_culprit", "other_info")
+# Fields copied into the original when a resubmitted report is merged into it
+REPORT_FIELDS = ("name", "location", "contact_info", "severity", "culprit",
+                 "relationship_to_culprit", "other_info")
+# Bookkeeping fields left out of duplicate cluster responses
+_DUPLICATE_HIDDEN_FIELDS = {"minhash": 0, "lsh_bands": 0, "culprit_embedding": 0}
+# Duplicate detection fields, binary and internal, never returned by similarity searches
+_SEARCH_HIDDEN_FIELDS = {"minhash": 0, "lsh_bands": 0}
+_minhasher = None
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 handler = logging.StreamHandler()
@@ -37,6 +98,18 @@ def get_database():
             return None
     return db_client["SheBuilds"]
 
+def geo_point(location):
+    """
+    GeoJSON point for a {"lat": ..., "lng": ...} location, as indexed by the
+    2dsphere index on location_point; None for anything else.
+    """
+    if not isinstance(location, dict):
+        return None
+    lat, lng = location.get("lat"), location.get("lng")
+    if not all(isinstance(value, (int, float)) for value in (lat, lng)):
+        return None
+    return {"type": "Point", "coordinates": [lng, lat]}
+
 def insert_data_into_db(
     name, location, contact_info, severity, culprit, relationship_to_culprit, other_info
 ):
@@ -60,9 +133,37 @@ def insert_data_into_db(
         "other_info": other_info,
         "status": "Pending",
     }
-    
-    # Generate embedding for culprit description
-    culprit_embedding = generate_text_embedding(culprit)
+    point = geo_point(location)
+    if point:
+        document["location_point"] = point
+
+    minhasher = get_minhasher()
+    signature = minhasher.signature(report_text(document))
+    document["minhash"] = pack_signature(signature)
+    document["lsh_bands"] = minhasher.band_keys(signature)
+    try:
+        duplicate = find_duplicate_report(collection, signature, document["lsh_bands"])
+    except PyMongoError as e:
+        logger.error(f"Error looking for duplicate reports: {e}")
+        duplicate = None
+    if duplicate is not None:
+        original_id, score = duplicate
+        logger.info(f"Report is a near-duplicate ({score:.2f}) of {original_id}")
+        if config.DUPLICATE_ACTION == "merge":
+            try:
+                collection.update_one({"_id": original_id}, {
+                    "$inc": {"report_count": 1},
+                    "$push": {"duplicate_reports": {field: document[field] for field in REPORT_FIELDS}},
+                })
+                return original_id
+            except Exception as e:
+                logger.error(f"Error merging duplicate report: {e}")
+                return None
+        document["duplicate_of"] = original_id
+        document["duplicate_score"] = score
+
+    # Generate embedding for culprit description; copies stay out of vector search
+    culprit_embedding = None if duplicate else generate_text_embedding(culprit)
     if culprit_embedding:
         document["culprit_embedding"] = culprit_embedding
     
@@ -70,14 +171,545 @@ def insert_data_into_db(
         # Insert the document into the collection
         result = collection.insert_one(document)
         logger.info(f"Inserted document with ID: {result.inserted_id}")
+        if culprit_embedding:
+            record_vector_changes("culprits", upserts=[(result.inserted_id, culprit_embedding)])
         return result.inserted_id
     except Exception as e:
         logger.error(f"Error inserting data: {e}")
         return None
 
-def find_similar_culprits(query_text, threshold=0.7):
+def get_minhasher():
+    """MinHasher for the configured signature size, created once per process."""
+    global _minhasher
+    settings = (config.DUPLICATE_PERMUTATIONS, config.DUPLICATE_BAND_ROWS)
+    if _minhasher is None or (_minhasher.num_perm, _minhasher.band_rows) != settings:
+        _minhasher = MinHasher(*settings)
+    return _minhasher
+
+def report_text(document):
+    """The text of a complaint that is compared when looking for duplicates."""
+    return "\n".join(
+        str(document[field]) for field in DUPLICATE_TEXT_FIELDS if document.get(field)
+    )
+
+def find_duplicate_report(collection, signature, band_keys, before=None):
+    """
+    Find the closest near-duplicate of a report among complaints sharing an
+    LSH band with it, read through the multikey index on lsh_bands instead of
+    comparing against the whole collection. `before` limits the search to
+    older _ids. Returns (original _id, estimated similarity) for the best
+    match at or above DUPLICATE_THRESHOLD, or None.
+    """
+    query = {"lsh_bands": {"$in": band_keys}}
+    if before is not None:
+        query["_id"] = {"$lt": before}
+    best = None
+    for doc in collection.find(query, {"minhash": 1, "duplicate_of": 1}):
+        stored = unpack_signature(doc["minhash"])
+        # Signatures made with other settings are not comparable
+        if len(stored) != len(signature):
+            continue
+        score = estimated_similarity(signature, stored)
+        if score >= config.DUPLICATE_THRESHOLD and (best is None or score > best[1]):
+            best = (doc.get("duplicate_of", doc["_id"]), score)
+    return best
+
+def find_duplicate_cluster(report_id):
+    """
+    Return the complaint `report_id` together with every report flagged as
+    a near-duplicate of the same original, original first. Returns None if
+    the complaint does not exist or the database is unavailable.
+    """
+    db = get_database()
+    if db is None:
+        return None
+
+    collection = db["complains2"]
+    report = collection.find_one({"_id": report_id}, {"duplicate_of": 1})
+    if report is None:
+        return None
+    original_id = report.get("duplicate_of", report_id)
+    return list(collection.find(
+        {"$or": [{"_id": original_id}, {"duplicate_of": original_id}]}, _DUPLICATE_HIDDEN_FIELDS
+    ).sort("_id", 1))
+
+def index_duplicate_reports(rebuild=False, batch_size=1000):
+    """
+    Add MinHash signatures and LSH band keys to complaints stored without
+    them, or to every complaint with `rebuild`, in _id order, flagging each
+    one that is a near-duplicate of an older complaint. Flagged copies lose
+    their culprit_embedding so they stay out of vector search, as they do
+    when inserted. Complaints flagged before that no longer match are
+    unflagged and embedded again. Returns the counts.
+    """
+    db = get_database()
+    if db is None:
+        return None
+
+    collection = db["complains2"]
+    minhasher = get_minhasher()
+    counts = {"indexed": 0, "duplicates": 0, "cleared": 0}
+    # (_id, fields to set, fields to unset, culprit to embed or None)
+    updates = []
+    # Reports of the current batch, not yet written, so copies within it are found too
+    pending = []
+
+    def flush():
+        if not updates:
+            return
+        texts = [culprit for _, _, _, culprit in updates if culprit is not None]
+        embeddings = []
+        if texts:
+            try:
+                embeddings = generate_text_embeddings(texts)
+            except Exception as e:
+                logger.error(f"Error embedding {len(texts)} unflagged complaints: {e}")
+        embeddings = iter(embeddings)
+        requests, upserts, deletes = [], [], []
+        for id_, fields, unset, culprit in updates:
+            embedding = next(embeddings, None) if culprit is not None else None
+            if embedding:
+                fields["culprit_embedding"] = embedding
+                upserts.append((id_, embedding))
+            if "culprit_embedding" in unset:
+                deletes.append(id_)
+            update = {"$set": fields}
+            if unset:
+                update["$unset"] = dict.fromkeys(unset, "")
+            requests.append(UpdateOne({"_id": id_}, update))
+        collection.bulk_write(requests, ordered=False)
+        record_vector_changes("culprits", upserts=upserts, deletes=deletes)
+        counts["indexed"] += len(updates)
+        updates.clear()
+        pending.clear()
+
+    query = {} if rebuild else {"minhash": {"$exists": False}}
+    for doc in collection.find(query).sort("_id", 1):
+        signature = minhasher.signature(report_text(doc))
+        fields = {"minhash": pack_signature(signature), "lsh_bands": minhasher.band_keys(signature)}
+        unset, culprit = [], None
+        duplicate = find_duplicate_report(collection, signature, fields["lsh_bands"], before=doc["_id"])
+        for other_signature, original_id in pending:
+            score = estimated_similarity(signature, other_signature)
+            if score >= config.DUPLICATE_THRESHOLD and (duplicate is None or score > duplicate[1]):
+                duplicate = (original_id, score)
+        if duplicate is not None:
+            fields["duplicate_of"], fields["duplicate_score"] = duplicate
+            counts["duplicates"] += 1
+            if "culprit_embedding" in doc:
+                unset.append("culprit_embedding")
+        elif "duplicate_of" in doc:
+            unset += ["duplicate_of", "duplicate_score"]
+            counts["cleared"] += 1
+            if "culprit_embedding" not in doc and doc.get("culprit"):
+                culprit = doc["culprit"]
+        pending.append((signature, fields.get("duplicate_of", doc["_id"])))
+        updates.append((doc["_id"], fields, unset, culprit))
+        if len(updates) >= batch_size:
+            flush()
+    flush()
+
+    logger.info(
+        f"Indexed {counts['indexed']} complaints for duplicates, {counts['duplicates']} flagged, "
+        f"{counts['cleared']} unflagged"
+    )
+    return counts
+
+def rank_by_similarity(query_embedding, documents, embeddings, threshold=None, k=None):
+    """
+    Score all embeddings against the query exactly in one vectorized call and
+    return the documents scoring at least `threshold`, best first, with a
+    similarity_score.
+    At most `k` documents are returned when it is given.
+    """
+    if not documents:
+        return []
+
+    scores = exact_similarity_scores(query_embedding, embeddings)
+    ranked = []
+    for index in np.argsort(-scores, kind="stable")[:k]:
+        if threshold is not None and scores[index] < threshold:
+            break
+        documents[index]["similarity_score"] = float(scores[index])
+        ranked.append(documents[index])
+    return ranked
+
+def decode_embedding(value):
+    """
+    Decode an embedding as stored in MongoDB: culprit embeddings are plain
+    arrays, document embeddings are packed vectors, or pickled lists in
+    documents not yet migrated with `python -m backend.cli migrate-embeddings`.
+    """
+    if is_packed_embedding(value):
+        return unpack_embedding(value)
+    if isinstance(value, bytes):
+        return unpickle_legacy_embedding(value)
+    return value
+
+def stored_embedding(value):
+    """
+    Decode a stored embedding for scoring against new queries. Vectors stored
+    before EMBEDDING_DIMENSIONS was lowered are truncated and re-normalized
+    the same way new embeddings are, until `reembed` rewrites them.
+    """
+    embedding = decode_embedding(value)
+    if len(embedding) > config.EMBEDDING_DIMENSIONS:
+        return fit_dimensions(embedding)
+    return embedding
+
+def scan_top_matches(collection, field, query_embedding, threshold=None, k=None,
+                     query=None, projection=None):
+    """
+    Exact similarity search over every document matching `query` without
+    loading whole documents. Only _id and `field` are streamed, in batches of
+    SCAN_BATCH_SIZE that are scored together; a heap keeps the best `k` hits
+    scoring at least `threshold`. The winners are scored again exactly, then
+    fetched with one $in query, using `projection`, and returned best first
+    with a similarity_score.
+    """
+    projection = _SEARCH_HIDDEN_FIELDS if projection is None else projection
+    batch_size = config.SCAN_BATCH_SIZE
+    cursor = collection.find({**(query or {}), field: {"$exists": True}}, {field: 1})
+    # (score, -position, _id, embedding): the weakest hit, latest on ties, is evicted first
+    best = []
+    position = 0
+
+    def score_block(ids, embeddings):
+        scores = similarity_scores(query_embedding, np.asarray(embeddings, dtype=np.float32))
+        rows = np.arange(len(scores))
+        if threshold is not None:
+            rows = rows[scores[rows] >= threshold]
+        if k is not None and len(rows) > k:
+            rows = rows[np.argpartition(-scores[rows], k - 1)[:k]]
+        for row in rows:
+            hit = (float(scores[row]), -(position + row), ids[row], embeddings[row])
+            if k is None:
+                best.append(hit)
+            elif len(best) < k:
+                heapq.heappush(best, hit)
+            elif hit > best[0]:
+                heapq.heapreplace(best, hit)
+
+    ids, embeddings = [], []
+    for doc in cursor.batch_size(batch_size):
+        ids.append(doc["_id"])
+        embeddings.append(stored_embedding(doc[field]))
+        if len(ids) == batch_size:
+            score_block(ids, embeddings)
+            position += len(ids)
+            ids, embeddings = [], []
+    if ids:
+        score_block(ids, embeddings)
+    if not best:
+        return []
+
+    # The block scores pick the candidates; the ones returned are exact
+    exact = exact_similarity_scores(query_embedding, [embedding for _, _, _, embedding in best])
+    best = sorted(
+        ((float(score), order, id_) for score, (_, order, id_, _) in zip(exact, best)
+         if threshold is None or score >= threshold),
+        reverse=True,
+    )
+    documents = {
+        doc["_id"]: doc
+        for doc in collection.find({"_id": {"$in": [id_ for _, _, id_ in best]}}, projection)
+    }
+    ranked = []
+    for score, _, id_ in best:
+        # Skip documents deleted since the scan
+        if id_ in documents:
+            documents[id_]["similarity_score"] = score
+            ranked.append(documents[id_])
+    return ranked
+
+def vector_index_path(name):
+    """Symlink to the current snapshot directory of the local index `name`."""
+    return os.path.join(config.VECTOR_INDEX_DIR, name)
+
+def load_stored_embeddings(name):
+    """
+    Read every embedding behind the local index `name` in _id order.
+    Returns (ids, N x D float32 matrix), or None without a database.
+    """
+    db = get_database()
+    if db is None:
+        return None
+
+    collection_name, field = VECTOR_INDEXES[name]
+    ids, embeddings = [], []
+    cursor = db[collection_name].find({field: {"$exists": True}}, {field: 1}).sort("_id", 1)
+    for doc in cursor:
+        ids.append(doc["_id"])
+        embeddings.append(stored_embedding(doc[field]))
+    if not embeddings:
+        return ids, np.empty((0, config.EMBEDDING_DIMENSIONS), dtype=np.float32)
+    return ids, np.asarray(embeddings, dtype=np.float32)
+
+def build_vector_index(name):
+    """
+    Build the local ANN index `name` from every stored embedding and save it
+    to VECTOR_INDEX_DIR. The newest _id is recorded so that documents inserted
+    afterwards are still found by an exact scan until the next build.
+    """
+    # Changes from this moment on may be missing from the scan, so they are carried over
+    built_at = time.time()
+    loaded = load_stored_embeddings(name)
+    if loaded is None:
+        return None
+
+    ids, embeddings = loaded
+    index = IVFIndex.build(
+        ids,
+        embeddings,
+        n_lists=config.VECTOR_INDEX_LISTS,
+        n_probe=config.VECTOR_INDEX_PROBES,
+        metadata={"last_id": str(ids[-1]) if ids else None, "built_at": built_at},
+        quantization=config.VECTOR_INDEX_QUANTIZATION or None,
+        pq_subvectors=config.VECTOR_INDEX_PQ_SUBVECTORS,
+        rerank_factor=config.VECTOR_INDEX_RERANK_FACTOR,
+        rerank_margin=config.VECTOR_INDEX_RERANK_MARGIN,
+    )
+    path = vector_index_path(name)
+    index.save(path)
+    # Serve the memory-mapped snapshot, shared with other workers, rather than the built copy
+    index = IVFIndex.load(path, n_probe=config.VECTOR_INDEX_PROBES)
+    _vector_indexes[name] = index
+    logger.info(f"Saved {name} snapshot with {len(index)} embeddings to {index.path}")
+    return index
+
+def get_vector_index(name):
+    """
+    Return the memory-mapped snapshot of index `name`, or None if it has not
+    been built. A new snapshot is mapped as soon as a rebuild switches to it.
+    """
+    path = vector_index_path(name)
+    if not os.path.exists(path):
+        return None
+
+    index = _vector_indexes.get(name)
+    if index is None or index.path != os.path.realpath(path):
+        try:
+            index = IVFIndex.load(path, n_probe=config.VECTOR_INDEX_PROBES)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Error loading {name} index from {path}: {e}")
+            return None
+        _vector_indexes[name] = index
+    return index
+
+def vector_delta(name, index):
+    """
+    Return the delta segment state extending snapshot `index`. When a new
+    snapshot replaces the old one, changes made while it was being built are
+    carried over, since the build may have read the documents before them.
+    """
+    with _vector_deltas_lock:
+        state = _vector_deltas.get(name)
+        if state is None or state["index"] is not index:
+            delta = DeltaSegment(index.metric)
+            built_at = index.metadata.get("built_at")
+            if state is not None and built_at is not None:
+                for id_, vector, changed_at in state["delta"].changes_since(built_at):
+                    if vector is None:
+                        delta.remove([id_], changed_at)
+                    else:
+                        delta.upsert([id_], [vector], changed_at)
+            state = {"index": index, "delta": delta, "last_id": index.metadata.get("last_id")}
+            _vector_deltas[name] = state
+        return state
+
+def refresh_vector_delta(name, index):
+    """
+    Return the delta segment of index `name`. Unless a change stream is
+    following the collection, first poll for documents inserted by other
+    processes, fetching only those newer than the last _id seen.
+    """
+    state = vector_delta(name, index)
+    if name in _watched_indexes:
+        return state["delta"]
+
+    collection_name, field = VECTOR_INDEXES[name]
+    newer_filter = {field: {"$exists": True}}
+    if state["last_id"]:
+        newer_filter["_id"] = {"$gt": ObjectId(state["last_id"])}
+    newer = list(get_database()[collection_name].find(newer_filter, {field: 1}).sort("_id", 1))
+    if newer:
+        state["delta"].upsert(
+            [doc["_id"] for doc in newer],
+            [stored_embedding(doc[field]) for doc in newer],
+        )
+        state["last_id"] = str(newer[-1]["_id"])
+    return state["delta"]
+
+def record_vector_changes(name, upserts=(), deletes=()):
+    """
+    Apply (id, embedding) upserts and deleted ids to the delta segment of
+    index `name`, making them searchable immediately. Does nothing when no
+    snapshot of the index exists.
+    """
+    index = get_vector_index(name)
+    if index is None:
+        return
+    delta = vector_delta(name, index)["delta"]
+    if upserts:
+        ids, embeddings = zip(*upserts)
+        delta.upsert(ids, embeddings)
+    if deletes:
+        delta.remove(deletes)
+
+def apply_vector_change(name, change):
+    """Apply one change stream event on the collection behind index `name`."""
+    _, field = VECTOR_INDEXES[name]
+    operation = change["operationType"]
+    id_ = change["documentKey"]["_id"]
+    if operation == "update":
+        description = change.get("updateDescription", {})
+        touched = [*description.get("updatedFields", {}), *description.get("removedFields", [])]
+        # Most updates, such as status changes, leave the embedding alone
+        if not any(path == field or path.startswith(f"{field}.") for path in touched):
+            return
+
+    document = change.get("fullDocument")
+    if operation == "delete" or not document or field not in document:
+        record_vector_changes(name, deletes=[id_])
+    else:
+        record_vector_changes(name, upserts=[(id_, stored_embedding(document[field]))])
+
+def watch_vector_index(name, stop_event):
+    """
+    Follow inserts, updates and deletes on the collection behind index `name`
+    through a change stream until `stop_event` is set, so writes from other
+    processes reach the delta segment within a second. Returns early when the
+    server does not support change streams, e.g. a standalone mongod, leaving
+    refresh_vector_delta to poll for inserts instead.
+    """
+    collection_name, _ = VECTOR_INDEXES[name]
+    pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+    resume_token = None
+    while not stop_event.is_set():
+        db = get_database()
+        if db is None:
+            stop_event.wait(config.VECTOR_CHANGE_STREAM_RETRY)
+            continue
+        try:
+            with db[collection_name].watch(
+                pipeline,
+                full_document="updateLookup",
+                resume_after=resume_token,
+                max_await_time_ms=1000,
+            ) as stream:
+                if resume_token is None:
+                    # Catch up on inserts made before the stream opened
+                    index = get_vector_index(name)
+                    if index is not None:
+                        refresh_vector_delta(name, index)
+                _watched_indexes.add(name)
+                logger.info(f"Following changes to {collection_name} for the {name} index")
+                while not stop_event.is_set():
+                    change = stream.try_next()
+                    if change is not None:
+                        apply_vector_change(name, change)
+                    resume_token = stream.resume_token
+        except OperationFailure as e:
+            _watched_indexes.discard(name)
+            if e.code == _CHANGE_STREAMS_UNSUPPORTED:
+                logger.warning(f"Change streams unavailable for {collection_name}, polling instead")
+                return
+            # The resume point may have left the oplog: start over and catch up by polling
+            logger.error(f"Change stream on {collection_name} failed, restarting: {e}")
+            resume_token = None
+            stop_event.wait(config.VECTOR_CHANGE_STREAM_RETRY)
+        except PyMongoError as e:
+            _watched_indexes.discard(name)
+            logger.error(f"Change stream on {collection_name} failed, retrying: {e}")
+            stop_event.wait(config.VECTOR_CHANGE_STREAM_RETRY)
+    _watched_indexes.discard(name)
+
+def start_vector_watchers(stop_event):
+    """Start a change stream thread for every index with a snapshot that is not yet followed."""
+    for name in VECTOR_INDEXES:
+        thread = _watcher_threads.get(name)
+        if (thread is None or not thread.is_alive()) and get_vector_index(name) is not None:
+            thread = threading.Thread(
+                target=watch_vector_index, args=(name, stop_event),
+                name=f"watch-{name}", daemon=True,
+            )
+            thread.start()
+            _watcher_threads[name] = thread
+
+def merge_vector_index(name, min_delta=None):
+    """
+    Compact index `name`: rebuild its snapshot once the delta segment holds
+    at least `min_delta` inserted, updated or deleted documents. A lock file keeps concurrent workers from
+    merging at the same time; the others skip and pick up the new snapshot.
+    Returns the new index, or None when no merge happened.
+    """
+    min_delta = config.VECTOR_SNAPSHOT_MERGE_SIZE if min_delta is None else min_delta
+    index = get_vector_index(name)
+    if index is None or len(refresh_vector_delta(name, index)) < min_delta:
+        return None
+
+    with open(vector_index_path(name) + ".lock", "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        # Another worker may have merged between our check and taking the lock
+        if os.path.realpath(vector_index_path(name)) != index.path:
+            return None
+        return build_vector_index(name)
+
+def search_vector_index(name, query_embedding, threshold=None, k=None, projection=None):
     """
-    Find similar culprit descriptions using embedding similarity
+    Find documents scoring at least `threshold` through the local ANN index.
+    The snapshot and the delta segment are searched together, skipping
+    snapshot entries the delta has updated or deleted, and at most `k`
+    documents are returned when it is given. Hits are fetched with
+    `projection`. Returns None when no index is available so callers can fall
+    back to a full scan.
+    """
+    index = get_vector_index(name)
+    if index is None:
+        return None
+
+    if index.dimensions != len(query_embedding):
+        logger.warning(
+            f"{name} index has {index.dimensions} dimensions, queries have "
+            f"{len(query_embedding)}; scanning until it is rebuilt"
+        )
+        return None
+
+    collection_name, field = VECTOR_INDEXES[name]
+    collection = get_database()[collection_name]
+    delta = refresh_vector_delta(name, index)
+    # Shadowed and deleted hits are dropped below, so ask the snapshot for a few more
+    snapshot_k = k and k + len(delta)
+    hits = {
+        id_: score
+        for id_, score in index.search(query_embedding, k=snapshot_k, threshold=threshold)
+        if not delta.shadows(id_)
+    }
+    hits.update(delta.search(query_embedding, k=k, threshold=threshold))
+    if k is not None and index.quantizer is None:
+        # A quantized index widened its candidates for the exact re-rank below, which cuts to k
+        hits = dict(sorted(hits.items(), key=lambda hit: hit[1], reverse=True)[:snapshot_k])
+    if projection is None:
+        projection = _SEARCH_HIDDEN_FIELDS
+    elif any(projection.values()):
+        # The exact re-rank below needs the stored vectors
+        projection = {**projection, field: 1}
+    documents = [
+        doc for doc in collection.find({"_id": {"$in": [ObjectId(id_) for id_ in hits]}}, projection)
+        # Skip documents whose embedding was removed since the hit was indexed
+        if field in doc
+    ]
+    # Index scores are float32 and, when quantized, approximate: re-rank on the stored floats
+    embeddings = [stored_embedding(doc[field]) for doc in documents]
+    return rank_by_similarity(query_embedding, documents, embeddings, threshold, k)
+
+def find_similar_culprits(query_text, threshold=0.7, k=config.MAX_MATCH_RESULTS):
+    """
+    Find similar culprit descriptions using embedding similarity, returning
+    at most the `k` best matches
     """
     db = get_database()
     if db is None:
@@ -89,47 +721,254 @@ def find_similar_culprits(query_text, threshold=0.7):
     if not query_embedding:
         return []
 
-    # Find documents and compute similarities
-    similar_documents = []
-    for doc in collection.find({"culprit_embedding": {"$exists": True}}):
-        similarity = compute_similarity(query_embedding, doc["culprit_embedding"])
-        if similarity >= threshold:
-            doc["similarity_score"] = similarity
-            similar_documents.append(doc)
+    indexed = search_vector_index("culprits", query_embedding, threshold, k)
+    if indexed is not None:
+        return indexed
 
-    # Sort by similarity score
-    similar_documents.sort(key=lambda x: x["similarity_score"], reverse=True)
-    return similar_documents
+    return scan_top_matches(collection, "culprit_embedding", query_embedding, threshold, k)
 
-def upload_embeddings_to_mongo(file_contents):
+def upload_embeddings_to_mongo(file_contents, batch_size=None, concurrency=None):
     """
-    Upload document embeddings to MongoDB
+    Upload document embeddings to MongoDB.
+    Contents are embedded in batches of `batch_size` texts, and each embedded
+    batch is written with one unordered insert_many while later batches are
+    still being embedded; up to `concurrency` requests of each kind run at
+    once. Returns per-stage counts and throughput, which are also logged.
     """
     db = get_database()
+    if db is None:
+        return None
+
     collection = db["doc_embedding"]
-    
-    for filename, content in file_contents:
-        # Generate embeddings for the document content
-        embedding = generate_text_embedding(content)
-        
-        if embedding:
-            # Prepare the document to insert into MongoDB
-            doc = {
+    batch_size = batch_size or config.EMBEDDING_BATCH_SIZE
+    concurrency = concurrency or config.INGEST_CONCURRENCY
+    file_contents = list(file_contents)
+    batches = [
+        file_contents[start:start + batch_size]
+        for start in range(0, len(file_contents), batch_size)
+    ]
+    stats = {"files": len(file_contents), "embedded": 0, "inserted": 0, "failed": 0}
+    stage_seconds = {"embed": 0.0, "insert": 0.0}
+    lock = threading.Lock()
+
+    def embed(batch):
+        start = time.perf_counter()
+        try:
+            embeddings = generate_text_embeddings([content for _, content in batch])
+        except Exception as e:
+            logger.error(f"Error embedding {len(batch)} documents: {e}")
+            embeddings = None
+        with lock:
+            stage_seconds["embed"] += time.perf_counter() - start
+            if embeddings is None:
+                stats["failed"] += len(batch)
+                return [], []
+            stats["embedded"] += len(batch)
+        return batch, embeddings
+
+    def insert(batch, embeddings):
+        docs = [
+            {
                 "filename": filename,
-                "embedding": Binary(pickle.dumps(embedding)),
+                "embedding": pack_embedding(embedding, config.EMBEDDING_STORAGE_DTYPE),
                 "content": content[:500],  # Store first 500 chars for preview
             }
+            for (filename, content), embedding in zip(batch, embeddings)
+            if embedding
+        ]
+        if not docs:
+            return
+        start = time.perf_counter()
+        failed_rows = set()
+        try:
+            inserted = len(collection.insert_many(docs, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            inserted = e.details.get("nInserted", 0)
+            failed_rows = {error.get("index") for error in e.details.get("writeErrors", [])}
+            logger.error(f"Error uploading {len(docs) - inserted} of {len(docs)} documents: {e}")
+        except Exception as e:
+            inserted = 0
+            failed_rows = set(range(len(docs)))
+            logger.error(f"Error uploading {len(docs)} documents: {e}")
+        # insert_many sets _id on each document it sends
+        record_vector_changes("documents", upserts=[
+            (doc["_id"], unpack_embedding(doc["embedding"]))
+            for row, doc in enumerate(docs) if row not in failed_rows and "_id" in doc
+        ])
+        with lock:
+            stage_seconds["insert"] += time.perf_counter() - start
+            stats["inserted"] += inserted
+            stats["failed"] += len(docs) - inserted
+
+    run_start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as embedders, ThreadPoolExecutor(concurrency) as writers:
+        pending_embeds = deque()
+        pending_writes = deque()
+        for batch in batches:
+            pending_embeds.append(embedders.submit(embed, batch))
+            # Hand finished batches to the writers, keeping both stages bounded
+            while len(pending_embeds) >= concurrency or (
+                pending_embeds and pending_embeds[0].done()
+            ):
+                pending_writes.append(writers.submit(insert, *pending_embeds.popleft().result()))
+                while len(pending_writes) > concurrency:
+                    pending_writes.popleft().result()
+        for future in pending_embeds:
+            pending_writes.append(writers.submit(insert, *future.result()))
+        for future in pending_writes:
+            future.result()
+
+    stats["seconds"] = time.perf_counter() - run_start
+    for stage, count in (("embed", stats["embedded"]), ("insert", stats["inserted"])):
+        seconds = stage_seconds[stage]
+        stats[f"{stage}_seconds"] = seconds
+        stats[f"{stage}_per_second"] = count / seconds if seconds else 0.0
+    logger.info(
+        f"Ingested {stats['inserted']}/{stats['files']} documents in {stats['seconds']:.2f}s: "
+        f"embedding {stats['embed_per_second']:.1f} docs/s, "
+        f"insert {stats['insert_per_second']:.1f} docs/s, {stats['failed']} failed"
+    )
+    return stats
+
+def migrate_document_embeddings(dtype=None, batch_size=1000):
+    """
+    Rewrite pickled document embeddings as packed vectors with unordered bulk
+    updates of `batch_size` documents. Documents already packed are skipped, so
+    the migration can be re-run after an interruption. Returns the counts.
+    """
+    db = get_database()
+    if db is None:
+        return None
+
+    collection = db["doc_embedding"]
+    dtype = dtype or config.EMBEDDING_STORAGE_DTYPE
+    counts = {"migrated": 0, "skipped": 0, "failed": 0}
+    updates = []
+
+    def flush():
+        if not updates:
+            return
+        try:
+            counts["migrated"] += collection.bulk_write(updates, ordered=False).modified_count
+        except BulkWriteError as e:
+            counts["migrated"] += e.details.get("nModified", 0)
+            counts["failed"] += len(e.details.get("writeErrors", []))
+            logger.error(f"Error migrating embeddings: {e}")
+        updates.clear()
+
+    for doc in collection.find({"embedding": {"$exists": True}}, {"embedding": 1}):
+        value = doc["embedding"]
+        if is_packed_embedding(value) or not isinstance(value, bytes):
+            counts["skipped"] += 1
+            continue
+        try:
+            packed = pack_embedding(unpickle_legacy_embedding(value), dtype)
+        except Exception as e:
+            counts["failed"] += 1
+            logger.error(f"Cannot migrate embedding of {doc['_id']}: {e}")
+            continue
+        updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"embedding": packed}}))
+        if len(updates) >= batch_size:
+            flush()
+    flush()
+
+    logger.info(
+        f"Migrated {counts['migrated']} document embeddings to {dtype}, "
+        f"skipped {counts['skipped']}, {counts['failed']} failed"
+    )
+    return counts
+
+def reembed_vectors(name, source="truncate", batch_size=1000):
+    """
+    Rewrite the embeddings behind index `name` after EMBEDDING_DIMENSIONS or
+    EMBEDDING_BACKEND changed. "truncate" cuts longer vectors down without
+    calling the API, skipping those already at the configured size so the
+    run can be repeated. "text" embeds every stored text again with the
+    current backend, which is needed to grow vectors or switch backends.
+    The local index, if built, is rebuilt afterwards. Returns the counts.
+    """
+    db = get_database()
+    if db is None:
+        return None
 
+    collection_name, field = VECTOR_INDEXES[name]
+    text_field = EMBEDDED_TEXT_FIELDS[name]
+    collection = db[collection_name]
+    dimensions = config.EMBEDDING_DIMENSIONS
+    counts = {"reembedded": 0, "skipped": 0, "failed": 0}
+    # (_id, truncated embedding or text to embed)
+    pending = []
+
+    def stored_value(embedding):
+        if name == "documents":
+            return pack_embedding(embedding, config.EMBEDDING_STORAGE_DTYPE)
+        return [float(value) for value in embedding]
+
+    def flush():
+        if not pending:
+            return
+        ids, values = zip(*pending)
+        pending.clear()
+        if source == "text":
             try:
-                # Insert the document
-                collection.insert_one(doc)
-                logger.info(f"Uploaded {filename} to MongoDB")
+                values = generate_text_embeddings(list(values))
             except Exception as e:
-                logger.error(f"Error uploading {filename}: {e}")
+                counts["failed"] += len(ids)
+                logger.error(f"Error re-embedding {len(ids)} {name}: {e}")
+                return
+        updates = [
+            UpdateOne({"_id": id_}, {"$set": {field: stored_value(embedding)}})
+            for id_, embedding in zip(ids, values)
+        ]
+        try:
+            counts["reembedded"] += collection.bulk_write(updates, ordered=False).modified_count
+        except BulkWriteError as e:
+            counts["reembedded"] += e.details.get("nModified", 0)
+            counts["failed"] += len(e.details.get("writeErrors", []))
+            logger.error(f"Error writing re-embedded {name}: {e}")
 
-def search_similar_documents(query_text, threshold=0.7):
+    for doc in collection.find({field: {"$exists": True}}, {field: 1, text_field: 1}):
+        if source == "text":
+            # Vectors of the right size may still come from another backend
+            if not doc.get(text_field):
+                counts["failed"] += 1
+                logger.error(f"No {text_field} to re-embed for {doc['_id']}")
+                continue
+            pending.append((doc["_id"], doc[text_field]))
+        else:
+            try:
+                embedding = decode_embedding(doc[field])
+            except Exception as e:
+                counts["failed"] += 1
+                logger.error(f"Cannot decode embedding of {doc['_id']}: {e}")
+                continue
+            if len(embedding) == dimensions:
+                counts["skipped"] += 1
+                continue
+            if len(embedding) < dimensions:
+                counts["failed"] += 1
+                logger.error(
+                    f"Cannot truncate {len(embedding)}-dimension embedding of {doc['_id']} "
+                    f"to {dimensions} dimensions; re-embed it from text"
+                )
+                continue
+            pending.append((doc["_id"], fit_dimensions(embedding, dimensions)))
+        if len(pending) >= batch_size:
+            flush()
+    flush()
+
+    logger.info(
+        f"Re-embedded {counts['reembedded']} {name} at {dimensions} dimensions by {source}, "
+        f"skipped {counts['skipped']}, {counts['failed']} failed"
+    )
+    if get_vector_index(name) is not None:
+        build_vector_index(name)
+    return counts
+
+def search_similar_documents(query_text, threshold=0.7, k=config.MAX_MATCH_RESULTS):
     """
-    Search for similar documents using embedding similarity
+    Search for similar documents using embedding similarity, returning at
+    most the `k` best matches
     """
     db = get_database()
     if db is None:
@@ -141,16 +980,202 @@ def search_similar_documents(query_text, threshold=0.7):
     if not query_embedding:
         return []
 
-    similar_docs = []
-    for doc in collection.find():
-        stored_embedding = pickle.loads(doc["embedding"])
-        similarity = compute_similarity(query_embedding, stored_embedding)
-        if similarity >= threshold:
-            doc["similarity_score"] = similarity
-            similar_docs.append(doc)
+    indexed = search_vector_index("documents", query_embedding, threshold, k)
+    if indexed is not None:
+        return indexed
+
+    return scan_top_matches(collection, "embedding", query_embedding, threshold, k)
+
+def ensure_search_indexes(collection_name="complains2"):
+    """
+    Create the indexes filtered vector search relies on: a 2dsphere index on
+    location_point, backfilled from lat/lng locations, and the Atlas vector
+    search index with status, severity and _id as pre-filter fields. The
+    Atlas index is skipped with a warning on servers without Atlas Search.
+    Also indexes lsh_bands and duplicate_of for near-duplicate lookups.
+    """
+    db = get_database()
+    if db is None:
+        return False
+
+    collection = db[collection_name]
+    collection.update_many(
+        {"location.lat": {"$type": "number"}, "location.lng": {"$type": "number"},
+         "location_point": None},
+        [{"$set": {"location_point": {"type": "Point", "coordinates": ["$location.lng", "$location.lat"]}}}],
+    )
+    collection.create_index([("location_point", "2dsphere")])
+    collection.create_index("lsh_bands")
+    collection.create_index("duplicate_of", sparse=True)
+
+    definition = {
+        "fields": [
+            {
+                "type": "vector",
+                "path": "culprit_embedding",
+                "numDimensions": config.EMBEDDING_DIMENSIONS,
+                "similarity": "euclidean",
+            },
+            {"type": "filter", "path": "status"},
+            {"type": "filter", "path": "severity"},
+            {"type": "filter", "path": "_id"},
+        ]
+    }
+    try:
+        existing = {index["name"] for index in collection.list_search_indexes()}
+        if config.VECTOR_SEARCH_INDEX in existing:
+            collection.update_search_index(config.VECTOR_SEARCH_INDEX, definition)
+        else:
+            collection.create_search_index(SearchIndexModel(
+                definition=definition, name=config.VECTOR_SEARCH_INDEX, type="vectorSearch"
+            ))
+    except OperationFailure as e:
+        logger.warning(f"Atlas vector search index not created: {e}")
+    return True
+
+def match_filter(status=None, severity=None, near=None, radius_km=None):
+    """
+    MongoDB query for complaints with the given status and severity and, if
+    `near` is a (lat, lng) pair, a location_point within `radius_km` of it.
+    """
+    query = {}
+    if status is not None:
+        query["status"] = status
+    if severity is not None:
+        query["severity"] = severity
+    if near is not None:
+        lat, lng = near
+        query["location_point"] = {
+            "$geoWithin": {"$centerSphere": [[lng, lat], radius_km / EARTH_RADIUS_KM]}
+        }
+    return query
+
+def find_top_matches(
+    collection, description_embedding, num_results=1, num_candidates=None,
+    status=None, severity=None, near=None, radius_km=None,
+):
+    """
+    Find the `num_results` culprits closest to `description_embedding`.
+    Status and severity go into the $vectorSearch pre-filter. A geo radius
+    cannot, so the 2dsphere index first resolves it to the matching _ids,
+    which are passed on as an _id filter; past VECTOR_SEARCH_MAX_GEO_IDS
+    matches, the filtered documents are scored locally instead. Without
+    Atlas Search the same filter selects the documents scored locally.
+
+    The approximate search fetches VECTOR_SEARCH_RERANK_FACTOR candidates per
+    result, which are re-ranked exactly on their stored vectors. When the
+    last result and the first one left out score within
+    VECTOR_SEARCH_SCORE_GAP of each other, the match is ambiguous and the
+    search is repeated with twice the candidates, up to
+    VECTOR_SEARCH_MAX_CANDIDATES. Every result carries its exact
+    similarity_score and similarity_percentage.
+    """
+    num_candidates = max(num_candidates or config.VECTOR_SEARCH_CANDIDATES, num_results)
+    max_candidates = max(config.VECTOR_SEARCH_MAX_CANDIDATES, num_candidates)
+    query = match_filter(status, severity, near, radius_km)
+    vector_filter = {key: {"$eq": query[key]} for key in ("status", "severity") if key in query}
+    if near is not None:
+        limit = config.VECTOR_SEARCH_MAX_GEO_IDS
+        ids = [doc["_id"] for doc in collection.find(query, {"_id": 1}).limit(limit + 1)]
+        if not ids:
+            return []
+        if len(ids) > limit:
+            logger.info(f"Geo filter matches more than {limit} complaints, scanning them instead")
+            matches = find_top_matches_locally(collection, description_embedding, num_results, query)
+            return add_similarity_percentages(description_embedding, matches)
+        vector_filter["_id"] = {"$in": ids}
+
+    # One more than asked for, to see how close the first excluded match is
+    pool = max(num_results * config.VECTOR_SEARCH_RERANK_FACTOR, num_results + 1)
+    previous = None
+    rounds = 0
+    try:
+        while True:
+            rounds += 1
+            limit = min(pool, num_candidates)
+            vector_search = {
+                "path": "culprit_embedding",
+                "index": config.VECTOR_SEARCH_INDEX,
+                "queryVector": description_embedding,
+                "numCandidates": num_candidates,
+                "limit": limit,
+            }
+            if vector_filter:
+                vector_search["filter"] = vector_filter
+            candidates = list(collection.aggregate([
+                {"$vectorSearch": vector_search},
+                {"$project": {"culprit": 1, "culprit_embedding": 1, "_id": 1}},
+            ]))
+            embeddings = [stored_embedding(doc["culprit_embedding"]) for doc in candidates]
+            ranked = rank_by_similarity(description_embedding, candidates, embeddings)
+            top_ids = [doc["_id"] for doc in ranked[:num_results]]
+            # Fewer candidates than the limit means every filtered match was seen
+            exhausted = len(candidates) < limit
+            gap = (
+                ranked[num_results - 1]["similarity_score"] - ranked[num_results]["similarity_score"]
+                if len(ranked) > num_results else None
+            )
+            if (exhausted or num_candidates >= max_candidates or gap is None
+                    or gap >= config.VECTOR_SEARCH_SCORE_GAP):
+                break
+            previous = top_ids
+            num_candidates = min(num_candidates * 2, max_candidates)
+    except OperationFailure as e:
+        logger.warning(f"$vectorSearch unavailable, searching locally: {e}")
+        matches = find_top_matches_locally(collection, description_embedding, num_results, query)
+        return add_similarity_percentages(description_embedding, matches)
+
+    matches = ranked[:num_results]
+    recall, measured = None, "estimated"
+    if random.random() < config.VECTOR_SEARCH_RECALL_SAMPLE_RATE:
+        exact = scan_top_matches(
+            collection, "culprit_embedding", description_embedding, k=num_results,
+            query=query, projection={"_id": 1},
+        )
+        recall, measured = _overlap(top_ids, [doc["_id"] for doc in exact]), "measured"
+    elif previous is not None:
+        # Share of the previous round's results that survived widening
+        recall = _overlap(previous, top_ids)
+    logger.info(
+        f"find_top_matches: k={num_results} candidates={num_candidates} rounds={rounds} "
+        f"recall={'unknown' if recall is None else f'{recall:.2f} ({measured})'}"
+    )
+    return add_similarity_percentages(description_embedding, matches)
+
+def _overlap(found, expected):
+    """Fraction of `expected` ids present in `found`; 1.0 when nothing was expected."""
+    return len(set(found) & set(expected)) / len(expected) if expected else 1.0
+
+def add_similarity_percentages(query_embedding, matches):
+    """
+    Set similarity_percentage on each match from its stored vector, on the
+    scale of calculate_similarity_percentage.
+    """
+    if not matches:
+        return matches
+    embeddings = [stored_embedding(doc["culprit_embedding"]) for doc in matches]
+    for doc, percentage in zip(matches, similarity_percentages(query_embedding, embeddings)):
+        doc["similarity_percentage"] = float(percentage)
+    return matches
+
+def find_top_matches_locally(collection, description_embedding, num_results, query):
+    """
+    Local fallback for find_top_matches. Unfiltered searches on complains2 use
+    the local index when one is built; otherwise only the documents matching
+    `query` are fetched and scored exactly.
+    """
+    if not query and collection.name == VECTOR_INDEXES["culprits"][0]:
+        matches = search_vector_index(
+            "culprits", description_embedding, k=num_results,
+            projection={"culprit": 1, "culprit_embedding": 1},
+        )
+        if matches is not None:
+            return matches
 
-    similar_docs.sort(key=lambda x: x["similarity_score"], reverse=True)
-    return similar_docs
+    return scan_top_matches(
+        collection, "culprit_embedding", description_embedding, k=num_results,
+        query=query, projection={"culprit": 1, "culprit_embedding": 1},
+    )
 
 # Example usage
 if __name__ == "__main__":
@@ -1,33 +1,63 @@
+import asyncio
+import hashlib
 import logging
-import os
-from typing import Optional
+import threading
+import zipfile
+from typing import List, Optional
+from bson import ObjectId
 # In main.py
 from fastapi import Form
-from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi import FastAPI, File, HTTPException, Query, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
-from backend.db import get_database
+from backend.config import (
+    IMAGE_QUEUE_SIZE,
+    IMAGE_TASK_TIMEOUT,
+    IMAGE_WORKERS,
+    MAX_BATCH_BYTES,
+    MAX_BATCH_IMAGES,
+    MAX_MATCH_RESULTS,
+    OUTPUT_DIR,
+    PNG_COMPRESS_LEVEL,
+    RESULT_CACHE_DIR,
+    RESULT_CACHE_DISK_BYTES,
+    RESULT_CACHE_MEMORY_BYTES,
+    VECTOR_CHANGE_STREAMS,
+    VECTOR_SNAPSHOT_MERGE_INTERVAL,
+)
+from backend.db import (
+    VECTOR_INDEXES,
+    find_duplicate_cluster,
+    find_top_matches,
+    get_database,
+    get_vector_index,
+    merge_vector_index,
+    start_vector_watchers,
+)
 from backend.logger import CustomFormatter
 from backend.schema import FileContent, PostInfo
+from backend.utils.batch import expand_uploads, stream_ndjson, stream_zip
+from backend.utils.cache import ResultCache, cache_key
 from backend.utils.common import (
-    load_image_from_url_or_file,
     read_files_from_directory,
+    save_content_addressed,
     serialize_object_id,
 )
-from backend.utils.embedding import find_top_matches, generate_text_embedding
+from backend.utils.embedding import embedding_cache, generate_text_embedding
 from backend.utils.regex_ptr import extract_info
-from backend.utils.steganography import (
-    decode_text_from_image,
-    encode_text_in_image
-)
 from backend.utils.text_llm import (
     create_poem,
     decompose_user_text,
     expand_user_text_using_gemini,
     expand_user_text_using_gemma,
 )
+from backend.utils.workers import (
+    ImageWorkerPool,
+    decode_image_bytes,
+    encode_image_bytes,
+)
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -50,18 +80,54 @@ app.add_middleware(
 
 # Global variables
 db = None
+image_pool = ImageWorkerPool(IMAGE_WORKERS, IMAGE_QUEUE_SIZE, IMAGE_TASK_TIMEOUT)
+result_cache = ResultCache(
+    RESULT_CACHE_MEMORY_BYTES, RESULT_CACHE_DISK_BYTES, RESULT_CACHE_DIR
+)
+merge_task = None
+watchers_stopped = threading.Event()
+
+async def merge_vector_indexes_periodically():
+    """Fold delta segments into fresh index snapshots once they grow large enough."""
+    while True:
+        await asyncio.sleep(VECTOR_SNAPSHOT_MERGE_INTERVAL)
+        # Indexes built since startup get their change stream here
+        if VECTOR_CHANGE_STREAMS:
+            start_vector_watchers(watchers_stopped)
+        for name in VECTOR_INDEXES:
+            try:
+                await asyncio.to_thread(merge_vector_index, name)
+            except Exception as e:
+                logger.error(f"Failed to merge {name} index: {e}")
 
 # Startup event
 @app.on_event("startup")
 async def startup_event():
-    """Initialize database connection on startup."""
-    global db
+    """Initialize database connection, image worker pool and index snapshots on startup."""
+    global db, merge_task
     try:
         db = get_database()
         logger.info("Successfully initialized database connection")
     except Exception as e:
         logger.error(f"Failed to initialize database: {e}")
         raise
+    image_pool.start()
+    # Snapshots are memory-mapped, so loading them here is cheap and shared between workers
+    for name in VECTOR_INDEXES:
+        get_vector_index(name)
+    if VECTOR_CHANGE_STREAMS:
+        start_vector_watchers(watchers_stopped)
+    if VECTOR_SNAPSHOT_MERGE_INTERVAL > 0:
+        merge_task = asyncio.create_task(merge_vector_indexes_periodically())
+
+# Shutdown event
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the image worker pool, the index merge task and change stream watchers."""
+    image_pool.shutdown()
+    if merge_task is not None:
+        merge_task.cancel()
+    watchers_stopped.set()
 
 
 
@@ -69,49 +135,172 @@ async def startup_event():
 async def encode_text_in_image_endpoint(
     text: str = Form(...), 
     file: UploadFile = File(...),
-    output_filename: str = "encoded_image.png"
+    channels: str = Form("R"),
+    bits_per_channel: int = Form(1),
+    compression: str = Form("auto"),
+    output_filename: str = "encoded_image.png",
+    compress_level: Optional[int] = Query(None, ge=0, le=9),
+    save: bool = False
 ):
     """
-    Encode text into an uploaded image and save locally.
+    Encode text into an uploaded image and return it as a PNG.
     Args:
         text: Text to encode (now received from form data)
         file: Uploaded image file
-        output_filename: Name for the output file
+        channels: Channels carrying the payload, any of "RGBA"
+        bits_per_channel: Low bits used in each channel, 1 or 2
+        compression: Payload codec, one of "auto", "none", "zlib" or "lzma"
+        output_filename: File name suggested to the client
+        compress_level: PNG zlib level (0-9), defaults to PNG_COMPRESS_LEVEL
+        save: Also store the PNG under a content-addressed name in OUTPUT_DIR
     """
     try:
-        image = load_image_from_url_or_file(file=file)
-        encoded_image = encode_text_in_image(image, text)
-        
-        # Ensure output directory exists
-        os.makedirs("output", exist_ok=True)
-        
-        output_path = os.path.join("output", output_filename)
-        encoded_image.save(output_path, format="PNG")
-        
-        return StreamingResponse(
-            open(output_path, "rb"),
-            media_type="image/png",
-            headers={"Content-Disposition": f"attachment; filename={output_filename}"}
+        image_bytes = await file.read()
+        level = PNG_COMPRESS_LEVEL if compress_level is None else compress_level
+        # Identical uploads with identical settings always produce the same PNG
+        key = cache_key(
+            "encode",
+            hashlib.sha256(image_bytes).digest(),
+            text,
+            channels.upper(),
+            bits_per_channel,
+            compression,
+            level,
         )
+        # Cache lookups and writes may touch the disk, so they run off the event loop
+        png_bytes = await asyncio.to_thread(result_cache.get, key)
+        if png_bytes is None:
+            png_bytes = await image_pool.run(
+                encode_image_bytes,
+                image_bytes,
+                text,
+                channels,
+                bits_per_channel,
+                compression,
+                level,
+            )
+            await asyncio.to_thread(result_cache.set, key, png_bytes)
+
+        headers = {"Content-Disposition": f"attachment; filename={output_filename}"}
+        if save:
+            saved_path = save_content_addressed(png_bytes, OUTPUT_DIR, suffix=".png")
+            headers["X-Saved-Path"] = saved_path
+
+        return Response(content=png_bytes, media_type="image/png", headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error encoding text in image: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/decode")
-async def decode_text_from_image_endpoint(file: UploadFile = File(...)):
+async def decode_text_from_image_endpoint(
+    file: UploadFile = File(...),
+    legacy_fallback: bool = True
+):
     """
     Decode text from an uploaded image.
     Args:
         file: Uploaded image file containing hidden text
+        legacy_fallback: Scan for the old end-marker format when no header is found
     """
     try:
-        image = load_image_from_url_or_file(file=file)
-        decoded_text = decode_text_from_image(image)
+        image_bytes = await file.read()
+        key = cache_key("decode", hashlib.sha256(image_bytes).digest(), legacy_fallback)
+        cached = await asyncio.to_thread(result_cache.get, key)
+        if cached is not None:
+            return {"decoded_text": cached.decode("utf-8")}
+
+        decoded_text = await image_pool.run(decode_image_bytes, image_bytes, legacy_fallback)
+        await asyncio.to_thread(result_cache.set, key, decoded_text.encode("utf-8"))
         return {"decoded_text": decoded_text}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error decoding text from image: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/cache-stats")
+async def get_cache_stats():
+    """Hit/miss counters and sizes of the /encode and /decode result cache."""
+    return result_cache.stats()
+
+@app.get("/embedding-cache-stats")
+async def get_embedding_cache_stats():
+    """Hit/miss counters and sizes of the text embedding cache."""
+    return embedding_cache.stats()
+
+async def read_batch_uploads(files: List[UploadFile]):
+    """Read uploaded images and zip archives into a list of (filename, bytes)."""
+    uploads = [(file.filename, await file.read()) for file in files]
+    try:
+        # Decompressing archives is CPU-bound, so it runs off the event loop
+        images = await asyncio.to_thread(expand_uploads, uploads, MAX_BATCH_IMAGES, MAX_BATCH_BYTES)
+    except zipfile.BadZipFile as e:
+        raise HTTPException(status_code=400, detail=f"Invalid zip archive: {e}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not images:
+        raise HTTPException(status_code=400, detail="No images provided")
+    return images
+
+@app.post("/encode-batch")
+async def encode_text_in_images_batch_endpoint(
+    text: str = Form(...),
+    files: List[UploadFile] = File(...),
+    channels: str = Form("R"),
+    bits_per_channel: int = Form(1),
+    compression: str = Form("auto"),
+    compress_level: Optional[int] = Query(None, ge=0, le=9)
+):
+    """
+    Encode the same text into many images and stream back a zip of PNGs.
+    Images are processed in parallel and added to the zip as each finishes;
+    images that fail are listed in errors.json inside the zip.
+    Args:
+        text: Text to encode
+        files: Uploaded images and/or zip archives of images
+        channels: Channels carrying the payload, any of "RGBA"
+        bits_per_channel: Low bits used in each channel, 1 or 2
+        compression: Payload codec, one of "auto", "none", "zlib" or "lzma"
+        compress_level: PNG zlib level (0-9), defaults to PNG_COMPRESS_LEVEL
+    """
+    images = await read_batch_uploads(files)
+    level = PNG_COMPRESS_LEVEL if compress_level is None else compress_level
+    results = image_pool.map_unordered(
+        encode_image_bytes,
+        (
+            (filename, (data, text, channels, bits_per_channel, compression, level))
+            for filename, data in images
+        ),
+    )
+    return StreamingResponse(
+        stream_zip(results),
+        media_type="application/zip",
+        headers={"Content-Disposition": "attachment; filename=encoded_images.zip"},
+    )
+
+@app.post("/decode-batch")
+async def decode_text_from_images_batch_endpoint(
+    files: List[UploadFile] = File(...),
+    legacy_fallback: bool = True
+):
+    """
+    Decode hidden text from many images, streaming one NDJSON line per image
+    as each finishes. Lines carry either "decoded_text" or "error".
+    Args:
+        files: Uploaded images and/or zip archives of images
+        legacy_fallback: Scan for the old end-marker format when no header is found
+    """
+    images = await read_batch_uploads(files)
+    results = image_pool.map_unordered(
+        decode_image_bytes,
+        ((filename, (data, legacy_fallback)) for filename, data in images),
+    )
+    return StreamingResponse(
+        stream_ndjson(results, "decoded_text"), media_type="application/x-ndjson"
+    )
+
 # Text processing endpoints
 @app.post("/text-generation")
 async def get_post_and_expand_its_content(post_info: PostInfo):
@@ -169,12 +358,54 @@ async def get_all_posts():
         logger.error(f"Error retrieving posts: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/duplicates/{report_id}")
+async def get_duplicate_reports(report_id: str):
+    """Return a complaint with its near-duplicate reports, original first."""
+    if not ObjectId.is_valid(report_id):
+        raise HTTPException(status_code=400, detail="Invalid report id")
+    try:
+        cluster = find_duplicate_cluster(ObjectId(report_id))
+    except Exception as e:
+        logger.error(f"Error finding duplicate reports: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if cluster is None:
+        raise HTTPException(status_code=404, detail="Report not found")
+    return [serialize_object_id(report) for report in cluster]
+
 @app.get("/find-match")
-async def find_top_matching_posts(info: str, collection: str):
-    """Find top matches based on embedding similarity."""
+async def find_top_matching_posts(
+    info: str,
+    collection: str,
+    k: int = Query(1, ge=1, le=MAX_MATCH_RESULTS),
+    status: Optional[str] = None,
+    severity: Optional[str] = None,
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lng: Optional[float] = Query(None, ge=-180, le=180),
+    radius_km: Optional[float] = Query(None, gt=0),
+):
+    """
+    Find top matches based on embedding similarity.
+    Args:
+        info: Culprit description to match
+        collection: Collection to search
+        k: Number of matches to return
+        status, severity: Only match complaints with this status or severity
+        lat, lng, radius_km: Only match complaints reported within radius_km of this point
+    """
+    geo = (lat, lng, radius_km)
+    if any(value is not None for value in geo) and None in geo:
+        raise HTTPException(status_code=400, detail="lat, lng and radius_km must be given together")
     try:
         description_vector = generate_text_embedding(info)
-        top_matches = find_top_matches(db[collection], description_vector)
+        top_matches = find_top_matches(
+            db[collection],
+            description_vector,
+            num_results=k,
+            status=status,
+            severity=severity,
+            near=None if lat is None else (lat, lng),
+            radius_km=radius_km,
+        )
         return [serialize_object_id(match) for match in top_matches]
     except Exception as e:
         logger.error(f"Error finding matches: {e}")
@@ -0,0 +1,135 @@
+import threading
+
+import numpy as np
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, OperationFailure
+
+
+def clustered_embeddings(count, dimensions=64, clusters=20, seed=0):
+    """Unit vectors scattered around a few random centres, like real embeddings."""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dimensions))
+    vectors = centres[rng.integers(0, clusters, count)] + 0.3 * rng.normal(size=(count, dimensions))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+class FakeCursor(list):
+    def sort(self, key, direction):
+        return FakeCursor(sorted(self, key=lambda doc: doc[key], reverse=direction < 0))
+
+    def batch_size(self, size):
+        return self
+
+    def limit(self, count):
+        return FakeCursor(self[:count])
+
+
+def matches(doc, query):
+    """Whether `doc` satisfies the subset of the MongoDB query language the code uses."""
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, option) for option in condition):
+                return False
+            continue
+        value = doc.get(key)
+        if not isinstance(condition, dict):
+            if value != condition:
+                return False
+        elif "$exists" in condition and (key in doc) != condition["$exists"]:
+            return False
+        elif "$in" in condition:
+            # Arrays match when any of their elements is listed
+            values = value if isinstance(value, list) else [value]
+            if not any(item in condition["$in"] for item in values):
+                return False
+        elif "$gt" in condition and not (value is not None and value > condition["$gt"]):
+            return False
+        elif "$lt" in condition and not (value is not None and value < condition["$lt"]):
+            return False
+    return True
+
+
+def project(doc, projection):
+    """Apply an inclusion or exclusion projection like MongoDB does."""
+    if not projection:
+        return dict(doc)
+    if any(projection.values()):
+        return {key: value for key, value in doc.items() if key == "_id" or projection.get(key)}
+    return {key: value for key, value in doc.items() if key not in projection}
+
+
+def apply_update(doc, update):
+    for key, value in update.get("$set", {}).items():
+        doc[key] = value
+    for key in update.get("$unset", {}):
+        doc.pop(key, None)
+    for key, value in update.get("$inc", {}).items():
+        doc[key] = doc.get(key, 0) + value
+    for key, value in update.get("$push", {}).items():
+        doc.setdefault(key, []).append(value)
+
+
+class FakeCollection:
+    """
+    The subset of a pymongo collection used by vector search, duplicate
+    detection and ingestion. insert_many fails the documents `reject`
+    returns true for, as a write error would.
+    """
+
+    name = "complains2"
+
+    def __init__(self, docs=None):
+        self.docs = docs or []
+        self.pipelines = []
+        self.projections = []
+        self.insert_calls = 0
+        self.reject = None
+        self._lock = threading.Lock()
+
+    def aggregate(self, pipeline):
+        # A plain mongod has no Atlas Search
+        self.pipelines.append(pipeline)
+        raise OperationFailure("$vectorSearch stage is only allowed on MongoDB Atlas")
+
+    def find(self, query=None, projection=None):
+        self.projections.append(projection)
+        return FakeCursor(project(doc, projection) for doc in self.docs if matches(doc, query or {}))
+
+    def find_one(self, query, projection=None):
+        found = self.find(query, projection)
+        return found[0] if found else None
+
+    def insert(self, **fields):
+        doc = {"_id": ObjectId(), **fields}
+        self.docs.append(doc)
+        return doc
+
+    def insert_one(self, document):
+        document["_id"] = ObjectId()
+        self.docs.append(dict(document))
+        return type("Result", (), {"inserted_id": document["_id"]})()
+
+    def insert_many(self, documents, ordered=True):
+        rejected = []
+        with self._lock:
+            self.insert_calls += 1
+            for row, document in enumerate(documents):
+                document.setdefault("_id", ObjectId())
+                if self.reject is not None and self.reject(document):
+                    rejected.append(row)
+                else:
+                    self.docs.append(dict(document))
+        if rejected:
+            raise BulkWriteError({
+                "nInserted": len(documents) - len(rejected),
+                "writeErrors": [{"index": row} for row in rejected],
+            })
+        return type("Result", (), {"inserted_ids": [document["_id"] for document in documents]})()
+
+    def update_one(self, query, update):
+        apply_update(next(doc for doc in self.docs if matches(doc, query)), update)
+
+    def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            apply_update(next(doc for doc in self.docs if matches(doc, request._filter)), request._doc)
+        return type("Result", (), {"modified_count": len(requests)})()
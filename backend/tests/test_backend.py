@@ -1,6 +1,7 @@
 import os
 import sys
 import logging
+import tempfile
 from pathlib import Path
 import pytest
 import requests
@@ -12,6 +13,7 @@ from dotenv import load_dotenv
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from backend.main import app
+from backend.utils.cache import ResultCache
 from backend.utils.steganography import encode_text_in_image, decode_text_from_image
 
 # Configure logging
@@ -24,8 +26,18 @@ load_dotenv()
 # Create test client
 client = TestClient(app)
 
+
+@pytest.fixture(autouse=True)
+def isolated_result_cache(tmp_path_factory, monkeypatch):
+    """Keep results cached by earlier runs from skipping the worker pool."""
+    import backend.main
+
+    cache = ResultCache(memory_bytes=1 << 20, disk_bytes=1 << 20, directory=str(tmp_path_factory.mktemp("results")))
+    monkeypatch.setattr(backend.main, "result_cache", cache)
+    return cache
+
 # Define a single test image path
-test_image_path = Path("/home/harisudhan/Downloads/OIP.jpeg")  # You can change the extension if needed
+test_image_path = Path(tempfile.gettempdir()) / "steganography_test_image.jpeg"
 
 def create_test_image(filepath):
     """Creates a simple test image."""
@@ -63,6 +75,107 @@ def test_encode_endpoint():
         if img_path.exists():
             img_path.unlink()
 
+def test_encode_endpoint_returns_png_in_memory(tmp_path, monkeypatch):
+    """The encoded PNG is returned directly and only saved to disk on request."""
+    import backend.main
+    from io import BytesIO
+
+    monkeypatch.setattr(backend.main, "OUTPUT_DIR", str(tmp_path))
+    buffer = BytesIO()
+    Image.new('RGB', (100, 100), color='red').save(buffer, format="PNG")
+
+    response = client.post(
+        "/encode",
+        files={"file": ("test.png", buffer.getvalue(), "image/png")},
+        data={"text": "In memory"},
+        params={"compress_level": 1},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    assert decode_text_from_image(Image.open(BytesIO(response.content))) == "In memory"
+    assert list(tmp_path.iterdir()) == []
+
+    response = client.post(
+        "/encode",
+        files={"file": ("test.png", buffer.getvalue(), "image/png")},
+        data={"text": "In memory"},
+        params={"compress_level": 1, "save": True},
+    )
+    saved_path = Path(response.headers["x-saved-path"])
+    assert saved_path.parent == tmp_path
+    assert saved_path.read_bytes() == response.content
+
+    response = client.post(
+        "/encode",
+        files={"file": ("test.png", buffer.getvalue(), "image/png")},
+        data={"text": "In memory"},
+        params={"compress_level": 10},
+    )
+    assert response.status_code == 422
+
+def test_batch_endpoints_round_trip():
+    """Batch-encoded images come back as a zip that batch-decodes, one bad image aside."""
+    import json
+    import zipfile
+    from io import BytesIO
+
+    def png_bytes(color):
+        buffer = BytesIO()
+        Image.new('RGB', (100, 100), color=color).save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    archive = BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("nested/blue.png", png_bytes("blue"))
+    files = [
+        ("files", ("red.png", png_bytes("red"), "image/png")),
+        ("files", ("broken.png", b"not an image", "image/png")),
+        ("files", ("more.zip", archive.getvalue(), "application/zip")),
+    ]
+    response = client.post("/encode-batch", files=files, data={"text": "Batch secret"})
+    assert response.status_code == 200
+    with zipfile.ZipFile(BytesIO(response.content)) as zf:
+        assert sorted(zf.namelist()) == ["blue.png", "errors.json", "red.png"]
+        assert list(json.loads(zf.read("errors.json"))) == ["broken.png"]
+
+    response = client.post(
+        "/decode-batch",
+        files=[("files", ("encoded.zip", response.content, "application/zip"))],
+    )
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    decoded = {line["filename"]: line.get("decoded_text") for line in lines}
+    assert decoded["red.png"] == "Batch secret"
+    assert decoded["blue.png"] == "Batch secret"
+    assert "error" in next(line for line in lines if line["filename"] == "errors.json")
+
+def test_batch_limits_are_checked_before_decompressing(monkeypatch):
+    """Oversized batches are rejected from the zip directory, without reading any entry."""
+    import zipfile
+    from io import BytesIO
+    import backend.main
+
+    archive = BytesIO()
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name in ("a.png", "b.png", "c.png"):
+            zf.writestr(name, bytes(1 << 20))
+
+    def read(*args, **kwargs):
+        raise AssertionError("an archive entry was decompressed")
+
+    monkeypatch.setattr(zipfile.ZipFile, "read", read)
+    files = [("files", ("bomb.zip", archive.getvalue(), "application/zip"))]
+    monkeypatch.setattr(backend.main, "MAX_BATCH_IMAGES", 2)
+    response = client.post("/decode-batch", files=files)
+    assert response.status_code == 400
+    assert "At most 2 images" in response.json()["detail"]
+
+    monkeypatch.setattr(backend.main, "MAX_BATCH_IMAGES", 3)
+    monkeypatch.setattr(backend.main, "MAX_BATCH_BYTES", (3 << 20) - 1)
+    response = client.post("/decode-batch", files=files)
+    assert response.status_code == 400
+    assert "at most" in response.json()["detail"]
+
 def test_decode_endpoint():
     """Test the steganography decode endpoint."""
     # Create and encode a test image
@@ -92,6 +205,15 @@ def test_decode_endpoint():
         if original_img_path.exists():
             original_img_path.unlink() # Ensure original test image is also cleaned up
 
+def test_find_match_requires_complete_geo_filter():
+    """A geo filter needs lat, lng and radius_km together."""
+    response = client.get(
+        "/find-match", params={"info": "tall man", "collection": "complains2", "lat": 12.9}
+    )
+    assert response.status_code == 400
+    response = client.get("/find-match", params={"info": "tall man", "collection": "complains2", "k": 0})
+    assert response.status_code == 422
+
 def test_text_generation():
     """Test the text generation endpoint."""
     test_data = {
@@ -139,4 +261,4 @@ if __name__ == "__main__":
         else:
             logger.info(f"Test {test.__name__} completed successfully")
     
-    logger.info("All tests completed")
\ No newline at end of file
+    logger.info("All tests completed")
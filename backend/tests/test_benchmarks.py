@@ -0,0 +1,38 @@
+import sys
+import tempfile
+from pathlib import Path
+
+# Add the parent directory to Python path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend import config, db
+from backend.benchmarks import vector_search
+
+
+def test_vector_search_benchmark_runs_every_variant(tmp_path, monkeypatch):
+    """A small corpus goes through the scan and every index variant without errors."""
+    # run_size points these at the benchmark corpus; restore them afterwards
+    for name in ("EMBEDDING_DIMENSIONS", "VECTOR_INDEX_DIR", "VECTOR_INDEX_PROBES", "VECTOR_INDEX_QUANTIZATION"):
+        monkeypatch.setattr(config, name, getattr(config, name))
+    monkeypatch.setattr(db, "get_database", db.get_database)
+    monkeypatch.setattr(db, "_vector_indexes", {})
+    monkeypatch.setattr(db, "_vector_deltas", {})
+    # The scratch index directory is created under the default temporary directory
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+
+    results = vector_search.run_size({
+        "size": 500,
+        "variants": list(vector_search.VARIANTS),
+        "dimensions": 32,
+        "queries": 5,
+        "k": 5,
+        "probes": 4,
+        "storage": "packed",
+        "max_scan_size": 1000,
+        "mongo_uri": None,
+        "mongo_database": None,
+    })
+    assert [result["variant"] for result in results] == list(vector_search.VARIANTS)
+    for result in results:
+        assert "skipped" not in result
+        assert 0 < result["recall"] <= 1
@@ -0,0 +1,76 @@
+import sys
+import time
+from pathlib import Path
+
+# Add the parent directory to Python path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend.utils.cache import ResultCache, cache_key
+
+
+def test_cache_key_separates_parts():
+    """Parts are length-prefixed, so different splits give different keys."""
+    assert cache_key("ab", "c") != cache_key("a", "bc")
+    assert cache_key(b"image", "text", 1) == cache_key(b"image", "text", "1")
+
+
+def test_memory_tier_evicts_least_recently_used():
+    """The memory tier stays within its byte budget, dropping the oldest entry."""
+    cache = ResultCache(memory_bytes=10)
+    cache.set("a", b"12345")
+    cache.set("b", b"12345")
+    assert cache.get("a") == b"12345"
+    cache.set("c", b"12345")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"12345"
+    assert cache.stats()["memory_bytes"] <= 10
+
+
+def test_disk_tier_survives_restart_and_counts_hits(tmp_path):
+    """Entries written to disk are found by a fresh cache over the same directory."""
+    cache = ResultCache(memory_bytes=0, disk_bytes=100, directory=str(tmp_path))
+    cache.set("k" * 64, b"payload")
+
+    restarted = ResultCache(memory_bytes=100, disk_bytes=100, directory=str(tmp_path))
+    assert restarted.get("k" * 64) == b"payload"
+    assert restarted.get("k" * 64) == b"payload"
+    assert restarted.get("m" * 64) is None
+    stats = restarted.stats()
+    assert (stats["disk_hits"], stats["memory_hits"], stats["misses"]) == (1, 1, 1)
+
+
+def test_disk_tier_evicts_to_budget(tmp_path):
+    """The disk tier removes the oldest files once it exceeds its budget."""
+    cache = ResultCache(memory_bytes=0, disk_bytes=10, directory=str(tmp_path))
+    cache.set("a" * 64, b"123456")
+    cache.set("b" * 64, b"123456")
+    assert cache.get("a" * 64) is None
+    assert cache.get("b" * 64) == b"123456"
+    assert cache.stats()["disk_bytes"] <= 10
+
+
+def test_disk_budget_is_shared_between_processes(tmp_path):
+    """Caches over one directory re-scan it and keep the files together within the budget."""
+    first = ResultCache(memory_bytes=0, disk_bytes=100, directory=str(tmp_path))
+    second = ResultCache(memory_bytes=0, disk_bytes=100, directory=str(tmp_path))
+    for i in range(20):
+        (first if i % 2 else second).set(f"{i:02d}" * 32, bytes(10))
+    on_disk = sum(path.stat().st_size for path in tmp_path.rglob("*") if path.is_file())
+    assert on_disk <= 100
+    assert first.get("19" * 32) == bytes(10)
+
+
+def test_entries_expire_after_ttl(tmp_path, monkeypatch):
+    """Entries older than the ttl are misses in both tiers and are removed from disk."""
+    now = [time.time()]
+    monkeypatch.setattr("backend.utils.cache.time.time", lambda: now[0])
+    cache = ResultCache(memory_bytes=100, disk_bytes=100, directory=str(tmp_path), ttl=60)
+    cache.set("e" * 64, b"vector")
+    now[0] += 30
+    assert cache.get("e" * 64) == b"vector"
+
+    now[0] += 31
+    assert cache.get("e" * 64) is None
+    assert not (tmp_path / "ee" / ("e" * 64)).exists()
+    stats = cache.stats()
+    assert (stats["expired"], stats["misses"], stats["disk_entries"]) == (1, 1, 0)
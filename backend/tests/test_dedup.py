@@ -0,0 +1,114 @@
+import sys
+from pathlib import Path
+
+import pytest
+from bson import ObjectId
+
+# Add the parent directory to Python path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend import config, db
+from backend.utils.dedup import MinHasher, estimated_similarity, normalize_report
+from conftest import FakeCollection
+
+REPORT = (
+    "He followed me from the Central bus stop every evening, tall, black jacket, "
+    "and kept sending threatening messages to my phone."
+)
+RESUBMITTED = (
+    "he followed me from the central bus stop EVERY evening - tall, black jacket - "
+    "and kept sending threatening messages to my phone!!"
+)
+OTHER = "A woman took my bag at the vegetable market on Sunday morning."
+
+
+@pytest.fixture
+def complaints(monkeypatch):
+    collection = FakeCollection()
+    embedded = []
+    monkeypatch.setattr(db, "get_database", lambda: {"complains2": collection})
+    monkeypatch.setattr(db, "generate_text_embedding", lambda text: embedded.append(text) or [1.0, 0.0])
+    monkeypatch.setattr(
+        db, "generate_text_embeddings", lambda texts: [db.generate_text_embedding(text) for text in texts]
+    )
+    monkeypatch.setattr(db, "record_vector_changes", lambda name, upserts=(), deletes=(): None)
+    return collection, embedded
+
+
+def insert(culprit, name="Asha"):
+    return db.insert_data_into_db(name, "Pune", "555-0100", "High", culprit, "neighbour", "")
+
+
+def test_minhash_estimates_similarity_of_normalized_text():
+    """Resubmissions differing in case and punctuation collide; unrelated reports do not."""
+    minhasher = MinHasher()
+    assert normalize_report(RESUBMITTED) == normalize_report(REPORT)
+    report, copy, other = (minhasher.signature(text) for text in (REPORT, RESUBMITTED, OTHER))
+    edited = minhasher.signature(REPORT.replace("tall", "very tall"))
+    assert estimated_similarity(report, copy) == 1.0
+    assert config.DUPLICATE_THRESHOLD < estimated_similarity(report, edited) < 1.0
+    assert estimated_similarity(report, other) < 0.1
+    assert set(minhasher.band_keys(report)) & set(minhasher.band_keys(edited))
+    assert not set(minhasher.band_keys(report)) & set(minhasher.band_keys(other))
+
+
+def test_insert_flags_near_duplicates_and_skips_their_embedding(complaints):
+    """A resubmitted report points at the original and stays out of vector search."""
+    collection, embedded = complaints
+    original_id = insert(REPORT)
+    copy_id = insert(RESUBMITTED)
+    other_id = insert(OTHER)
+
+    copy = next(doc for doc in collection.docs if doc["_id"] == copy_id)
+    assert copy["duplicate_of"] == original_id and copy["duplicate_score"] >= config.DUPLICATE_THRESHOLD
+    assert "culprit_embedding" not in copy
+    assert embedded == [REPORT, OTHER]
+    assert "duplicate_of" not in collection.docs[2]
+
+    cluster = db.find_duplicate_cluster(copy_id)
+    assert [doc["_id"] for doc in cluster] == [original_id, copy_id]
+    assert all("minhash" not in doc and "lsh_bands" not in doc for doc in cluster)
+    assert [doc["_id"] for doc in db.find_duplicate_cluster(other_id)] == [other_id]
+    assert db.find_duplicate_cluster(ObjectId()) is None
+
+
+def test_insert_merges_near_duplicates(complaints, monkeypatch):
+    """In merge mode a resubmission is appended to the original instead of stored."""
+    collection, _ = complaints
+    monkeypatch.setattr(config, "DUPLICATE_ACTION", "merge")
+    original_id = insert(REPORT)
+    assert insert(RESUBMITTED, name="A. Asha") == original_id
+    assert len(collection.docs) == 1
+    assert collection.docs[0]["report_count"] == 1
+    assert collection.docs[0]["duplicate_reports"][0]["name"] == "A. Asha"
+
+
+def test_index_duplicates_backfills_and_flags_existing_copies(complaints):
+    """Complaints stored before detection get signatures; later copies are flagged in _id order."""
+    collection, _ = complaints
+    for culprit in (REPORT, OTHER, RESUBMITTED, RESUBMITTED):
+        collection.insert_one({"name": "Asha", "culprit": culprit, "culprit_embedding": [1.0, 0.0]})
+
+    assert db.index_duplicate_reports(batch_size=2) == {"indexed": 4, "duplicates": 2, "cleared": 0}
+    original_id = collection.docs[0]["_id"]
+    assert [doc.get("duplicate_of") for doc in collection.docs] == [None, None, original_id, original_id]
+    assert ["culprit_embedding" in doc for doc in collection.docs] == [True, True, False, False]
+    assert all("lsh_bands" in doc for doc in collection.docs)
+    assert db.index_duplicate_reports() == {"indexed": 0, "duplicates": 0, "cleared": 0}
+
+
+def test_rebuild_unflags_reports_that_no_longer_match(complaints, monkeypatch):
+    """After a stricter threshold, a rebuild clears stale flags and restores the embedding."""
+    collection, embedded = complaints
+    insert(REPORT)
+    edited_id = insert(REPORT.replace("tall", "very tall"))
+    copy_id = insert(RESUBMITTED)
+    assert embedded == [REPORT]
+
+    monkeypatch.setattr(config, "DUPLICATE_THRESHOLD", 0.99)
+    assert db.index_duplicate_reports(rebuild=True) == {"indexed": 3, "duplicates": 1, "cleared": 1}
+    edited, copy = (next(doc for doc in collection.docs if doc["_id"] == id_) for id_ in (edited_id, copy_id))
+    assert "duplicate_of" not in edited and "duplicate_score" not in edited
+    assert edited["culprit_embedding"] == [1.0, 0.0]
+    assert embedded == [REPORT, REPORT.replace("tall", "very tall")]
+    assert "duplicate_of" in copy and "culprit_embedding" not in copy
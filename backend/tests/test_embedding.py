@@ -0,0 +1,193 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# Add the parent directory to Python path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend.db import rank_by_similarity
+from backend.utils import embedding
+from backend.utils.cache import ResultCache
+from backend.utils.embedding import (
+    calculate_similarity_percentage,
+    compute_similarity,
+    embedding_norms,
+    fit_dimensions,
+    generate_text_embedding,
+    similarity_percentages,
+    similarity_scores,
+)
+
+
+def reference_similarity(embedding1, embedding2):
+    """The original per-document Euclidean similarity."""
+    distance = sum((q - r) ** 2 for q, r in zip(embedding1, embedding2)) ** 0.5
+    return 1 - distance / len(embedding1) ** 0.5
+
+
+def random_embeddings(count, dimensions=768, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(count, dimensions))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def test_euclidean_scores_match_reference():
+    """Batched scores match the original formula document by document."""
+    matrix = random_embeddings(50)
+    query = random_embeddings(1, seed=1)[0]
+    scores = similarity_scores(query, matrix)
+    expected = [reference_similarity(query.tolist(), row.tolist()) for row in matrix]
+    assert scores.shape == (50,)
+    assert np.allclose(scores, expected, atol=1e-5)
+    assert compute_similarity(query.tolist(), matrix[0].tolist()) == pytest.approx(
+        expected[0], abs=1e-12
+    )
+
+
+def test_single_pair_scores_are_exact():
+    """Identical vectors score exactly 1 and 100%, where the norm expansion would not."""
+    vector = [1.0, 2.0, 3.0]
+    assert compute_similarity(vector, vector) == 1.0
+    assert calculate_similarity_percentage(vector, vector) == 100.0
+    nearby = [1.0, 2.0, 3.001]
+    assert compute_similarity(vector, nearby) == pytest.approx(
+        reference_similarity(vector, nearby), abs=1e-12
+    )
+    assert rank_by_similarity(vector, [{}], [vector])[0]["similarity_score"] == 1.0
+
+
+def test_batch_of_queries_with_precomputed_norms():
+    """A batch of queries gives one row of scores per query."""
+    matrix = random_embeddings(20)
+    queries = random_embeddings(3, seed=2)
+    scores = similarity_scores(queries, matrix, norms=embedding_norms(matrix))
+    assert scores.shape == (3, 20)
+    assert np.allclose(scores[1], similarity_scores(queries[1], matrix))
+
+
+def test_cosine_scores():
+    """Cosine scores equal the dot product for unit vectors."""
+    matrix = random_embeddings(10)
+    query = random_embeddings(1, seed=3)[0]
+    assert np.allclose(similarity_scores(query, matrix, "cosine"), matrix @ query, atol=1e-6)
+    assert similarity_scores(matrix[4], matrix, "cosine")[4] == pytest.approx(1.0)
+
+
+def test_similarity_percentage_is_clipped_and_rounded():
+    """Percentages keep the 0 floor and 2-decimal rounding of the original."""
+    assert calculate_similarity_percentage([0.0, 0.0], [0.0, 0.0]) == 100.0
+    assert calculate_similarity_percentage([0.0], [5.0]) == 0.0
+    matrix = random_embeddings(5)
+    percentages = similarity_percentages(matrix[0], matrix)
+    assert percentages[0] == 100.0
+    assert np.all(percentages == np.round(percentages, 2))
+
+
+def test_rank_by_similarity_filters_and_sorts():
+    """Documents under the threshold are dropped and the rest come back best first."""
+    matrix = random_embeddings(4)
+    documents = [{"name": str(index)} for index in range(4)]
+    query = matrix[2] * 0.9 + matrix[0] * 0.1
+    ranked = rank_by_similarity(query, documents, matrix, threshold=0.0)
+    assert ranked[0]["name"] == "2"
+    scores = [doc["similarity_score"] for doc in ranked]
+    assert scores == sorted(scores, reverse=True)
+    assert rank_by_similarity(query, documents, matrix, threshold=1.1) == []
+
+
+def test_generate_text_embedding_is_cached(monkeypatch):
+    """Repeated texts are served from the cache instead of calling the API again."""
+    calls = []
+
+    def fake_embed_content(model, content, task_type, title, output_dimensionality):
+        calls.append((content, task_type))
+        return {"embedding": [[0.6, 0.8, 0.0] for _ in content]}
+
+    monkeypatch.setattr(embedding, "embedding_cache", ResultCache(memory_bytes=1 << 20))
+    monkeypatch.setattr(embedding, "_genai_configured", True)
+    monkeypatch.setattr(embedding.genai, "embed_content", fake_embed_content)
+
+    first = generate_text_embedding("tall man in a black jacket")
+    assert generate_text_embedding("tall man in a black jacket") == first
+    assert np.allclose(first, [0.6, 0.8, 0.0])
+    generate_text_embedding("tall man in a black jacket", task_type="retrieval_query")
+    assert len(calls) == 2
+    assert embedding.embedding_cache.stats()["memory_hits"] == 1
+
+
+def test_generate_text_embeddings_batches_and_deduplicates(monkeypatch):
+    """Only uncached, distinct texts are sent, in requests of at most batch_size texts."""
+    requests = []
+
+    def fake_embed_content(model, content, task_type, title, output_dimensionality):
+        requests.append(list(content))
+        return {"embedding": [[float(len(text)), 0.0] for text in content]}
+
+    monkeypatch.setattr(embedding, "embedding_cache", ResultCache(memory_bytes=1 << 20))
+    monkeypatch.setattr(embedding, "_genai_configured", True)
+    monkeypatch.setattr(embedding.genai, "embed_content", fake_embed_content)
+
+    embedding.embedding_cache.set(
+        embedding.cache_key(embedding.EMBEDDING_MODEL, 768, "retrieval_document",
+                            "Embedding of culprit info", "cached"),
+        np.array([0.0, 1.0], dtype="<f8").tobytes(),
+    )
+    texts = ["a", "bb", "a", "cached", "ccc", "dddd", "eeeee"]
+    result = embedding.generate_text_embeddings(texts, batch_size=2)
+    assert result == [[1.0, 0.0]] * 3 + [[0.0, 1.0]] + [[1.0, 0.0]] * 3
+    assert requests == [["a", "bb"], ["ccc", "dddd"], ["eeeee"]]
+
+
+def test_fit_dimensions_truncates_and_renormalizes():
+    """Embeddings keep their leading components and are rescaled to unit length."""
+    vectors = np.array([[3.0, 4.0, 12.0], [0.0, 0.0, 1.0]])
+    assert np.allclose(fit_dimensions(vectors, 2), [[0.6, 0.8], [0.0, 0.0]])
+    assert np.allclose(fit_dimensions([3.0, 4.0, 12.0], 3), [3 / 13, 4 / 13, 12 / 13])
+
+
+def test_generated_embeddings_use_configured_dimensions(monkeypatch):
+    """The API is asked for EMBEDDING_DIMENSIONS and longer results are cut to size."""
+    requested = []
+
+    def fake_embed_content(model, content, task_type, title, output_dimensionality):
+        requested.append(output_dimensionality)
+        return {"embedding": [[3.0, 4.0, 5.0, 6.0] for _ in content]}
+
+    monkeypatch.setattr(embedding.config, "EMBEDDING_DIMENSIONS", 2)
+    monkeypatch.setattr(embedding, "embedding_cache", ResultCache(memory_bytes=1 << 20))
+    monkeypatch.setattr(embedding, "_genai_configured", True)
+    monkeypatch.setattr(embedding.genai, "embed_content", fake_embed_content)
+
+    assert np.allclose(generate_text_embedding("short man"), [0.6, 0.8])
+    monkeypatch.setattr(embedding.config, "EMBEDDING_DIMENSIONS", 4)
+    assert len(generate_text_embedding("short man")) == 4
+    assert requested == [2, 4]
+
+
+def test_hashing_backend_runs_offline(monkeypatch):
+    """The hashing backend embeds without the API or the cache, at the configured size."""
+    def no_network(**kwargs):
+        raise AssertionError("the hashing backend must not call the API")
+
+    monkeypatch.setattr(embedding.config, "EMBEDDING_BACKEND", "hashing")
+    monkeypatch.setattr(embedding.config, "EMBEDDING_DIMENSIONS", 256)
+    monkeypatch.setattr(embedding, "embedding_cache", ResultCache(memory_bytes=1 << 20))
+    monkeypatch.setattr(embedding.genai, "embed_content", no_network)
+
+    texts = ["tall man in a black jacket", "tall man wearing a black jacket", "red sports car"]
+    vectors = np.array(embedding.generate_text_embeddings(texts))
+    assert vectors.shape == (3, 256)
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0)
+    assert vectors.tolist() == embedding.generate_text_embeddings(texts)
+    assert embedding.embedding_cache.stats()["memory_entries"] == 0
+
+    scores = similarity_scores(vectors[0], vectors)
+    assert scores[1] > scores[2]
+
+
+def test_unknown_embedding_backend():
+    """A misspelled backend fails loudly instead of falling back to the API."""
+    with pytest.raises(ValueError):
+        embedding.make_embedder("word2vec", 256)
@@ -0,0 +1,125 @@
+import pickle
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# Add the parent directory to Python path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend import db
+from backend.utils.vector_codec import is_packed_embedding, unpack_embedding
+from conftest import FakeCollection
+
+
+def fake_embeddings(texts):
+    return [[float(len(text)), 1.0] for text in texts]
+
+
+def test_upload_batches_embeddings_and_inserts(monkeypatch):
+    """Documents are embedded and written in batches, with stats for each stage."""
+    collection = FakeCollection()
+    monkeypatch.setattr(db, "get_database", lambda: {"doc_embedding": collection})
+    monkeypatch.setattr(db, "generate_text_embeddings", fake_embeddings)
+
+    files = [(f"doc{i}.txt", "x" * i) for i in range(1, 26)]
+    stats = db.upload_embeddings_to_mongo(files, batch_size=10, concurrency=2)
+
+    assert collection.insert_calls == 3
+    assert sorted(doc["filename"] for doc in collection.docs) == sorted(name for name, _ in files)
+    doc = next(doc for doc in collection.docs if doc["filename"] == "doc3.txt")
+    assert unpack_embedding(doc["embedding"]).tolist() == [3.0, 1.0]
+    assert (stats["files"], stats["embedded"], stats["inserted"], stats["failed"]) == (25, 25, 25, 0)
+
+
+def test_upload_counts_failed_writes_and_embeddings(monkeypatch):
+    """A failed embedding batch or document write is counted without stopping the run."""
+    collection = FakeCollection()
+    collection.reject = lambda doc: doc["filename"] == "doc2.txt"
+    monkeypatch.setattr(db, "get_database", lambda: {"doc_embedding": collection})
+
+    def flaky_embeddings(texts):
+        if "boom" in texts:
+            raise RuntimeError("embedding API unavailable")
+        return fake_embeddings(texts)
+
+    monkeypatch.setattr(db, "generate_text_embeddings", flaky_embeddings)
+    files = [("doc1.txt", "a"), ("doc2.txt", "b"), ("bad.txt", "boom"), ("doc4.txt", "d")]
+    stats = db.upload_embeddings_to_mongo(files, batch_size=2, concurrency=1)
+
+    assert [doc["filename"] for doc in collection.docs] == ["doc1.txt"]
+    assert (stats["inserted"], stats["failed"]) == (1, 3)
+
+
+def test_migrate_rewrites_pickled_embeddings(monkeypatch):
+    """Pickled embeddings become packed vectors; packed and unsafe ones are left alone."""
+    class Exploit:
+        def __reduce__(self):
+            return (print, ("pwned",))
+
+    collection = FakeCollection(docs=[
+        {"_id": 1, "embedding": pickle.dumps([0.5, -1.0, 2.0])},
+        {"_id": 2, "embedding": db.pack_embedding([1.0, 2.0])},
+        {"_id": 3, "embedding": pickle.dumps([0.25])},
+        {"_id": 4, "embedding": pickle.dumps(Exploit())},
+    ])
+    monkeypatch.setattr(db, "get_database", lambda: {"doc_embedding": collection})
+
+    counts = db.migrate_document_embeddings("float16", batch_size=1)
+    assert counts == {"migrated": 2, "skipped": 1, "failed": 1}
+    first = collection.docs[0]["embedding"]
+    assert is_packed_embedding(first)
+    assert unpack_embedding(first).dtype == "float16"
+    assert unpack_embedding(first).tolist() == [0.5, -1.0, 2.0]
+    assert db.stored_embedding(collection.docs[2]["embedding"]).tolist() == [0.25]
+    assert not is_packed_embedding(collection.docs[3]["embedding"])
+
+
+def test_reembed_truncates_longer_vectors(monkeypatch):
+    """Vectors longer than EMBEDDING_DIMENSIONS are cut and re-normalized; others are skipped."""
+    collection = FakeCollection(docs=[
+        {"_id": 1, "embedding": db.pack_embedding([3.0, 4.0, 12.0])},
+        {"_id": 2, "embedding": db.pack_embedding([0.6, 0.8])},
+        {"_id": 3, "embedding": db.pack_embedding([1.0])},
+    ])
+    monkeypatch.setattr(db, "get_database", lambda: {"doc_embedding": collection})
+    monkeypatch.setattr(db, "get_vector_index", lambda name: None)
+    monkeypatch.setattr(db.config, "EMBEDDING_DIMENSIONS", 2)
+
+    assert db.reembed_vectors("documents") == {"reembedded": 1, "skipped": 1, "failed": 1}
+    assert np.allclose(unpack_embedding(collection.docs[0]["embedding"]), [0.6, 0.8])
+    # Vectors not yet rewritten are fitted the same way when read
+    assert np.allclose(db.stored_embedding(db.pack_embedding([3.0, 4.0, 12.0])), [0.6, 0.8])
+
+
+def test_reembed_from_text(monkeypatch):
+    """The text source embeds every stored text again, growing vectors or switching backends."""
+    collection = FakeCollection(docs=[
+        {"_id": 1, "culprit_embedding": [1.0], "culprit": "tall"},
+        {"_id": 2, "culprit_embedding": [1.0, 0.0], "culprit": "short"},
+    ])
+    monkeypatch.setattr(db, "get_database", lambda: {"complains2": collection})
+    monkeypatch.setattr(db, "get_vector_index", lambda name: None)
+    monkeypatch.setattr(db, "generate_text_embeddings", fake_embeddings)
+    monkeypatch.setattr(db.config, "EMBEDDING_DIMENSIONS", 2)
+
+    assert db.reembed_vectors("culprits", source="text") == {"reembedded": 2, "skipped": 0, "failed": 0}
+    assert collection.docs[0]["culprit_embedding"] == [4.0, 1.0]
+    # Same-size vectors from another backend are replaced too
+    assert collection.docs[1]["culprit_embedding"] == [5.0, 1.0]
+
+
+def test_reembed_from_text_switches_backend(monkeypatch):
+    """Switching backends at the same size still replaces every stored vector."""
+    texts = [f"culprit number {i}" for i in range(5)]
+    collection = FakeCollection(docs=[
+        {"_id": i, "culprit_embedding": [0.0] * 8, "culprit": text} for i, text in enumerate(texts)
+    ])
+    monkeypatch.setattr(db, "get_database", lambda: {"complains2": collection})
+    monkeypatch.setattr(db, "get_vector_index", lambda name: None)
+    monkeypatch.setattr(db.config, "EMBEDDING_DIMENSIONS", 8)
+    monkeypatch.setattr(db.config, "EMBEDDING_BACKEND", "hashing")
+
+    assert db.reembed_vectors("culprits", source="text") == {"reembedded": 5, "skipped": 0, "failed": 0}
+    expected = db.generate_text_embeddings(texts)
+    assert np.allclose([doc["culprit_embedding"] for doc in collection.docs], expected)
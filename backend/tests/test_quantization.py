@@ -0,0 +1,77 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# Add the parent directory to Python path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend.utils.embedding import similarity_scores
+from backend.utils.quantization import (
+    ProductQuantizer,
+    ScalarQuantizer,
+    approximate_scores,
+    evaluate_recall,
+)
+from backend.utils.vector_index import IVFIndex
+from conftest import clustered_embeddings
+
+
+@pytest.mark.parametrize("quantizer", [ScalarQuantizer(), ProductQuantizer(16)])
+def test_approximate_scores_track_exact_scores(quantizer):
+    """Scores computed from codes stay close to the exact float scores."""
+    vectors = clustered_embeddings(2000)
+    codes = quantizer.fit(vectors).encode(vectors)
+    assert len(codes) == 2000
+    query = clustered_embeddings(1, seed=1)[0]
+    approx = approximate_scores(quantizer, query, codes, quantizer.norms(codes), 64)
+    exact = similarity_scores(query, vectors)
+    assert np.corrcoef(approx, exact)[0, 1] > 0.95
+    assert np.allclose(quantizer.norms(codes), np.linalg.norm(quantizer.decode(codes), axis=1), atol=1e-4)
+
+
+def test_int8_codes_reconstruct_closely():
+    """int8 codes are a quarter of the float size and decode within half a step."""
+    vectors = clustered_embeddings(500)
+    quantizer = ScalarQuantizer().fit(vectors)
+    codes = quantizer.encode(vectors)
+    assert codes.dtype == np.int8 and codes.nbytes == vectors.nbytes // 4
+    assert np.all(np.abs(quantizer.decode(codes) - vectors) <= quantizer.scale / 2 + 1e-6)
+
+
+def test_pq_rejects_uneven_split():
+    """The embedding size must divide into the requested number of subvectors."""
+    with pytest.raises(ValueError):
+        ProductQuantizer(10).fit(clustered_embeddings(300))
+
+
+def test_evaluate_recall_reports_each_quantization():
+    """Re-ranking recovers most of the recall lost to quantization."""
+    vectors = clustered_embeddings(3000)
+    queries = clustered_embeddings(20, seed=2)
+    report = {row["quantization"]: row for row in evaluate_recall(vectors, queries, pq_subvectors=16)}
+    assert report["none"]["bytes_per_vector"] == 256
+    assert report["int8"]["bytes_per_vector"] == 68
+    assert report["pq"]["bytes_per_vector"] == 20
+    assert report["int8"]["recall_reranked"] >= 0.95
+    assert report["pq"]["recall_reranked"] >= report["pq"]["recall"]
+
+
+@pytest.mark.parametrize("quantization", ["int8", "pq"])
+def test_quantized_index_round_trip(tmp_path, quantization):
+    """A quantized index stores only codes and widens its candidates for re-ranking."""
+    vectors = clustered_embeddings(1000)
+    index = IVFIndex.build(
+        range(1000), vectors, n_probe=32, quantization=quantization,
+        pq_subvectors=16, rerank_factor=3,
+    )
+    assert index.vectors is None
+    assert len(index.search(vectors[3], k=5)) == 15
+
+    path = tmp_path / "index.npz"
+    index.save(str(path))
+    loaded = IVFIndex.load(str(path))
+    assert loaded.quantizer.kind == quantization
+    assert loaded.search(vectors[3], k=5) == index.search(vectors[3], k=5)
+    assert "3" in [id_ for id_, _ in loaded.search(vectors[3], k=5)]
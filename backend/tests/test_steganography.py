@@ -0,0 +1,195 @@
+import lzma
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# Add the parent directory to Python path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend.utils import steganography
+from backend.utils.steganography import (
+    decode_text_from_image,
+    encode_text_in_image,
+    peak_buffer_bytes,
+)
+
+
+def create_random_image(mode="RGB", size=(64, 48), seed=0):
+    """Creates an image with random pixel values."""
+    channels = len(mode)
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (size[1], size[0], channels), dtype=np.uint8)
+    return Image.fromarray(pixels)
+
+
+def encode_legacy(image, text):
+    """Encodes text with the legacy end-marker format."""
+    bits = "".join(format(ord(char), "08b") for char in text) + "1111111111111110"
+    pixels = np.array(image)
+    red = pixels[..., 0].reshape(-1)
+    red[: len(bits)] = (red[: len(bits)] & 0xFE) | [int(bit) for bit in bits]
+    pixels[..., 0] = red.reshape(pixels.shape[:2])
+    return Image.fromarray(pixels)
+
+
+def test_round_trip_rgb():
+    """Text encoded in an RGB image decodes back unchanged."""
+    image = create_random_image("RGB")
+    encoded = encode_text_in_image(image, "Secret test message")
+    assert encoded.mode == "RGB"
+    assert decode_text_from_image(encoded) == "Secret test message"
+
+
+def test_round_trip_rgba():
+    """Text encoded in an RGBA image keeps the alpha channel intact."""
+    image = create_random_image("RGBA")
+    encoded = encode_text_in_image(image, "Secret test message")
+    assert encoded.mode == "RGBA"
+    assert np.array_equal(np.array(encoded)[..., 3], np.array(image)[..., 3])
+    assert decode_text_from_image(encoded) == "Secret test message"
+
+
+def test_only_red_lsb_changes():
+    """Encoding touches nothing but the least significant bit of the red channel."""
+    image = create_random_image("RGB")
+    original = np.array(image).astype(np.int16)
+    encoded = np.array(encode_text_in_image(image, "Hello")).astype(np.int16)
+    assert np.all(np.abs(encoded - original)[..., 0] <= 1)
+    assert np.array_equal(encoded[..., 1:], original[..., 1:])
+
+
+def test_grayscale_image_is_converted():
+    """Images that are not RGB or RGBA are converted before encoding."""
+    image = create_random_image("RGB").convert("L")
+    encoded = encode_text_in_image(image, "Hello")
+    assert encoded.mode == "RGB"
+    assert decode_text_from_image(encoded) == "Hello"
+
+
+def test_clean_image_decodes_to_empty_string():
+    """An image without hidden text decodes to an empty string."""
+    image = Image.new("RGB", (32, 32), color=(255, 255, 255))
+    assert decode_text_from_image(image) == ""
+
+
+def test_text_containing_end_marker_is_not_truncated():
+    """Bytes that look like the legacy end marker survive the round trip."""
+    text = "before\xff\xfeafter"
+    encoded = encode_text_in_image(create_random_image("RGB"), text)
+    assert decode_text_from_image(encoded) == text
+
+
+def test_legacy_marker_format_still_decodes():
+    """Images written with the end-marker format decode through the fallback."""
+    encoded = encode_legacy(create_random_image("RGB"), "Old format message")
+    assert decode_text_from_image(encoded) == "Old format message"
+    assert decode_text_from_image(encoded, legacy_fallback=False) == ""
+
+
+def test_text_too_long_for_image():
+    """Text that does not fit in the image is rejected instead of truncated."""
+    with pytest.raises(ValueError):
+        encode_text_in_image(create_random_image("RGB", size=(8, 8)), "too long")
+
+
+def test_small_tiles_match_single_tile():
+    """Encoding band by band produces the same pixels as one large band."""
+    image = create_random_image("RGBA", size=(40, 30))
+    text = "A message that spans several rows of the image"
+    whole = encode_text_in_image(image, text)
+    tiled = encode_text_in_image(image, text, tile_bytes=1)
+    assert whole.tobytes() == tiled.tobytes()
+    assert decode_text_from_image(tiled, tile_bytes=1) == text
+    assert peak_buffer_bytes(image, tile_bytes=1) == 40 * 4
+
+
+def test_legacy_scan_with_small_tiles():
+    """The end marker is found even when it crosses a band boundary."""
+    encoded = encode_legacy(create_random_image("RGB", size=(7, 40)), "Old format")
+    assert decode_text_from_image(encoded, tile_bytes=3 * 7 * 2) == "Old format"
+
+
+def test_in_place_encoding_reuses_image():
+    """In-place encoding modifies and returns the image it was given."""
+    image = create_random_image("RGB")
+    encoded = encode_text_in_image(image, "Hello", in_place=True)
+    assert encoded is image
+    assert decode_text_from_image(image) == "Hello"
+
+
+@pytest.mark.parametrize("channels", ["G", "RGB", "RGBA", "BA"])
+@pytest.mark.parametrize("bits_per_channel", [1, 2])
+def test_density_modes_round_trip(channels, bits_per_channel):
+    """The density mode is read back from the header without being passed in."""
+    image = create_random_image("RGBA")
+    text = "A denser payload " * 10
+    encoded = encode_text_in_image(
+        image, text, channels=channels, bits_per_channel=bits_per_channel
+    )
+    assert decode_text_from_image(encoded) == text
+
+
+def test_denser_mode_touches_fewer_pixels():
+    """Using more channels and bits per channel changes fewer pixels."""
+    image = create_random_image("RGB")
+    original = np.array(image)
+    text = "x" * 200
+    sparse = np.array(encode_text_in_image(image, text))
+    dense = np.array(encode_text_in_image(image, text, channels="RGB", bits_per_channel=2))
+    assert (dense != original).any(axis=-1).sum() < (sparse != original).any(axis=-1).sum()
+
+
+def test_alpha_channel_requires_rgba_image():
+    """Asking for the alpha channel of an RGB image is rejected."""
+    with pytest.raises(ValueError):
+        encode_text_in_image(create_random_image("RGB"), "Hello", channels="RA")
+
+
+def test_non_latin_text_round_trip():
+    """Text outside Latin-1 is stored as UTF-8 and decodes unchanged."""
+    text = "मदद चाहिए ☃ 求助"
+    encoded = encode_text_in_image(create_random_image("RGB"), text)
+    assert decode_text_from_image(encoded) == text
+
+
+@pytest.mark.parametrize("compression", ["none", "zlib", "lzma", "auto"])
+def test_compression_round_trip(compression):
+    """Every codec is recorded in the header and undone on decode."""
+    text = "The culprit was seen near the market. " * 20
+    encoded = encode_text_in_image(
+        create_random_image("RGB", size=(128, 128)), text, compression=compression
+    )
+    assert decode_text_from_image(encoded) == text
+
+
+def test_lzma_payload_from_the_64_mib_dictionary_still_decodes(monkeypatch):
+    """Payloads written with the earlier preset dictionary decode, even with matches over 1 MiB back."""
+    block = os.urandom(600_000).hex()
+    text = block + block
+    with monkeypatch.context() as patched:
+        patched.setattr(steganography, "_LZMA_FILTERS", [{"id": lzma.FILTER_LZMA2, "preset": 9}])
+        encoded = encode_text_in_image(
+            create_random_image("RGBA", size=(800, 800)), text,
+            channels="RGBA", bits_per_channel=2, compression="lzma",
+        )
+    assert decode_text_from_image(encoded) == text
+
+
+def test_auto_compression_touches_fewer_pixels():
+    """Compressible text needs fewer pixels than the raw UTF-8 bytes."""
+    image = create_random_image("RGB", size=(128, 128))
+    original = np.array(image)
+    text = "The culprit was seen near the market. " * 20
+    raw = np.array(encode_text_in_image(image, text, compression="none"))
+    auto = np.array(encode_text_in_image(image, text))
+    assert (auto != original).any(axis=-1).sum() < (raw != original).any(axis=-1).sum() / 4
+
+
+def test_unknown_compression_is_rejected():
+    """An unknown codec name raises instead of silently storing raw text."""
+    with pytest.raises(ValueError):
+        encode_text_in_image(create_random_image("RGB"), "Hello", compression="brotli")
@@ -0,0 +1,60 @@
+import pickle
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# Add the parent directory to Python path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend.utils.vector_codec import (
+    is_packed_embedding,
+    pack_embedding,
+    unpack_embedding,
+    unpickle_legacy_embedding,
+)
+
+
+def test_float32_round_trip_is_compact_and_zero_copy():
+    """768 floats pack into 4 bytes each plus a 4-byte header and decode as a view."""
+    embedding = np.random.default_rng(0).normal(size=768).tolist()
+    packed = pack_embedding(embedding)
+    assert len(packed) == 4 + 768 * 4
+    assert len(packed) < len(pickle.dumps(embedding)) / 2
+    assert is_packed_embedding(packed)
+
+    vector = unpack_embedding(packed)
+    assert vector.dtype == np.float32
+    assert not vector.flags.owndata
+    assert np.array_equal(vector, np.asarray(embedding, dtype=np.float32))
+
+
+def test_float16_halves_the_size():
+    """The float16 format keeps values to about three significant digits."""
+    embedding = [0.1234, -0.5, 0.75]
+    packed = pack_embedding(embedding, "float16")
+    assert len(packed) == 4 + 3 * 2
+    assert np.allclose(unpack_embedding(packed), embedding, atol=1e-3)
+
+
+def test_unpack_rejects_unknown_formats():
+    """Other data, newer versions and unknown dtypes raise ValueError."""
+    packed = bytes(pack_embedding([1.0]))
+    with pytest.raises(ValueError):
+        unpack_embedding(b"xx" + packed[2:])
+    with pytest.raises(ValueError):
+        unpack_embedding(packed[:2] + b"\x09" + packed[3:])
+    with pytest.raises(ValueError):
+        unpack_embedding(packed[:3] + b"\x07" + packed[4:])
+    with pytest.raises(ValueError):
+        pack_embedding([1.0], "float64")
+
+
+def test_legacy_unpickler_only_loads_number_lists():
+    """Pickled float lists load; pickles that import anything are refused."""
+    assert unpickle_legacy_embedding(pickle.dumps([0.5, 1.5])) == [0.5, 1.5]
+    with pytest.raises(pickle.UnpicklingError):
+        unpickle_legacy_embedding(pickle.dumps(np.array([0.5])))
+    with pytest.raises(ValueError):
+        unpickle_legacy_embedding(pickle.dumps({"embedding": [0.5]}))
@@ -0,0 +1,116 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# Add the parent directory to Python path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend.utils.embedding import similarity_scores
+from backend.utils.vector_index import DeltaSegment, IVFIndex
+from conftest import clustered_embeddings
+
+
+def test_search_recall_against_exact_scan():
+    """Probing a fraction of the lists still finds most of the exact top 10."""
+    vectors = clustered_embeddings(5000)
+    queries = clustered_embeddings(20, seed=1)
+    index = IVFIndex.build(range(len(vectors)), vectors, n_probe=8)
+    assert index.n_lists == 71
+
+    found = 0
+    for query in queries:
+        exact = set(np.argsort(-similarity_scores(query, vectors))[:10].astype(str))
+        found += len(exact & {id_ for id_, _ in index.search(query, k=10)})
+    assert found / (10 * len(queries)) >= 0.9
+
+
+def test_probing_every_list_is_exact():
+    """With every list probed the results equal a brute-force ranking."""
+    vectors = clustered_embeddings(500)
+    index = IVFIndex.build([f"doc{i}" for i in range(500)], vectors, n_lists=10)
+    results = index.search(vectors[7], k=5, n_probe=10)
+    scores = similarity_scores(vectors[7], vectors)
+    assert [id_ for id_, _ in results] == [f"doc{i}" for i in np.argsort(-scores, kind="stable")[:5]]
+    assert np.allclose([score for _, score in results], np.sort(scores)[::-1][:5])
+
+
+def test_threshold_filters_results():
+    """Only hits at or above the threshold come back, best first."""
+    vectors = clustered_embeddings(300)
+    index = IVFIndex.build(range(300), vectors, n_lists=1)
+    results = index.search(vectors[0], threshold=0.97)
+    assert results[0] == ("0", 1.0)
+    assert all(score >= 0.97 for _, score in results)
+
+
+def test_save_and_load_round_trip(tmp_path):
+    """A saved snapshot maps back read-only with the same results and metadata."""
+    vectors = clustered_embeddings(400)
+    index = IVFIndex.build(range(400), vectors, metadata={"last_id": "399"})
+    path = tmp_path / "culprits"
+    index.save(str(path))
+
+    loaded = IVFIndex.load(str(path), n_probe=3)
+    assert loaded.n_probe == 3
+    assert loaded.metadata == {"last_id": "399"}
+    assert loaded.path == index.path == str(path.resolve())
+    assert isinstance(loaded.vectors, np.memmap) and not loaded.vectors.flags.writeable
+    assert loaded.search(vectors[5], k=5, n_probe=8) == index.search(vectors[5], k=5)
+
+
+def test_resave_switches_snapshot_and_prunes_old_ones(tmp_path):
+    """Each save points the symlink at a new snapshot and keeps only the newest two."""
+    vectors = clustered_embeddings(100)
+    path = tmp_path / "documents"
+    first = IVFIndex.build(range(100), vectors)
+    first.save(str(path))
+    mapped = IVFIndex.load(str(path))
+    for count in (50, 60):
+        IVFIndex.build(range(count), vectors[:count]).save(str(path))
+
+    assert len(IVFIndex.load(str(path))) == 60
+    snapshots = [entry for entry in tmp_path.iterdir() if entry.is_dir() and not entry.is_symlink()]
+    assert len(snapshots) == 2
+    assert not Path(first.path).exists()
+    # A process still mapping a removed snapshot keeps working until it reloads
+    assert mapped.search(vectors[0], k=1)[0][0] == "0"
+
+
+def test_delta_segment_search():
+    """The delta segment scores its vectors exactly and applies the same limits."""
+    vectors = clustered_embeddings(30)
+    delta = DeltaSegment()
+    assert delta.search(vectors[0]) == []
+    delta.upsert(["a", "b"], vectors[:2])
+    delta.upsert([f"c{i}" for i in range(28)], vectors[2:])
+    assert len(delta) == 30
+    results = delta.search(vectors[1], k=3)
+    assert results[0] == ("b", 1.0) and len(results) == 3
+    assert all(score >= 0.99 for _, score in delta.search(vectors[1], threshold=0.99))
+
+
+def test_delta_segment_updates_and_deletes():
+    """Upserts replace earlier vectors, removals hide ids, and both shadow the snapshot."""
+    vectors = clustered_embeddings(4)
+    delta = DeltaSegment()
+    delta.upsert(["a", "b"], vectors[:2], changed_at=10)
+    delta.upsert(["a"], vectors[2:3], changed_at=20)
+    delta.remove(["b", "snapshot-only"], changed_at=30)
+
+    assert [id_ for id_, _ in delta.search(vectors[2])] == ["a"]
+    assert delta.search(vectors[2])[0][1] == 1.0
+    assert delta.shadows("b") and delta.shadows("snapshot-only") and not delta.shadows("c")
+    assert len(delta) == 3
+
+    changes = {id_: (vector, changed_at) for id_, vector, changed_at in delta.changes_since(20)}
+    assert set(changes) == {"a", "b", "snapshot-only"}
+    assert np.array_equal(changes["a"][0], vectors[2]) and changes["b"][0] is None
+    assert [id_ for id_, _, _ in delta.changes_since(25)] == ["b", "snapshot-only"]
+
+
+def test_empty_index():
+    """An index over no embeddings returns no results."""
+    index = IVFIndex.build([], np.zeros((0, 8)))
+    assert len(index) == 0
+    assert index.search(np.ones(8)) == []
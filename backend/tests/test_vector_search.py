@@ -0,0 +1,373 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# Add the parent directory to Python path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend import config, db
+from backend.utils import embedding
+from conftest import FakeCollection, clustered_embeddings
+
+
+@pytest.fixture
+def culprits(tmp_path, monkeypatch):
+    """A fake complains2 collection of 200 culprits with a snapshot built over it."""
+    collection = FakeCollection()
+    database = {"complains2": collection}
+    monkeypatch.setattr(db, "get_database", lambda: database)
+    monkeypatch.setattr(config, "VECTOR_INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(db, "_vector_indexes", {})
+    monkeypatch.setattr(db, "_vector_deltas", {})
+    monkeypatch.setattr(db, "_watched_indexes", set())
+
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(200, 16))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    for i, vector in enumerate(vectors):
+        collection.insert(culprit=str(i), culprit_embedding=vector.tolist())
+    db.build_vector_index("culprits")
+    return collection, vectors
+
+
+def search(vector, threshold=0.99):
+    return [doc["culprit"] for doc in db.search_vector_index("culprits", vector, threshold)]
+
+
+def test_inserts_by_other_processes_are_polled(culprits):
+    """Documents inserted after the snapshot are found by polling newer _ids."""
+    collection, vectors = culprits
+    collection.insert(culprit="new", culprit_embedding=vectors[3].tolist())
+    assert search(vectors[3]) == ["3", "new"]
+
+
+def test_change_stream_events_update_and_delete(culprits):
+    """Update and delete events replace or hide snapshot entries without a rebuild."""
+    collection, vectors = culprits
+    db._watched_indexes.add("culprits")
+    moved, deleted = collection.docs[5], collection.docs[6]
+    moved["culprit_embedding"] = vectors[9].tolist()
+    db.apply_vector_change("culprits", {
+        "operationType": "update",
+        "documentKey": {"_id": moved["_id"]},
+        "updateDescription": {"updatedFields": {"culprit_embedding": moved["culprit_embedding"]}},
+        "fullDocument": moved,
+    })
+    collection.docs.remove(deleted)
+    db.apply_vector_change("culprits", {"operationType": "delete", "documentKey": {"_id": deleted["_id"]}})
+    db.apply_vector_change("culprits", {
+        "operationType": "update",
+        "documentKey": {"_id": collection.docs[7]["_id"]},
+        "updateDescription": {"updatedFields": {"status": "Resolved"}},
+        "fullDocument": collection.docs[7],
+    })
+
+    assert search(vectors[5]) == []
+    assert sorted(search(vectors[9])) == ["5", "9"]
+    assert search(vectors[6]) == []
+    assert len(db.refresh_vector_delta("culprits", db.get_vector_index("culprits"))) == 2
+
+
+def test_merge_compacts_and_carries_over_late_changes(culprits, monkeypatch):
+    """A merge folds the delta into a new snapshot, keeping changes made during the build."""
+    collection, vectors = culprits
+    doc = collection.insert(culprit="late", culprit_embedding=vectors[1].tolist())
+    db.record_vector_changes("culprits", upserts=[(doc["_id"], vectors[1])])
+    assert db.merge_vector_index("culprits", min_delta=5) is None
+
+    load = db.load_stored_embeddings
+
+    def load_then_delete(name):
+        # A delete lands after the build has read the documents
+        loaded = load(name)
+        db.record_vector_changes("culprits", deletes=[collection.docs[2]["_id"]])
+        return loaded
+
+    monkeypatch.setattr(db, "load_stored_embeddings", load_then_delete)
+    merged = db.merge_vector_index("culprits", min_delta=1)
+    assert len(merged) == 201
+    assert search(vectors[1]) == ["1", "late"]
+    assert search(vectors[2]) == []
+
+
+def test_match_filter_builds_geo_radius():
+    """The geo filter is a $centerSphere around (lng, lat) in radians."""
+    query = db.match_filter(status="Pending", near=(12.5, 77.25), radius_km=db.EARTH_RADIUS_KM / 100)
+    assert query == {
+        "status": "Pending",
+        "location_point": {"$geoWithin": {"$centerSphere": [[77.25, 12.5], 0.01]}},
+    }
+    assert db.geo_point({"lat": 12.5, "lng": 77.25}) == {"type": "Point", "coordinates": [77.25, 12.5]}
+    assert db.geo_point("Bengaluru") is None
+
+
+def test_find_top_matches_pushes_filters_into_vector_search(culprits, monkeypatch):
+    """Status and severity become $vectorSearch filters and a geo radius an _id filter."""
+    collection, vectors = culprits
+    # The fake collection ignores $geoWithin, so status and severity pick the nearby complaints
+    for doc in collection.docs[:2]:
+        doc.update(status="Pending", severity="High")
+    near_ids = [collection.docs[0]["_id"], collection.docs[1]["_id"]]
+
+    db.find_top_matches(
+        collection, vectors[0].tolist(), num_results=5, num_candidates=3,
+        status="Pending", severity="High", near=(12.5, 77.25), radius_km=2,
+    )
+    stage = collection.pipelines[-1][0]["$vectorSearch"]
+    assert (stage["limit"], stage["numCandidates"]) == (5, 5)
+    assert stage["filter"] == {
+        "status": {"$eq": "Pending"},
+        "severity": {"$eq": "High"},
+        "_id": {"$in": near_ids},
+    }
+
+
+def test_wide_geo_filter_is_scanned_instead_of_listed(culprits, monkeypatch):
+    """A radius matching more _ids than fit in one $in list is scored with a filtered scan."""
+    collection, vectors = culprits
+    for doc in collection.docs[:3]:
+        doc["status"] = "Pending"
+    monkeypatch.setattr(config, "VECTOR_SEARCH_MAX_GEO_IDS", 2)
+
+    matches = db.find_top_matches(
+        collection, vectors[0].tolist(), num_results=5,
+        status="Pending", near=(12.5, 77.25), radius_km=2,
+    )
+    assert collection.pipelines == []
+    assert sorted(doc["culprit"] for doc in matches) == ["0", "1", "2"]
+    assert matches[0]["culprit"] == "0" and matches[0]["similarity_percentage"] == 100.0
+
+
+def test_find_top_matches_falls_back_to_filtered_local_search(culprits):
+    """Without Atlas Search only documents matching the filter are scored."""
+    collection, vectors = culprits
+    for doc in collection.docs[:50]:
+        doc["severity"] = "High"
+
+    matches = db.find_top_matches(collection, vectors[70].tolist(), num_results=3, severity="High")
+    assert len(matches) == 3
+    assert all(int(doc["culprit"]) < 50 for doc in matches)
+
+    unfiltered = db.find_top_matches(collection, vectors[70].tolist(), num_results=3)
+    assert unfiltered[0]["culprit"] == "70"
+    assert len(unfiltered) == 3
+
+
+def test_find_top_matches_returns_the_same_fields_from_every_path(culprits, monkeypatch):
+    """The local index and the scan return only the culprit fields, never personal data."""
+    collection, vectors = culprits
+    for doc in collection.docs:
+        doc.update(name="Asha", contact_info="555-0100", other_info="private")
+    returned = {"_id", "culprit", "culprit_embedding", "similarity_score", "similarity_percentage"}
+
+    indexed = db.find_top_matches(collection, vectors[7].tolist(), num_results=3)
+    assert indexed[0]["culprit"] == "7"
+    assert all(set(doc) == returned for doc in indexed)
+
+    monkeypatch.setattr(config, "VECTOR_INDEX_QUANTIZATION", "int8")
+    db.build_vector_index("culprits")
+    quantized = db.find_top_matches(collection, vectors[7].tolist(), num_results=3)
+    assert all(set(doc) == returned for doc in quantized)
+
+    monkeypatch.setattr(db, "get_vector_index", lambda name: None)
+    scanned = db.find_top_matches(collection, vectors[7].tolist(), num_results=3)
+    assert [doc["_id"] for doc in scanned] == [doc["_id"] for doc in indexed]
+    assert all(set(doc) == returned for doc in scanned)
+
+
+class ApproximateCollection(FakeCollection):
+    """Answers $vectorSearch by scoring only the first numCandidates documents, like a low-recall ANN."""
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        stage = pipeline[0]["$vectorSearch"]
+        docs = self.docs[:stage["numCandidates"]]
+        scores = db.similarity_scores(stage["queryVector"], [doc["culprit_embedding"] for doc in docs])
+        order = np.argsort(-scores, kind="stable")[:stage["limit"]]
+        return [dict(docs[i]) for i in order]
+
+
+def test_find_top_matches_widens_ambiguous_searches_and_reranks(monkeypatch, caplog):
+    """Close scores double the candidates until the ceiling; results are exact and scored."""
+    collection = ApproximateCollection()
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(400, 16))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    for i, vector in enumerate(vectors):
+        collection.insert(culprit=str(i), culprit_embedding=vector.tolist())
+    query = vectors[300] + 0.01
+    monkeypatch.setattr(config, "VECTOR_SEARCH_MAX_CANDIDATES", 400)
+    monkeypatch.setattr(config, "VECTOR_SEARCH_RECALL_SAMPLE_RATE", 1.0)
+
+    # Every gap counts as close: 100 -> 200 -> 400 candidates
+    monkeypatch.setattr(config, "VECTOR_SEARCH_SCORE_GAP", 1.0)
+    with caplog.at_level("INFO", logger="backend.db"):
+        matches = db.find_top_matches(collection, query.tolist(), num_results=3)
+    assert [p[0]["$vectorSearch"]["numCandidates"] for p in collection.pipelines] == [100, 200, 400]
+    assert collection.pipelines[0][0]["$vectorSearch"]["limit"] == 12
+    exact = np.argsort(-db.similarity_scores(query, vectors), kind="stable")[:3]
+    assert [doc["culprit"] for doc in matches] == [str(i) for i in exact]
+    assert matches[0]["similarity_percentage"] == embedding.calculate_similarity_percentage(
+        query.tolist(), vectors[exact[0]].tolist()
+    )
+    assert "candidates=400 rounds=3 recall=1.00 (measured)" in caplog.text
+
+    # A clear winner stops after the first round
+    collection.pipelines.clear()
+    monkeypatch.setattr(config, "VECTOR_SEARCH_SCORE_GAP", 0.0)
+    db.find_top_matches(collection, query.tolist(), num_results=3)
+    assert len(collection.pipelines) == 1
+
+
+@pytest.mark.parametrize("quantization", ["int8", "pq"])
+def test_quantized_search_keeps_recall_through_the_rerank(tmp_path, monkeypatch, quantization):
+    """search_vector_index re-ranks the whole widened candidate pool before cutting to k."""
+    collection = FakeCollection()
+    monkeypatch.setattr(db, "get_database", lambda: {"complains2": collection})
+    monkeypatch.setattr(config, "VECTOR_INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "VECTOR_INDEX_QUANTIZATION", quantization)
+    monkeypatch.setattr(config, "VECTOR_INDEX_PQ_SUBVECTORS", 32)
+    monkeypatch.setattr(config, "VECTOR_INDEX_PROBES", 1000)
+    monkeypatch.setattr(db, "_vector_indexes", {})
+    monkeypatch.setattr(db, "_vector_deltas", {})
+    vectors = clustered_embeddings(2000)
+    for i, vector in enumerate(vectors):
+        collection.insert(culprit=str(i), culprit_embedding=vector.tolist())
+    db.build_vector_index("culprits")
+
+    found = 0
+    queries = clustered_embeddings(10, seed=1)
+    for query in queries:
+        exact = np.argsort(-db.similarity_scores(query, vectors), kind="stable")[:10]
+        results = db.search_vector_index("culprits", query, k=10)
+        found += len({doc["culprit"] for doc in results} & {str(i) for i in exact})
+    assert found / (10 * len(queries)) >= 0.95
+
+
+def test_built_and_merged_snapshots_are_memory_mapped(culprits):
+    """The worker that builds or merges a snapshot serves it memory-mapped like the others."""
+    collection, vectors = culprits
+    assert isinstance(db.get_vector_index("culprits").vectors, np.memmap)
+    collection.insert(culprit="new", culprit_embedding=vectors[3].tolist())
+    search(vectors[3])
+    assert db.merge_vector_index("culprits", min_delta=1) is not None
+    index = db.get_vector_index("culprits")
+    assert isinstance(index.vectors, np.memmap) and len(index) == 201
+
+
+def test_scan_and_index_scores_are_exact(tmp_path, monkeypatch):
+    """Both search paths return the same scores as compute_similarity."""
+    collection = FakeCollection()
+    monkeypatch.setattr(db, "get_database", lambda: {"complains2": collection})
+    monkeypatch.setattr(config, "VECTOR_INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(db, "_vector_indexes", {})
+    monkeypatch.setattr(db, "_vector_deltas", {})
+    vectors = [[1.0, 2.0, 3.0], [1.0, 2.0, 3.5], [-3.0, 0.5, 1.0]]
+    for i, vector in enumerate(vectors):
+        collection.insert(culprit=str(i), culprit_embedding=vector)
+    query = vectors[0]
+    expected = [embedding.compute_similarity(query, vector) for vector in vectors[:2]]
+    assert expected[0] == 1.0
+
+    scanned = db.scan_top_matches(collection, "culprit_embedding", query, k=2)
+    assert [doc["similarity_score"] for doc in scanned] == expected
+    db.build_vector_index("culprits")
+    indexed = db.search_vector_index("culprits", query, k=2)
+    assert [doc["similarity_score"] for doc in indexed] == expected
+
+
+def test_index_builds_from_an_empty_collection(tmp_path, monkeypatch):
+    """A fresh deployment gets an empty snapshot that later inserts are found next to."""
+    collection = FakeCollection()
+    monkeypatch.setattr(db, "get_database", lambda: {"complains2": collection})
+    monkeypatch.setattr(config, "VECTOR_INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "EMBEDDING_DIMENSIONS", 16)
+    monkeypatch.setattr(db, "_vector_indexes", {})
+    monkeypatch.setattr(db, "_vector_deltas", {})
+
+    ids, embeddings = db.load_stored_embeddings("culprits")
+    assert ids == [] and embeddings.shape == (0, 16)
+    assert len(db.build_vector_index("culprits")) == 0
+    vector = np.ones(16) / 4
+    assert db.search_vector_index("culprits", vector, k=1) == []
+
+    collection.insert(culprit="new", culprit_embedding=vector.tolist())
+    assert [doc["culprit"] for doc in db.search_vector_index("culprits", vector, k=1)] == ["new"]
+
+
+def test_similarity_pipeline_runs_offline(tmp_path, monkeypatch):
+    """With the hashing backend culprit matching works end to end without the network."""
+    collection = FakeCollection()
+    monkeypatch.setattr(db, "get_database", lambda: {"complains2": collection})
+    monkeypatch.setattr(config, "VECTOR_INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "EMBEDDING_BACKEND", "hashing")
+    monkeypatch.setattr(config, "EMBEDDING_DIMENSIONS", 256)
+    texts = [
+        "short woman with curly red hair",
+        "tall man with a scar on his left cheek",
+        "elderly man walking with a cane",
+    ]
+    for text, embedding in zip(texts, db.generate_text_embeddings(texts)):
+        collection.insert(culprit=text, culprit_embedding=embedding)
+
+    query = "tall man, scar on the left cheek"
+    assert db.find_similar_culprits(query)[0]["culprit"] == texts[1]
+    assert len(db.find_similar_culprits(query, threshold=0, k=2)) == 2
+    matches = db.find_top_matches(collection, db.generate_text_embedding(query), num_results=2)
+    assert [doc["culprit"] for doc in matches][0] == texts[1] and len(matches) == 2
+
+
+def test_scan_streams_embeddings_and_hydrates_winners(culprits, monkeypatch):
+    """A full scan fetches only embeddings, keeps the best k and loads just the winners."""
+    collection, vectors = culprits
+    monkeypatch.setattr(config, "SCAN_BATCH_SIZE", 32)
+    for doc in collection.docs:
+        doc["other_info"] = "x" * 1000
+    collection.projections.clear()
+
+    results = db.scan_top_matches(collection, "culprit_embedding", vectors[42], k=5)
+    exact = np.argsort(-db.similarity_scores(vectors[42], vectors), kind="stable")[:5]
+    assert [doc["culprit"] for doc in results] == [str(i) for i in exact]
+    assert collection.projections == [{"culprit_embedding": 1}, {"minhash": 0, "lsh_bands": 0}]
+
+    above = db.scan_top_matches(collection, "culprit_embedding", vectors[42], threshold=0.8)
+    assert above[0]["culprit"] == "42" and all(doc["similarity_score"] >= 0.8 for doc in above)
+    scores = [doc["similarity_score"] for doc in above]
+    assert scores == sorted(scores, reverse=True)
+    assert db.scan_top_matches(collection, "culprit_embedding", vectors[42], threshold=1.1) == []
+
+
+def test_find_match_endpoint_with_snapshot(tmp_path, monkeypatch):
+    """/find-match answers from a built snapshot without exposing duplicate detection fields."""
+    from fastapi.testclient import TestClient
+
+    from backend import main
+
+    collection = FakeCollection()
+    database = {"complains2": collection}
+    monkeypatch.setattr(db, "get_database", lambda: database)
+    monkeypatch.setattr(main, "db", database)
+    monkeypatch.setattr(config, "VECTOR_INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "EMBEDDING_BACKEND", "hashing")
+    monkeypatch.setattr(config, "EMBEDDING_DIMENSIONS", 64)
+    monkeypatch.setattr(db, "_vector_indexes", {})
+    monkeypatch.setattr(db, "_vector_deltas", {})
+    texts = ["tall man with a scar", "short woman with red hair", "elderly man with a cane"]
+    for text, embedding in zip(texts, db.generate_text_embeddings(texts)):
+        collection.insert(culprit=text, culprit_embedding=embedding, name="Asha",
+                          minhash=bytes(range(200, 256)), lsh_bands=["0:00000000"])
+    db.build_vector_index("culprits")
+
+    response = TestClient(main.app).get(
+        "/find-match", params={"info": "tall man, scar", "collection": "complains2", "k": 2}
+    )
+    assert response.status_code == 200
+    matches = response.json()
+    assert matches[0]["culprit"] == texts[0] and len(matches) == 2
+    assert all("minhash" not in match and "name" not in match for match in matches)
+
+    assert all("minhash" not in doc and "lsh_bands" not in doc
+               for doc in db.find_similar_culprits("tall man, scar", threshold=0))
+    assert len(db.find_similar_culprits("tall man, scar", threshold=0, k=1)) == 1
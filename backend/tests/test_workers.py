@@ -0,0 +1,88 @@
+import asyncio
+import os
+import sys
+import threading
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+from PIL import Image
+
+# Add the parent directory to Python path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend.utils.workers import ImageWorkerPool, decode_image_bytes, encode_image_bytes
+
+
+def create_png_bytes():
+    """Creates a small PNG image in memory."""
+    buffer = BytesIO()
+    Image.new("RGB", (64, 64), color="red").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_process_pool_round_trip():
+    """Encode and decode tasks run in worker processes and return plain bytes."""
+    pool = ImageWorkerPool(max_workers=1, max_queue=1, timeout=60)
+    pool.start()
+    try:
+        png_bytes = asyncio.run(
+            pool.run(encode_image_bytes, create_png_bytes(), "Hidden", "R", 1, "auto", 1)
+        )
+        assert asyncio.run(pool.run(decode_image_bytes, png_bytes)) == "Hidden"
+    finally:
+        pool.shutdown()
+
+
+def test_overloaded_pool_rejects_with_503():
+    """Requests beyond workers plus queue slots are rejected immediately."""
+    pool = ImageWorkerPool(max_workers=0, max_queue=1, timeout=5)
+    release = threading.Event()
+
+    async def submit_three():
+        first = asyncio.ensure_future(pool.run(release.wait))
+        second = asyncio.ensure_future(pool.run(release.wait))
+        await asyncio.sleep(0.05)
+        try:
+            with pytest.raises(HTTPException) as error:
+                await pool.run(release.wait)
+            assert error.value.status_code == 503
+        finally:
+            release.set()
+        await asyncio.gather(first, second)
+
+    try:
+        asyncio.run(submit_three())
+        assert pool.pending == 0
+    finally:
+        pool.shutdown()
+
+
+def test_slow_task_times_out_with_504():
+    """A task that outlives the timeout is answered with 504."""
+    pool = ImageWorkerPool(max_workers=0, max_queue=1, timeout=0.05)
+    release = threading.Event()
+    try:
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(pool.run(release.wait))
+        assert error.value.status_code == 504
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_pool_recovers_after_a_worker_dies():
+    """A worker exiting fails only its own request; later tasks run on a fresh pool."""
+    pool = ImageWorkerPool(max_workers=1, max_queue=1, timeout=60)
+    pool.start()
+    try:
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(pool.run(os._exit, 1))
+        assert error.value.status_code == 500
+        png_bytes = create_png_bytes()
+        for _ in range(2):
+            assert asyncio.run(pool.run(decode_image_bytes, png_bytes, False)) == ""
+        assert pool.pending == 0
+    finally:
+        pool.shutdown()
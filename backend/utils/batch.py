@@ -0,0 +1,100 @@
+import json
+import os
+import zipfile
+from io import BytesIO
+
+
+def is_zip_upload(filename: str, data: bytes) -> bool:
+    """Whether an upload is a zip archive, judged by its name or its magic bytes."""
+    return (filename or "").lower().endswith(".zip") or data[:4] == b"PK\x03\x04"
+
+
+def expand_uploads(uploads, max_images=None, max_bytes=None):
+    """
+    Flatten (filename, bytes) uploads into a list of images, extracting zip archives.
+    Directories and hidden files inside archives are skipped. Archive entries
+    are counted and sized from the zip directory before anything is
+    decompressed, and ValueError is raised when there are more than
+    `max_images` images or they add up to more than `max_bytes`.
+    """
+    entries = []
+    for filename, data in uploads:
+        if not is_zip_upload(filename, data):
+            entries.append((filename, data, None))
+            continue
+        archive = zipfile.ZipFile(BytesIO(data))
+        for info in archive.infolist():
+            basename = os.path.basename(info.filename)
+            if info.is_dir() or not basename or basename.startswith("."):
+                continue
+            entries.append((info.filename, archive, info))
+
+    if max_images is not None and len(entries) > max_images:
+        raise ValueError(f"At most {max_images} images are accepted per batch")
+    # Reading an entry stops at its declared file_size, so the total cannot be exceeded
+    total = sum(len(data) if info is None else info.file_size for _, data, info in entries)
+    if max_bytes is not None and total > max_bytes:
+        raise ValueError(f"Images in a batch may add up to at most {max_bytes} bytes")
+
+    return [
+        (filename, source if info is None else source.read(info))
+        for filename, source, info in entries
+    ]
+
+
+class _ChunkWriter:
+    """Write-only file object that collects what is written until it is drained."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+async def stream_zip(results, suffix: str = ".png"):
+    """
+    Stream a zip archive of (filename, data, error) results as they arrive.
+    Each successful result is written as <name stem><suffix>; failures are
+    listed in an errors.json entry at the end instead of failing the batch.
+    """
+    writer = _ChunkWriter()
+    errors = {}
+    used_names = set()
+    # ZipFile falls back to data descriptors on a stream it cannot seek, so
+    # every entry can be sent as soon as it is written
+    with zipfile.ZipFile(writer, "w", compression=zipfile.ZIP_STORED) as archive:
+        async for filename, data, error in results:
+            if error is not None:
+                errors[filename] = error
+                continue
+            stem = os.path.splitext(os.path.basename(filename))[0] or "image"
+            name, counter = stem + suffix, 1
+            while name in used_names:
+                name, counter = f"{stem}_{counter}{suffix}", counter + 1
+            used_names.add(name)
+            archive.writestr(name, data)
+            yield writer.drain()
+        if errors:
+            archive.writestr("errors.json", json.dumps(errors, indent=2))
+    yield writer.drain()
+
+
+async def stream_ndjson(results, field: str):
+    """Stream (filename, value, error) results as newline-delimited JSON."""
+    async for filename, value, error in results:
+        line = {"filename": filename}
+        if error is None:
+            line[field] = value
+        else:
+            line["error"] = error
+        yield json.dumps(line) + "\n"
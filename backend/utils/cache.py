@@ -0,0 +1,216 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Share of the disk budget a process writes before it re-scans the directory
+_RESCAN_FRACTION = 0.125
+
+
+def cache_key(*parts) -> str:
+    """
+    Build a cache key from bytes and str parts.
+    Each part is length-prefixed so that ("ab", "c") and ("a", "bc") differ.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        data = part if isinstance(part, bytes) else str(part).encode("utf-8")
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier LRU cache of byte strings keyed by hex digests.
+    Recently used entries live in memory up to `memory_bytes`; everything is
+    also written to `directory` up to `disk_bytes`, so results survive restarts
+    and are shared between worker processes. Either tier is disabled with a
+    size of 0. With a `ttl`, entries expire that many seconds after being set.
+    On disk a file's mtime records when it was written and its atime when it
+    was last used. Each process indexes the files it knows of, and after
+    writing a fraction of `disk_bytes` re-scans the directory, so files
+    written by other processes count against the same budget.
+    """
+
+    def __init__(
+        self,
+        memory_bytes: int,
+        disk_bytes: int = 0,
+        directory: Optional[str] = None,
+        ttl: Optional[float] = None,
+    ):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes if directory else 0
+        self.directory = directory
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        self._written_since_scan = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+        if self.disk_bytes:
+            self._load_disk_index()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _load_disk_index(self):
+        """
+        Rebuild the disk LRU order from file access times, picking up files
+        left by earlier runs and written by other processes, and evict down
+        to the budget.
+        """
+        entries = []
+        now = time.time()
+        for root, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                    if self._is_expired(stat.st_mtime, now):
+                        os.remove(path)
+                        continue
+                except OSError:
+                    # Removed by another process meanwhile
+                    continue
+                entries.append((stat.st_atime, filename, stat.st_size))
+        with self._lock:
+            self._disk.clear()
+            self._disk_size = 0
+            for _, key, size in sorted(entries):
+                self._disk[key] = size
+                self._disk_size += size
+            self._written_since_scan = 0
+            self._evict_disk()
+
+    def _is_expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        with self._lock:
+            if key in self._memory:
+                value, stored_at = self._memory[key]
+                if not self._is_expired(stored_at, now):
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return value
+                self._memory_size -= len(self._memory.pop(key)[0])
+
+        # Other processes may have written the entry, so look on disk even if it is not indexed
+        value = None
+        expired = False
+        if self.disk_bytes:
+            path = self._path(key)
+            try:
+                stored_at = os.stat(path).st_mtime
+                if self._is_expired(stored_at, now):
+                    expired = True
+                    os.remove(path)
+                else:
+                    with open(path, "rb") as cached_file:
+                        value = cached_file.read()
+                    # Bump only the atime, which orders the disk LRU, so mtime keeps the write time
+                    os.utime(path, (now, stored_at))
+            except OSError:
+                value = None
+
+        with self._lock:
+            if value is None:
+                if expired:
+                    self.expired += 1
+                    self._forget_disk(key)
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            else:
+                self._disk[key] = len(value)
+                self._disk_size += len(value)
+            self._remember(key, value, stored_at)
+            return value
+
+    def set(self, key: str, value: bytes):
+        with self._lock:
+            self._remember(key, value, time.time())
+            if not self.disk_bytes or len(value) > self.disk_bytes:
+                return
+            # Without a ttl an existing file already holds this value; with one it is rewritten to renew it
+            if key in self._disk and self.ttl is None:
+                return
+
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(value)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write cache entry {key}: {e}")
+            return
+        with self._lock:
+            self._forget_disk(key)
+            self._disk[key] = len(value)
+            self._disk_size += len(value)
+            self._evict_disk()
+            self._written_since_scan += len(value)
+            rescan = self._written_since_scan > self.disk_bytes * _RESCAN_FRACTION
+        if rescan:
+            self._load_disk_index()
+
+    def _remember(self, key: str, value: bytes, stored_at: float):
+        """Add an entry to the memory tier and evict the least recently used ones."""
+        if len(value) > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key)[0])
+        self._memory[key] = (value, stored_at)
+        self._memory_size += len(value)
+        while self._memory_size > self.memory_bytes:
+            _, (evicted, _) = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _forget_disk(self, key: str):
+        """Drop a key from the disk index without touching its file."""
+        if key in self._disk:
+            self._disk_size -= self._disk.pop(key)
+
+    def _evict_disk(self):
+        while self._disk_size > self.disk_bytes:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_size,
+            }
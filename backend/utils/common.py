@@ -1,4 +1,6 @@
+import hashlib
 import os
+import tempfile
 from io import BytesIO
 
 import requests
@@ -32,6 +34,35 @@ def load_image_from_url_or_file(img_url=None, file=None):
     )
 
 
+def image_to_png_bytes(image: Image.Image, compress_level: int = 6) -> bytes:
+    """Serialize an image to PNG in memory."""
+    buffer = BytesIO()
+    image.save(buffer, format="PNG", compress_level=compress_level)
+    return buffer.getvalue()
+
+
+def save_content_addressed(data: bytes, directory: str, suffix: str = "") -> str:
+    """
+    Save data under a name derived from its SHA-256 digest and return the path.
+    Identical content maps to the same file, so concurrent writers never clobber
+    each other; the file is written to a temporary name and renamed into place.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, hashlib.sha256(data).hexdigest() + suffix)
+    if os.path.exists(path):
+        return path
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+    return path
+
+
 # Function to read files from the docs directory with improved error handling for encoding
 def read_files_from_directory(directory: str):
     file_contents = []
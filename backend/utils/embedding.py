@@ -3,67 +3,207 @@ import numpy as np
 import google.generativeai as genai
 from dotenv import load_dotenv
 
+from backend import config
+from backend.utils.cache import ResultCache, cache_key
+from backend.utils.local_embedding import HashingEmbedder, OnnxEmbedder
+
 load_dotenv()
 
-def generate_text_embedding(text):
-    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-    response = genai.embed_content(
-        model="models/text-embedding-004",
-        content=text,
-        task_type="retrieval_document",
-        title="Embedding of culprit info",
-    )
-    return response["embedding"]
+EMBEDDING_MODEL = "models/text-embedding-004"
 
-def compute_similarity(embedding1, embedding2):
+embedding_cache = ResultCache(
+    config.EMBEDDING_CACHE_MEMORY_BYTES,
+    config.EMBEDDING_CACHE_DISK_BYTES,
+    config.EMBEDDING_CACHE_DIR,
+    ttl=config.EMBEDDING_CACHE_TTL,
+)
+_genai_configured = False
+# Embedders by (backend, dimensions)
+_embedders = {}
+
+def _configure_genai():
+    global _genai_configured
+    if not _genai_configured:
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        _genai_configured = True
+
+def fit_dimensions(embedding, dimensions=None):
     """
-    Compute similarity between two embeddings using Euclidean distance
+    Truncate embeddings to their first `dimensions` components
+    (EMBEDDING_DIMENSIONS by default) and rescale them to unit length.
+    text-embedding-004 concentrates information in the leading components, so
+    a truncated vector still works on its own once re-normalized. Accepts one
+    embedding or an N x D matrix and returns float32.
     """
-    distance = sum((q - r) ** 2 for q, r in zip(embedding1, embedding2)) ** 0.5
-    max_distance = len(embedding1) ** 0.5
-    similarity = 1 - (distance / max_distance)
-    return similarity
+    dimensions = dimensions or config.EMBEDDING_DIMENSIONS
+    vectors = np.asarray(embedding, dtype=np.float32)[..., :dimensions]
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, np.finfo(np.float32).tiny)
 
-def calculate_similarity_percentage(query_vector, result_vector):
-    # Calculate Euclidean distance manually
-    distance = sum((q - r) ** 2 for q, r in zip(query_vector, result_vector)) ** 0.5
+class GeminiEmbedder:
+    """Google's hosted text-embedding-004 model, the default backend."""
 
-    # Estimate a maximum possible distance for normalization
-    max_distance = len(query_vector) ** 0.5
+    name = "gemini"
+    model = EMBEDDING_MODEL
+    cacheable = True
 
-    # Convert distance to a similarity percentage
-    similarity_percentage = max(0, (1 - distance / max_distance) * 100)
-    return round(similarity_percentage, 2)
+    def __init__(self, dimensions):
+        self.dimensions = dimensions
 
-def find_top_matches(
-    collection, description_embedding, num_results=1, num_candidates=100
+    def embed(self, texts, task_type="retrieval_document", title=None):
+        _configure_genai()
+        response = genai.embed_content(
+            model=EMBEDDING_MODEL,
+            content=list(texts),
+            task_type=task_type,
+            title=title,
+            output_dimensionality=self.dimensions,
+        )
+        return response["embedding"]
+
+def make_embedder(name, dimensions):
+    if name == "gemini":
+        return GeminiEmbedder(dimensions)
+    if name == "hashing":
+        return HashingEmbedder(dimensions)
+    if name == "onnx":
+        return OnnxEmbedder(config.EMBEDDING_ONNX_MODEL_DIR, dimensions)
+    raise ValueError(f"Unknown embedding backend: {name}")
+
+def get_embedder():
+    """
+    The embedder selected by EMBEDDING_BACKEND for EMBEDDING_DIMENSIONS,
+    created once per process. Every backend has the same interface:
+    embed(texts, task_type, title) returns one vector per text.
+    """
+    key = (config.EMBEDDING_BACKEND, config.EMBEDDING_DIMENSIONS)
+    if key not in _embedders:
+        _embedders[key] = make_embedder(*key)
+    return _embedders[key]
+
+def generate_text_embedding(
+    text, task_type="retrieval_document", title="Embedding of culprit info"
 ):
-    # Perform a vector search to get the top matches
-    results_cursor = collection.aggregate(
-        [
-            {
-                "$vectorSearch": {
-                    "path": "culprit_embedding",
-                    "index": "culpritIndex2",
-                    "queryVector": description_embedding,
-                    "numResults": num_results,
-                    "numCandidates": num_candidates,
-                    "numDimensions": 768,
-                    "similarity": "euclidean",
-                    "type": "knn",
-                    "limit": num_results,
-                },
-            },
-            {
-                "$project": {
-                    "culprit": 1,
-                    "culprit_embedding": 1,
-                    "_id": 1,
-                }
-            },
-        ]
-    )
-
-    # Convert the cursor to a list to access the results
-    results = list(results_cursor)
-    return results
\ No newline at end of file
+    """
+    Embed text as a unit vector of EMBEDDING_DIMENSIONS components with the
+    configured backend. Results are cached by (model, size, task type, title,
+    text), so repeated texts skip the remote API.
+    """
+    return generate_text_embeddings([text], task_type, title)[0]
+
+def generate_text_embeddings(
+    texts,
+    task_type="retrieval_document",
+    title="Embedding of culprit info",
+    batch_size=None,
+):
+    """
+    Embed a list of texts, returning one embedding per text in order.
+    Cached texts are served from the cache; the rest are deduplicated and sent
+    to the backend in batches of at most `batch_size` texts.
+    """
+    embedder = get_embedder()
+    batch_size = batch_size or config.EMBEDDING_BATCH_SIZE
+    dimensions = embedder.dimensions
+    cache = embedding_cache if embedder.cacheable else None
+    keys = [cache_key(embedder.model, dimensions, task_type, title, text) for text in texts]
+    embeddings = {}
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key in embeddings or key in missing:
+            continue
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            embeddings[key] = np.frombuffer(cached, dtype="<f8").tolist()
+        else:
+            missing[key] = text
+
+    missing_items = list(missing.items())
+    for start in range(0, len(missing_items), batch_size):
+        batch = missing_items[start:start + batch_size]
+        vectors = embedder.embed([text for _, text in batch], task_type=task_type, title=title)
+        for (key, _), embedding in zip(batch, fit_dimensions(vectors, dimensions).tolist()):
+            embeddings[key] = embedding
+            if cache is not None:
+                cache.set(key, np.asarray(embedding, dtype="<f8").tobytes())
+    return [embeddings[key] for key in keys]
+
+def embedding_norms(matrix):
+    """
+    L2 norm of every row of an N x D embedding matrix, computed once and
+    passed to similarity_scores to avoid recomputing it for every query.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    return np.sqrt(np.einsum("ij,ij->i", matrix, matrix))
+
+
+def similarity_scores(queries, matrix, metric="euclidean", norms=None):
+    """
+    Score one query (D,) or a batch of queries (Q, D) against an N x D matrix
+    in a single vectorized call.
+    "euclidean" uses the same normalization as compute_similarity,
+    1 - distance / sqrt(D); "cosine" returns the cosine similarity.
+    Returns an (N,) array for a single query and a (Q, N) array for a batch.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    queries = np.asarray(queries, dtype=np.float32)
+    single = queries.ndim == 1
+    queries = np.atleast_2d(queries)
+    if norms is None:
+        norms = embedding_norms(matrix)
+    query_norms = np.sqrt(np.einsum("ij,ij->i", queries, queries))
+
+    scores = scores_from_dots(queries @ matrix.T, query_norms, norms, matrix.shape[1], metric)
+    return scores[0] if single else scores
+
+
+def scores_from_dots(dots, query_norms, norms, dimensions, metric="euclidean"):
+    """
+    Turn (Q, N) dot products and the norms of both sides into similarity
+    scores, so exact and quantized search share one scoring scale.
+    """
+    if metric == "euclidean":
+        # |q - x|^2 = |q|^2 + |x|^2 - 2 q.x, clamped against rounding below zero
+        squared = query_norms[:, None] ** 2 + norms[None, :] ** 2 - 2 * dots
+        distances = np.sqrt(np.maximum(squared, 0))
+        return 1 - distances / np.sqrt(dimensions)
+    if metric == "cosine":
+        return dots / np.maximum(query_norms[:, None] * norms[None, :], 1e-12)
+    raise ValueError(f"Unknown similarity metric: {metric}")
+
+
+def exact_similarity_scores(query, matrix, metric="euclidean"):
+    """
+    Score one query (D,) against an N x D matrix in float64, taking Euclidean
+    distances as |q - x| directly. The norm expansion used by
+    similarity_scores loses precision for near-identical vectors, so it is
+    kept for scoring candidates, and final scores are computed here.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    query = np.asarray(query, dtype=np.float64)
+    if metric == "euclidean":
+        return 1 - np.linalg.norm(matrix - query, axis=1) / np.sqrt(matrix.shape[1])
+    if metric == "cosine":
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+        return matrix @ query / np.maximum(norms, 1e-12)
+    raise ValueError(f"Unknown similarity metric: {metric}")
+
+
+def similarity_percentages(query, matrix):
+    """
+    Exact Euclidean similarity of one query to every row as a percentage
+    clipped at 0 and rounded to 2 places, matching
+    calculate_similarity_percentage.
+    """
+    scores = exact_similarity_scores(query, matrix)
+    return np.round(np.maximum(scores * 100, 0), 2)
+
+
+def compute_similarity(embedding1, embedding2):
+    """
+    Compute similarity between two embeddings using Euclidean distance
+    """
+    return float(exact_similarity_scores(embedding1, [embedding2])[0])
+
+def calculate_similarity_percentage(query_vector, result_vector):
+    return float(similarity_percentages(query_vector, [result_vector])[0])
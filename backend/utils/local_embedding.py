@@ -0,0 +1,111 @@
+import hashlib
+import math
+import os
+import re
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+
+_WORD = re.compile(r"\w+")
+# Character trigrams add robustness to typos and inflections, weighted below whole words
+_TRIGRAM_WEIGHT = 0.5
+
+
+@lru_cache(maxsize=1 << 16)
+def _bucket(feature, dimensions):
+    """Hash bucket and sign of a feature, stable across processes unlike hash()."""
+    digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+    return digest % dimensions, 1.0 if digest >> 63 else -1.0
+
+
+class HashingEmbedder:
+    """
+    Network-free embedder projecting word unigrams, word bigrams and character
+    trigrams onto `dimensions` signed hash buckets, with sublinear term
+    frequencies. Texts sharing words and spellings score as similar; unlike a
+    trained model it knows nothing of synonyms, so it suits low-latency
+    matching and hermetic tests rather than semantic search.
+    """
+
+    name = "hashing"
+    # Embedding a text is cheaper than a cache lookup on disk
+    cacheable = False
+
+    def __init__(self, dimensions):
+        self.dimensions = dimensions
+        self.model = "hashing-v1"
+
+    @staticmethod
+    def features(text):
+        """Weighted features of `text`: words, word pairs and trigrams of each word."""
+        words = _WORD.findall(text.lower())
+        counts = Counter(words)
+        counts.update(f"{first} {second}" for first, second in zip(words, words[1:]))
+        trigrams = Counter(
+            f"#{padded[i:i + 3]}"
+            for padded in (f"<{word}>" for word in words)
+            for i in range(len(padded) - 2)
+        )
+        weights = {feature: 1 + math.log(count) for feature, count in counts.items()}
+        weights.update(
+            (feature, _TRIGRAM_WEIGHT * (1 + math.log(count))) for feature, count in trigrams.items()
+        )
+        return weights
+
+    def embed(self, texts, task_type=None, title=None):
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self.features(text).items():
+                column, sign = _bucket(feature, self.dimensions)
+                vectors[row, column] += sign * weight
+        return vectors
+
+
+class OnnxEmbedder:
+    """
+    Sentence-transformer model exported to ONNX, run on the CPU with
+    onnxruntime and tokenized from its tokenizer.json with the `tokenizers`
+    package; token embeddings are mean-pooled over the attention mask. Both
+    packages are imported only when this backend is selected.
+    """
+
+    name = "onnx"
+    cacheable = True
+
+    def __init__(self, model_dir, dimensions, max_length=256):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise RuntimeError(
+                "The onnx embedding backend needs the onnxruntime and tokenizers packages"
+            ) from e
+
+        model_path = os.path.join(model_dir, "model.onnx")
+        self.session = onnxruntime.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding()
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.dimensions = dimensions
+        # Replacing the model files changes the cache key
+        self.model = f"onnx:{os.path.abspath(model_path)}:{os.path.getmtime(model_path)}"
+
+        output_dimensions = self.session.get_outputs()[0].shape[-1]
+        if isinstance(output_dimensions, int) and output_dimensions < dimensions:
+            raise ValueError(
+                f"{model_path} produces {output_dimensions}-dimension embeddings, "
+                f"fewer than EMBEDDING_DIMENSIONS={dimensions}"
+            )
+
+    def embed(self, texts, task_type=None, title=None):
+        encodings = self.tokenizer.encode_batch(list(texts))
+        ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        inputs = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self.input_names:
+            inputs["token_type_ids"] = np.zeros_like(ids)
+        tokens = self.session.run(None, inputs)[0]
+        summed = np.einsum("btd,bt->bd", tokens, mask.astype(np.float32))
+        return summed / np.maximum(mask.sum(axis=1, keepdims=True), 1)
@@ -0,0 +1,241 @@
+import numpy as np
+
+from backend.utils.embedding import scores_from_dots, similarity_scores
+
+# Rows per block when scanning vectors or codes, bounding temporary arrays
+BLOCK_ROWS = 8192
+# Training points per cluster used by k-means; more adds build time, not much accuracy
+_TRAIN_POINTS_PER_CLUSTER = 64
+
+
+def squared_distances(vectors, centroids, centroid_norms):
+    """Squared L2 distances from each row of `vectors` to each centroid."""
+    vector_norms = np.einsum("ij,ij->i", vectors, vectors)
+    return vector_norms[:, None] + centroid_norms[None, :] - 2 * vectors @ centroids.T
+
+
+def assign_nearest(vectors, centroids):
+    """Index of the nearest centroid for every vector, computed in blocks."""
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), BLOCK_ROWS):
+        block = vectors[start:start + BLOCK_ROWS]
+        labels[start:start + len(block)] = np.argmin(
+            squared_distances(block, centroids, centroid_norms), axis=1
+        )
+    return labels
+
+
+def kmeans(vectors, n_clusters, iterations=10, rng=None):
+    """Lloyd's k-means on a sample of `vectors`; empty clusters are re-seeded at random."""
+    rng = rng or np.random.default_rng(0)
+    sample_size = min(len(vectors), n_clusters * _TRAIN_POINTS_PER_CLUSTER)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(sample_size, n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign_nearest(sample, centroids)
+        counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+    return centroids
+
+
+class ScalarQuantizer:
+    """
+    Per-dimension int8 quantization: each component is mapped linearly onto
+    -127..127 over the range seen in training, 4x smaller than float32.
+    """
+
+    kind = "int8"
+
+    def __init__(self, offset=None, scale=None):
+        self.offset = offset
+        self.scale = scale
+
+    def fit(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        low, high = vectors.min(axis=0), vectors.max(axis=0)
+        self.offset = (high + low) / 2
+        self.scale = np.where(high > low, (high - low) / 254, 1).astype(np.float32)
+        return self
+
+    def encode(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return np.clip(np.rint((vectors - self.offset) / self.scale), -127, 127).astype(np.int8)
+
+    @property
+    def dimensions(self):
+        return len(self.offset)
+
+    def decode(self, codes):
+        return codes.astype(np.float32) * self.scale + self.offset
+
+    def dots(self, queries, codes):
+        """Dot products of (Q, D) queries with the decoded vectors, without decoding them all."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        scaled = queries * self.scale
+        bias = queries @ self.offset
+        out = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), BLOCK_ROWS):
+            block = codes[start:start + BLOCK_ROWS].astype(np.float32)
+            out[:, start:start + len(block)] = scaled @ block.T + bias[:, None]
+        return out
+
+    def norms(self, codes):
+        out = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), BLOCK_ROWS):
+            block = self.decode(codes[start:start + BLOCK_ROWS])
+            out[start:start + len(block)] = np.sqrt(np.einsum("ij,ij->i", block, block))
+        return out
+
+    def state(self):
+        return {"offset": self.offset, "scale": self.scale}
+
+
+class ProductQuantizer:
+    """
+    Product quantization: vectors are split into `n_subvectors` equal slices
+    and each slice is replaced by the index of its nearest of 256 k-means
+    centroids, one byte per slice. Dot products are looked up per slice.
+    """
+
+    kind = "pq"
+
+    def __init__(self, n_subvectors=0, centroids=None):
+        self.n_subvectors = n_subvectors
+        self.centroids = centroids
+
+    def fit(self, vectors, iterations=10, seed=0):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        dimensions = vectors.shape[1]
+        # 8 dimensions per byte by default, e.g. 96 bytes for a 768-dim embedding
+        self.n_subvectors = self.n_subvectors or max(1, dimensions // 8)
+        if dimensions % self.n_subvectors:
+            raise ValueError(
+                f"{dimensions} dimensions do not split into {self.n_subvectors} subvectors"
+            )
+        width = dimensions // self.n_subvectors
+        n_centroids = min(256, len(vectors))
+        rng = np.random.default_rng(seed)
+        self.centroids = np.stack([
+            kmeans(vectors[:, m * width:(m + 1) * width], n_centroids, iterations, rng)
+            for m in range(self.n_subvectors)
+        ])
+        return self
+
+    @property
+    def dimensions(self):
+        return self.centroids.shape[0] * self.centroids.shape[2]
+
+    def _split(self, vectors):
+        return vectors.reshape(len(vectors), self.n_subvectors, -1)
+
+    def encode(self, vectors):
+        parts = self._split(np.asarray(vectors, dtype=np.float32))
+        codes = np.empty((len(parts), self.n_subvectors), dtype=np.uint8)
+        for m in range(self.n_subvectors):
+            codes[:, m] = assign_nearest(parts[:, m], self.centroids[m])
+        return codes
+
+    def decode(self, codes):
+        subvectors = np.arange(self.n_subvectors)
+        return self.centroids[subvectors, codes].reshape(len(codes), -1)
+
+    def _lookup(self, tables, codes):
+        """Sum the per-slice table entries selected by each code, for (Q, M, K) tables."""
+        subvectors = np.arange(self.n_subvectors)
+        out = np.empty((len(tables), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), BLOCK_ROWS):
+            block = codes[start:start + BLOCK_ROWS]
+            out[:, start:start + len(block)] = tables[:, subvectors, block].sum(axis=2)
+        return out
+
+    def dots(self, queries, codes):
+        """Dot products of (Q, D) queries with the decoded vectors via per-slice lookup tables."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        tables = np.einsum("qmd,mkd->qmk", self._split(queries), self.centroids)
+        return self._lookup(tables, codes)
+
+    def norms(self, codes):
+        squared = np.einsum("mkd,mkd->mk", self.centroids, self.centroids)
+        return np.sqrt(self._lookup(squared[None], codes)[0])
+
+    def state(self):
+        return {"centroids": self.centroids}
+
+
+def make_quantizer(kind, pq_subvectors=0):
+    if kind == "int8":
+        return ScalarQuantizer()
+    if kind == "pq":
+        return ProductQuantizer(pq_subvectors)
+    raise ValueError(f"Unknown quantization: {kind}")
+
+
+def load_quantizer(kind, state):
+    if kind == "int8":
+        return ScalarQuantizer(state["offset"], state["scale"])
+    if kind == "pq":
+        return ProductQuantizer(len(state["centroids"]), state["centroids"])
+    raise ValueError(f"Unknown quantization: {kind}")
+
+
+def approximate_scores(quantizer, queries, codes, norms, dimensions, metric="euclidean"):
+    """
+    Scores on the same scale as similarity_scores, computed from the codes.
+    `norms` are the norms of the decoded vectors, from quantizer.norms(codes).
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    single = queries.ndim == 1
+    queries = np.atleast_2d(queries)
+    query_norms = np.sqrt(np.einsum("ij,ij->i", queries, queries))
+    scores = scores_from_dots(
+        quantizer.dots(queries, codes), query_norms, norms, dimensions, metric
+    )
+    return scores[0] if single else scores
+
+
+def evaluate_recall(vectors, queries, kinds=("int8", "pq"), k=10, rerank_factor=4,
+                    metric="euclidean", pq_subvectors=0):
+    """
+    Compare quantized search against exact search over `vectors`.
+    For each quantization, the top k * rerank_factor candidates by approximate
+    score are re-ranked with the exact vectors. Reports recall@k with and
+    without the re-rank and the bytes stored per vector.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    queries = np.asarray(queries, dtype=np.float32)
+    k = min(k, len(vectors))
+    exact = np.argsort(-similarity_scores(queries, vectors, metric), axis=1, kind="stable")[:, :k]
+    report = [{
+        "quantization": "none",
+        "bytes_per_vector": vectors.shape[1] * 4,
+        "recall": 1.0,
+        "recall_reranked": 1.0,
+    }]
+
+    for kind in kinds:
+        quantizer = make_quantizer(kind, pq_subvectors).fit(vectors)
+        codes = quantizer.encode(vectors)
+        approx = approximate_scores(
+            quantizer, queries, codes, quantizer.norms(codes), vectors.shape[1], metric
+        )
+        candidates = np.argsort(-approx, axis=1, kind="stable")[:, :k * rerank_factor]
+        found = found_reranked = 0
+        for query, truth, rows in zip(queries, exact, candidates):
+            truth = set(truth.tolist())
+            found += len(truth & set(rows[:k].tolist()))
+            exact_scores = similarity_scores(query, vectors[rows], metric)
+            reranked = rows[np.argsort(-exact_scores, kind="stable")[:k]]
+            found_reranked += len(truth & set(reranked.tolist()))
+        report.append({
+            "quantization": kind,
+            "bytes_per_vector": codes.shape[1] * codes.itemsize + 4,
+            "recall": found / exact.size,
+            "recall_reranked": found_reranked / exact.size,
+        })
+    return report
@@ -1,82 +1,438 @@
-import requests
+import logging
+import lzma
+import struct
+import zlib
+
+import numpy as np
 from PIL import Image
 
+END_MARKER = "1111111111111110"
+_END_MARKER_BITS = np.array([int(bit) for bit in END_MARKER], dtype=np.uint8)
+
+# Payload header, always stored in the red LSB of the first pixels:
+#   version 1: magic, version, flags, payload length in bytes, CRC-32 of the payload
+#   version 2: magic, version, flags, density, payload length in bytes, CRC-32 of the payload
+HEADER_MAGIC = b"UJ"
+HEADER_VERSION = 2
+_HEADER_FORMATS = {1: ">2sBBII", 2: ">2sBBBII"}
+_HEADER_PREFIX_BITS = struct.calcsize(">2sB") * 8
+_MAGIC_BITS = len(HEADER_MAGIC) * 8
+
+# Header flags: bit 0 marks UTF-8 text (Latin-1 otherwise), bits 1-2 hold the compression codec
+_FLAG_UTF8 = 0x01
+_CODEC_SHIFT = 1
+_CODECS = {"none": 0, "zlib": 1, "lzma": 2}
+# A 1 MiB dictionary covers typical payloads; the 64 MiB preset default costs ~50 ms to set up
+_LZMA_FILTERS = [{"id": lzma.FILTER_LZMA2, "preset": 9, "dict_size": 1 << 20}]
+# Raw streams do not record their dictionary, so decode with the 64 MiB one payloads were
+# first written with; a larger dictionary than the encoder's decodes any stream and is cheap
+_LZMA_DECODE_FILTERS = [{"id": lzma.FILTER_LZMA2, "dict_size": 64 << 20}]
+# Payloads shorter than this are stored raw when the codec is picked automatically
+_MIN_COMPRESSIBLE_BYTES = 64
+# Refuse to inflate payloads past this size
+_MAX_TEXT_BYTES = 64 << 20
+
+# Payload density: which channels carry payload bits and how many low bits of each
+CHANNELS = "RGBA"
+DEFAULT_CHANNELS = "R"
+DEFAULT_BITS_PER_CHANNEL = 1
+_MAX_BITS_PER_CHANNEL = 2
+
+# Number of red-channel bits inspected per step while searching for the end marker
+_SCAN_CHUNK_BITS = 1 << 18
+
+# Upper bound on the pixel buffer held at once; images are processed in bands of rows
+DEFAULT_TILE_BYTES = 4 << 20
 
-def encode_text_in_image(image: Image.Image, text: str) -> Image.Image:
+logger = logging.getLogger(__name__)
+
+
+def _header_bits(version: int) -> int:
+    return struct.calcsize(_HEADER_FORMATS[version]) * 8
+
+
+def _band_rows(image: Image.Image, tile_bytes: int) -> int:
     """
-    Encodes text into the image using LSB steganography on the RGB values.
+    Returns how many full rows of the image fit in `tile_bytes`, at least one.
     """
-    # Convert image to RGB if it's in a different mode
-    if image.mode not in ("RGB", "RGBA"):
-        image = image.convert("RGB")
-
-    encoded_image = image.copy()
-    binary_text = (
-        "".join(format(ord(char), "08b") for char in text) + "1111111111111110"
-    )  # End marker
-    pixels = encoded_image.load()
-    width, height = encoded_image.size
-    idx = 0
-
-    for y in range(height):
-        for x in range(width):
-            if idx < len(binary_text):
-                # Get pixel values
-                pixel = pixels[x, y]
-
-                # Handle RGB and RGBA formats
-                if image.mode == "RGBA":
-                    r, g, b, a = pixel
-                else:
-                    r, g, b = pixel
-                    a = None
-
-                # Modify LSB of the red channel
-                r = (r & ~1) | int(binary_text[idx])  # Modify LSB of red channel
-                idx += 1
-
-                # Set modified pixel back
-                if a is not None:
-                    pixels[x, y] = (r, g, b, a)
-                else:
-                    pixels[x, y] = (r, g, b)
-            else:
-                break
-    return encoded_image
+    channels = 4 if image.mode == "RGBA" else 3
+    return max(1, tile_bytes // (image.size[0] * channels))
 
 
-def decode_text_from_image(image: Image.Image) -> str:
+def peak_buffer_bytes(image: Image.Image, tile_bytes: int = DEFAULT_TILE_BYTES) -> int:
     """
-    Decodes text from the image using LSB steganography on the RGB values.
+    Returns the largest pixel buffer encode or decode holds at once for this image,
+    on top of the image itself (and its copy when encoding without `in_place`).
     """
-    # Convert the image to RGB if it's not in RGB or RGBA
-    if image.mode not in ("RGB", "RGBA"):
-        image = image.convert("RGB")
+    width, height = image.size
+    channels = 4 if image.mode == "RGBA" else 3
+    return min(_band_rows(image, tile_bytes), height) * width * channels
 
-    binary_text = ""
-    pixels = image.load()
+
+def _iter_row_bands(image: Image.Image, start: int, count: int, tile_bytes: int):
+    """
+    Yields (first_pixel, rows) for the bands of rows spanning `count` pixels from `start`.
+    Each band is a writable (rows, width, channels) array of at most `tile_bytes` bytes,
+    unless a single row is larger than that.
+    """
     width, height = image.size
+    end = min(start + count, width * height)
+    if end <= start:
+        return
+
+    band_rows = _band_rows(image, tile_bytes)
+    top, last_row = start // width, -(-end // width)
+    while top < last_row:
+        bottom = min(top + band_rows, last_row)
+        band = image.crop((0, top, width, bottom))
+        if band.mode not in ("RGB", "RGBA"):
+            band = band.convert("RGB")
+        yield top * width, np.array(band, dtype=np.uint8)
+        top = bottom
+
+
+def _parse_density(channels: str, bits_per_channel: int):
+    """
+    Validates a density mode and returns the channel indices and bits per channel.
+    """
+    channels = channels.upper()
+    if not channels or set(channels) - set(CHANNELS) or len(set(channels)) != len(channels):
+        raise ValueError(f"Channels must be a non-empty subset of {CHANNELS}, got {channels!r}")
+    if not 1 <= bits_per_channel <= _MAX_BITS_PER_CHANNEL:
+        raise ValueError(
+            f"Bits per channel must be between 1 and {_MAX_BITS_PER_CHANNEL}, "
+            f"got {bits_per_channel}"
+        )
+    return tuple(CHANNELS.index(c) for c in CHANNELS if c in channels), bits_per_channel
+
+
+def _density_to_byte(channel_indices, bits_per_channel: int) -> int:
+    """
+    Packs a density mode as a channel bit mask in the low nibble and the bit count above it.
+    """
+    mask = sum(1 << index for index in channel_indices)
+    return mask | (bits_per_channel << 4)
+
+
+def _density_from_byte(density: int):
+    channel_indices = tuple(index for index in range(len(CHANNELS)) if density & (1 << index))
+    return channel_indices, density >> 4
+
+
+def _pixels_needed(bit_count: int, channel_indices, bits_per_channel: int) -> int:
+    """
+    Returns the number of pixels needed to hold `bit_count` bits in the given density.
+    """
+    values = -(-bit_count // bits_per_channel)
+    return -(-values // len(channel_indices))
+
+
+def _read_bits(
+    image: Image.Image,
+    start: int,
+    bit_count: int,
+    channel_indices=(0,),
+    bits_per_channel: int = 1,
+    tile_bytes: int = DEFAULT_TILE_BYTES,
+) -> np.ndarray:
+    """
+    Reads `bit_count` payload bits stored from pixel `start` on, cropping only the rows they span.
+    """
+    pixel_count = _pixels_needed(bit_count, channel_indices, bits_per_channel)
+    shifts = np.arange(bits_per_channel - 1, -1, -1, dtype=np.uint8)
+    chunks = []
+    for first_pixel, rows in _iter_row_bands(image, start, pixel_count, tile_bytes):
+        pixels = rows.reshape(-1, rows.shape[-1])
+        lo = max(start - first_pixel, 0)
+        hi = min(start + pixel_count - first_pixel, len(pixels))
+        values = pixels[lo:hi][:, channel_indices].reshape(-1)
+        # Expand each channel value into its low bits, most significant first
+        chunks.append(((values[:, None] >> shifts) & 1).reshape(-1))
+    if not chunks:
+        return np.zeros(0, dtype=np.uint8)
+    return np.concatenate(chunks)[:bit_count]
+
+
+def _write_bits(
+    image: Image.Image,
+    start: int,
+    bits: np.ndarray,
+    channel_indices=(0,),
+    bits_per_channel: int = 1,
+    tile_bytes: int = DEFAULT_TILE_BYTES,
+):
+    """
+    Writes bits into the low bits of the given channels from pixel `start` on.
+    """
+    # Group the bits per channel value, padding the last group with zeros
+    padding = -len(bits) % bits_per_channel
+    groups = np.concatenate([bits, np.zeros(padding, dtype=np.uint8)])
+    groups = groups.reshape(-1, bits_per_channel)
+    weights = (1 << np.arange(bits_per_channel - 1, -1, -1)).astype(np.uint8)
+    values = (groups * weights).sum(axis=1).astype(np.uint8)
+    keep_mask = np.uint8(0xFF ^ ((1 << bits_per_channel) - 1))
+
+    width = image.size[0]
+    pixel_count = _pixels_needed(len(bits), channel_indices, bits_per_channel)
+    for first_pixel, rows in _iter_row_bands(image, start, pixel_count, tile_bytes):
+        pixels = rows.reshape(-1, rows.shape[-1])
+        lo = max(start - first_pixel, 0)
+        hi = min(start + pixel_count - first_pixel, len(pixels))
+        slots = pixels[lo:hi][:, channel_indices].reshape(-1)
+        offset = (first_pixel + lo - start) * len(channel_indices)
+        band_values = values[offset : offset + len(slots)]
+        slots[: len(band_values)] = (slots[: len(band_values)] & keep_mask) | band_values
+        pixels[lo:hi, channel_indices] = slots.reshape(hi - lo, len(channel_indices))
+        image.paste(Image.fromarray(rows), (0, first_pixel // width))
+
+
+def _bits_to_text(bits: np.ndarray) -> str:
+    """
+    Unpacks bits into text, one character per group of 8 bits.
+    """
+    full_length = len(bits) - len(bits) % 8
+    text = np.packbits(bits[:full_length]).tobytes().decode("latin-1")
+    if full_length < len(bits):
+        # A trailing partial group is read as a short binary number, as before
+        text += chr(int("".join(str(bit) for bit in bits[full_length:]), 2))
+    return text
+
+
+def _compress(data: bytes, codec: str) -> bytes:
+    if codec == "zlib":
+        return zlib.compress(data, 9)
+    if codec == "lzma":
+        return lzma.compress(data, format=lzma.FORMAT_RAW, filters=_LZMA_FILTERS)
+    return data
+
+
+def _decompress(data: bytes, codec: int) -> bytes:
+    if codec == _CODECS["zlib"]:
+        decompressor = zlib.decompressobj()
+        text_bytes = decompressor.decompress(data, _MAX_TEXT_BYTES)
+        if decompressor.unconsumed_tail:
+            raise ValueError("Decompressed payload is too large")
+        return text_bytes
+    if codec == _CODECS["lzma"]:
+        decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_RAW, filters=_LZMA_DECODE_FILTERS)
+        text_bytes = decompressor.decompress(data, _MAX_TEXT_BYTES)
+        if not decompressor.eof and not decompressor.needs_input:
+            raise ValueError("Decompressed payload is too large")
+        return text_bytes
+    return data
+
+
+def _encode_payload(text: str, compression: str):
+    """
+    Encodes the text as UTF-8 and compresses it with the requested codec.
+    With "auto" the smallest of the uncompressed, zlib and lzma payloads is kept.
+    Returns the payload bytes and the header flags describing them.
+    """
+    if compression != "auto" and compression not in _CODECS:
+        raise ValueError(
+            f"Compression must be one of auto, {', '.join(_CODECS)}, got {compression!r}"
+        )
+    text_bytes = text.encode("utf-8")
+
+    if compression == "auto":
+        candidates = ["none"]
+        if len(text_bytes) >= _MIN_COMPRESSIBLE_BYTES:
+            candidates += ["zlib", "lzma"]
+    else:
+        candidates = [compression]
+    payload, codec = min(
+        ((_compress(text_bytes, codec), codec) for codec in candidates),
+        key=lambda candidate: len(candidate[0]),
+    )
+    return payload, _FLAG_UTF8 | (_CODECS[codec] << _CODEC_SHIFT)
+
+
+def _decode_payload(payload: bytes, flags: int) -> str:
+    text_bytes = _decompress(payload, (flags >> _CODEC_SHIFT) & 0b11)
+    return text_bytes.decode("utf-8" if flags & _FLAG_UTF8 else "latin-1")
+
+
+def _build_header(payload: bytes, flags: int, density: int) -> np.ndarray:
+    """
+    Packs the header for the payload into an array of bits.
+    """
+    header = struct.pack(
+        _HEADER_FORMATS[HEADER_VERSION],
+        HEADER_MAGIC,
+        HEADER_VERSION,
+        flags,
+        density,
+        len(payload),
+        zlib.crc32(payload),
+    )
+    return np.unpackbits(np.frombuffer(header, dtype=np.uint8))
+
+
+def _find_end_marker(bits: np.ndarray) -> int:
+    """
+    Returns the index where the first end marker starts, or -1 if there is none.
+    """
+    marker_length = len(_END_MARKER_BITS)
+    for start in range(0, len(bits), _SCAN_CHUNK_BITS):
+        # Overlap chunks so that a marker crossing a chunk boundary is still found
+        window = bits[max(0, start - marker_length + 1) : start + _SCAN_CHUNK_BITS]
+        if len(window) < marker_length:
+            break
+        # The marker is fifteen ones followed by a zero: count the ones before each zero
+        ones = np.concatenate(([0], np.cumsum(window, dtype=np.int64)))
+        ends = np.arange(marker_length - 1, len(window))
+        leading_ones = ones[ends] - ones[ends - (marker_length - 1)]
+        matches = np.flatnonzero((window[ends] == 0) & (leading_ones == marker_length - 1))
+        if len(matches):
+            return max(0, start - marker_length + 1) + int(ends[matches[0]]) - (
+                marker_length - 1
+            )
+    return -1
+
+
+def _decode_with_header(image: Image.Image, tile_bytes: int):
+    """
+    Decodes a payload written with the length-prefixed header.
+    Returns None if the image does not carry a valid header and payload.
+    """
+    magic_bits = _read_bits(image, 0, _MAGIC_BITS, tile_bytes=tile_bytes)
+    if len(magic_bits) < _MAGIC_BITS or np.packbits(magic_bits).tobytes() != HEADER_MAGIC:
+        return None
 
-    for y in range(height):
-        for x in range(width):
-            # Handle both RGB and RGBA pixel formats
-            pixel = pixels[x, y]
-            if image.mode == "RGBA":
-                r, g, b, a = pixel
-            else:
-                r, g, b = pixel
-
-            # Extract the LSB of the red channel
-            binary_text += str(r & 1)
-
-            # Check for end marker
-            if binary_text[-16:] == "1111111111111110":
-                binary_text = binary_text[:-16]  # Remove end marker
-                decoded_text = "".join(
-                    chr(int(binary_text[i : i + 8], 2))
-                    for i in range(0, len(binary_text), 8)
-                )
-                return decoded_text
+    prefix_bits = _read_bits(image, 0, _HEADER_PREFIX_BITS, tile_bytes=tile_bytes)
+    version = int(np.packbits(prefix_bits[_MAGIC_BITS:])[0])
+    if version not in _HEADER_FORMATS:
+        return None
+
+    header_bit_count = _header_bits(version)
+    header_bits = _read_bits(image, 0, header_bit_count, tile_bytes=tile_bytes)
+    if len(header_bits) < header_bit_count:
+        return None
+    fields = struct.unpack(_HEADER_FORMATS[version], np.packbits(header_bits).tobytes())
+    if version == 1:
+        _, _, flags, length, checksum = fields
+        channel_indices, bits_per_channel = (0,), 1
+    else:
+        _, _, flags, density, length, checksum = fields
+        channel_indices, bits_per_channel = _density_from_byte(density)
+        if not channel_indices or not 1 <= bits_per_channel <= _MAX_BITS_PER_CHANNEL:
+            return None
+        if max(channel_indices) >= (4 if image.mode == "RGBA" else 3):
+            return None
+
+    payload_bits = _read_bits(
+        image, header_bit_count, length * 8, channel_indices, bits_per_channel, tile_bytes
+    )
+    if len(payload_bits) < length * 8:
+        return None
+    payload = np.packbits(payload_bits).tobytes()
+    if zlib.crc32(payload) != checksum:
+        return None
+    try:
+        return _decode_payload(payload, flags)
+    except (ValueError, zlib.error, lzma.LZMAError) as e:
+        logger.warning(f"Failed to decode payload with a valid checksum: {e}")
+        return None
+
+
+def _decode_with_end_marker(image: Image.Image, tile_bytes: int) -> str:
+    """
+    Decodes a payload terminated by the legacy end marker.
+    Only the last few bits of each band are carried over, so memory stays bounded
+    by the band size; the payload pixels are re-read once the marker is found.
+    """
+    width, height = image.size
+    carry = np.zeros(0, dtype=np.uint8)
+    for first_pixel, rows in _iter_row_bands(image, 0, width * height, tile_bytes):
+        # Extract the LSB of the red channel of every pixel in the band
+        window = np.concatenate([carry, rows[..., 0].reshape(-1) & 1])
+        marker_index = _find_end_marker(window)
+        if marker_index >= 0:
+            payload_length = first_pixel - len(carry) + marker_index
+            return _bits_to_text(_read_bits(image, 0, payload_length, tile_bytes=tile_bytes))
+        carry = window[-(len(_END_MARKER_BITS) - 1) :]
 
     # If no end marker is found, return an empty string
     return ""
+
+
+def encode_text_in_image(
+    image: Image.Image,
+    text: str,
+    channels: str = DEFAULT_CHANNELS,
+    bits_per_channel: int = DEFAULT_BITS_PER_CHANNEL,
+    compression: str = "auto",
+    in_place: bool = False,
+    tile_bytes: int = DEFAULT_TILE_BYTES,
+) -> Image.Image:
+    """
+    Encodes text into the image using LSB steganography on the RGB values.
+    The text is stored behind a header holding its length, checksum and density
+    mode: the `channels` (any of "RGBA") and `bits_per_channel` (1 or 2) that
+    carry the payload. Denser modes touch fewer pixels.
+    The text is stored as UTF-8, compressed with `compression` ("none", "zlib",
+    "lzma", or "auto" to keep whichever is smallest); the header records the codec.
+    Only the rows the payload touches are loaded, one band of at most
+    `tile_bytes` at a time. With `in_place` an RGB or RGBA image is modified
+    directly instead of being copied.
+    """
+    channel_indices, bits_per_channel = _parse_density(channels, bits_per_channel)
+    payload, flags = _encode_payload(text, compression)
+    header_bits = _build_header(
+        payload, flags, _density_to_byte(channel_indices, bits_per_channel)
+    )
+    payload_bits = np.unpackbits(np.frombuffer(payload, dtype=np.uint8))
+
+    # Convert image to RGB if it's in a different mode; the conversion is already a copy
+    if image.mode not in ("RGB", "RGBA"):
+        encoded_image = image.convert("RGB")
+    else:
+        encoded_image = image if in_place else image.copy()
+    if max(channel_indices) >= len(encoded_image.mode):
+        raise ValueError(f"Image mode {encoded_image.mode} has no alpha channel")
+
+    width, height = encoded_image.size
+    pixels_needed = len(header_bits) + _pixels_needed(
+        len(payload_bits), channel_indices, bits_per_channel
+    )
+    if pixels_needed > width * height:
+        raise ValueError(
+            f"Text needs {pixels_needed} pixels but the image only has {width * height}"
+        )
+
+    _write_bits(encoded_image, 0, header_bits, tile_bytes=tile_bytes)
+    _write_bits(
+        encoded_image,
+        len(header_bits),
+        payload_bits,
+        channel_indices,
+        bits_per_channel,
+        tile_bytes,
+    )
+
+    logger.debug(
+        f"Encoded {len(payload)} bytes into {-(-pixels_needed // width)} rows, "
+        f"peak tile buffer {peak_buffer_bytes(encoded_image, tile_bytes)} bytes"
+    )
+    return encoded_image
+
+
+def decode_text_from_image(
+    image: Image.Image,
+    legacy_fallback: bool = True,
+    tile_bytes: int = DEFAULT_TILE_BYTES,
+) -> str:
+    """
+    Decodes text from the image using LSB steganography on the RGB values.
+    The density mode is read from the header, and only the header and payload
+    pixels are read. Images without a header are scanned for the legacy end
+    marker unless `legacy_fallback` is False, in which case they are rejected
+    after the first few pixels.
+    """
+    logger.debug(f"Decoding with peak tile buffer {peak_buffer_bytes(image, tile_bytes)} bytes")
+    decoded_text = _decode_with_header(image, tile_bytes)
+    if decoded_text is not None:
+        return decoded_text
+    if not legacy_fallback:
+        return ""
+    return _decode_with_end_marker(image, tile_bytes)
@@ -0,0 +1,65 @@
+import io
+import pickle
+import struct
+
+import numpy as np
+from bson import Binary
+
+# Packed vectors: magic, format version and dtype code, then the little-endian
+# components. The 4-byte header keeps float32 data aligned.
+VECTOR_MAGIC = b"EV"
+VECTOR_VERSION = 1
+_HEADER_FORMAT = "<2sBB"
+_HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+_DTYPES = {"float32": (1, np.dtype("<f4")), "float16": (2, np.dtype("<f2"))}
+_DTYPES_BY_CODE = {code: dtype for code, dtype in _DTYPES.values()}
+
+
+def pack_embedding(embedding, dtype: str = "float32") -> Binary:
+    """Pack an embedding into a versioned Binary of little-endian float32 or float16."""
+    if dtype not in _DTYPES:
+        raise ValueError(f"Unknown embedding dtype: {dtype}")
+    code, np_dtype = _DTYPES[dtype]
+    header = struct.pack(_HEADER_FORMAT, VECTOR_MAGIC, VECTOR_VERSION, code)
+    return Binary(header + np.asarray(embedding, dtype=np_dtype).tobytes())
+
+
+def is_packed_embedding(data) -> bool:
+    return isinstance(data, bytes) and data[:len(VECTOR_MAGIC)] == VECTOR_MAGIC
+
+
+def unpack_embedding(data) -> np.ndarray:
+    """
+    Decode a packed embedding into a read-only NumPy view of `data`, without
+    copying. float16 vectors stay float16; similarity code upcasts as needed.
+    """
+    if len(data) < _HEADER_SIZE:
+        raise ValueError("Packed embedding is too short")
+    magic, version, code = struct.unpack_from(_HEADER_FORMAT, data)
+    if magic != VECTOR_MAGIC:
+        raise ValueError("Not a packed embedding")
+    if version != VECTOR_VERSION:
+        raise ValueError(f"Unsupported packed embedding version: {version}")
+    if code not in _DTYPES_BY_CODE:
+        raise ValueError(f"Unknown packed embedding dtype code: {code}")
+    return np.frombuffer(data, dtype=_DTYPES_BY_CODE[code], offset=_HEADER_SIZE)
+
+
+class _ListUnpickler(pickle.Unpickler):
+    """Unpickler that refuses every global, so only builtin containers and numbers load."""
+
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"Refusing to load {module}.{name} from stored embedding")
+
+
+def unpickle_legacy_embedding(data) -> list:
+    """
+    Load an embedding stored by older versions as a pickled list of floats.
+    Pickles that reference any class or function are rejected.
+    """
+    embedding = _ListUnpickler(io.BytesIO(data)).load()
+    if not isinstance(embedding, list) or not all(
+        isinstance(value, (int, float)) for value in embedding
+    ):
+        raise ValueError("Stored pickle is not a list of numbers")
+    return embedding
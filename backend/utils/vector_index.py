@@ -0,0 +1,331 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from backend.utils.embedding import embedding_norms, similarity_scores
+from backend.utils.quantization import (
+    approximate_scores,
+    assign_nearest,
+    kmeans,
+    load_quantizer,
+    make_quantizer,
+    squared_distances,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest-neighbour index over embedding vectors.
+    Vectors are clustered into `n_lists` lists with k-means; a query is scored
+    exactly against the vectors of its `n_probe` nearest lists only, so more
+    probes give higher recall at the cost of latency. Scores are the same as
+    similarity_scores for the index metric.
+
+    With a quantizer the index keeps only compressed codes in memory and its
+    scores are approximate. Searches then return a wider candidate set, k *
+    rerank_factor hits down to threshold - rerank_margin, for the caller to
+    re-rank against the exact vectors.
+    """
+
+    def __init__(self, ids, vectors, centroids, offsets, metric="euclidean", n_probe=8,
+                 metadata=None, quantizer=None, codes=None, rerank_factor=4, rerank_margin=0.01,
+                 norms=None):
+        self.ids = ids
+        self.vectors = vectors
+        self.quantizer = quantizer
+        self.codes = codes
+        if quantizer is None:
+            self.dimensions = vectors.shape[1]
+            self.norms = embedding_norms(vectors) if norms is None else norms
+        else:
+            self.dimensions = quantizer.dimensions
+            self.norms = quantizer.norms(codes) if norms is None else norms
+        self.centroids = centroids
+        self.offsets = offsets
+        self.metric = metric
+        self.n_probe = n_probe
+        self.metadata = metadata or {}
+        self.rerank_factor = rerank_factor
+        self.rerank_margin = rerank_margin
+        # Snapshot directory the index was saved to or loaded from
+        self.path = None
+
+    @classmethod
+    def build(cls, ids, embeddings, n_lists=0, n_probe=8, metric="euclidean",
+              iterations=10, seed=0, metadata=None, quantization=None, pq_subvectors=0,
+              rerank_factor=4, rerank_margin=0.01):
+        """
+        Cluster `embeddings` and build an index mapping rows back to `ids`.
+        `n_lists` of 0 picks about sqrt(N) lists. `quantization` of "int8" or
+        "pq" stores compressed codes instead of the float vectors.
+        """
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        ids = np.asarray([str(id_) for id_ in ids])
+        if vectors.ndim != 2 or len(vectors) != len(ids):
+            raise ValueError("Expected one embedding per id")
+        if len(vectors) == 0:
+            return cls(ids, vectors, vectors[:0], np.zeros(1, dtype=np.int64), metric, n_probe, metadata)
+
+        n_lists = n_lists or int(round(np.sqrt(len(vectors))))
+        n_lists = max(1, min(n_lists, len(vectors)))
+        rng = np.random.default_rng(seed)
+        if n_lists == 1:
+            centroids = vectors.mean(axis=0, keepdims=True)
+            labels = np.zeros(len(vectors), dtype=np.int64)
+        else:
+            centroids = kmeans(vectors, n_lists, iterations, rng)
+            labels = assign_nearest(vectors, centroids)
+
+        # Store each list contiguously so probing a list is a slice
+        order = np.argsort(labels, kind="stable")
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=n_lists), out=offsets[1:])
+        vectors = vectors[order]
+        quantizer = codes = None
+        if quantization:
+            quantizer = make_quantizer(quantization, pq_subvectors).fit(vectors)
+            codes = quantizer.encode(vectors)
+            vectors = None
+        logger.info(
+            f"Built IVF index over {len(ids)} vectors in {n_lists} lists"
+            + (f" with {quantization} codes" if quantization else "")
+        )
+        return cls(
+            ids[order], vectors, centroids, offsets, metric, n_probe, metadata,
+            quantizer, codes, rerank_factor, rerank_margin,
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    def search(self, query, k=None, threshold=None, n_probe=None):
+        """
+        Return up to `k` (id, score) pairs scoring at least `threshold`, best first.
+        Either limit may be None; `n_probe` overrides the index default. For a
+        quantized index both limits are widened for re-ranking.
+        """
+        if len(self) == 0:
+            return []
+        query = np.asarray(query, dtype=np.float32)
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+
+        centroid_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        distances = squared_distances(query[None, :], self.centroids, centroid_norms)[0]
+        probes = np.argpartition(distances, n_probe - 1)[:n_probe]
+        rows = np.concatenate([
+            np.arange(self.offsets[probe], self.offsets[probe + 1]) for probe in probes
+        ])
+
+        if self.quantizer is None:
+            scores = similarity_scores(query, self.vectors[rows], self.metric, self.norms[rows])
+        else:
+            scores = approximate_scores(
+                self.quantizer, query, self.codes[rows], self.norms[rows], self.dimensions, self.metric
+            )
+            k = k and k * self.rerank_factor
+            threshold = None if threshold is None else threshold - self.rerank_margin
+        if threshold is not None:
+            keep = scores >= threshold
+            rows, scores = rows[keep], scores[keep]
+        order = np.argsort(-scores, kind="stable")
+        if k is not None:
+            order = order[:k]
+        return [(str(self.ids[rows[i]]), float(scores[i])) for i in order]
+
+    def save(self, path, keep=2):
+        """
+        Write the index as a snapshot directory of .npy files that load() can
+        memory-map. `path` becomes a symlink to the new snapshot, switched
+        atomically so readers see either the old or the new one. Snapshots
+        older than the newest `keep` are removed; processes still mapping
+        them keep their pages until they reload.
+        """
+        parent = os.path.dirname(os.path.abspath(path))
+        base = os.path.basename(path)
+        os.makedirs(parent, exist_ok=True)
+        building = tempfile.mkdtemp(dir=parent, prefix=f"{base}.{time.time_ns()}-", suffix=".building")
+        try:
+            arrays = {
+                "ids": self.ids,
+                "norms": self.norms,
+                "centroids": self.centroids,
+                "offsets": self.offsets,
+            }
+            quantizer_state = {}
+            if self.quantizer is None:
+                arrays["vectors"] = self.vectors
+            else:
+                arrays["codes"] = self.codes
+                quantizer_state = self.quantizer.state()
+                arrays.update({f"quantizer_{name}": value for name, value in quantizer_state.items()})
+            for name, array in arrays.items():
+                np.save(os.path.join(building, f"{name}.npy"), np.ascontiguousarray(array))
+            with open(os.path.join(building, "config.json"), "w") as config_file:
+                json.dump({
+                    "metric": self.metric,
+                    "n_probe": self.n_probe,
+                    "metadata": self.metadata,
+                    "quantization": self.quantizer and self.quantizer.kind,
+                    "quantizer_state": list(quantizer_state),
+                    "rerank_factor": self.rerank_factor,
+                    "rerank_margin": self.rerank_margin,
+                }, config_file)
+
+            snapshot = building[:-len(".building")]
+            os.rename(building, snapshot)
+            link = f"{path}.{os.getpid()}.link"
+            os.symlink(os.path.basename(snapshot), link)
+            os.replace(link, path)
+        except BaseException:
+            shutil.rmtree(building, ignore_errors=True)
+            raise
+        self.path = snapshot
+        _prune_snapshots(parent, base, keep)
+
+    @classmethod
+    def load(cls, path, n_probe=None, mmap=True):
+        """
+        Load the snapshot `path` points to. With `mmap` the large arrays are
+        mapped read-only, so processes loading the same snapshot share one
+        copy in the page cache and loading does not read them up front.
+        """
+        snapshot = os.path.realpath(path)
+        with open(os.path.join(snapshot, "config.json")) as config_file:
+            config = json.load(config_file)
+
+        def array(name):
+            return np.load(
+                os.path.join(snapshot, f"{name}.npy"),
+                mmap_mode="r" if mmap else None,
+                allow_pickle=False,
+            )
+
+        quantizer = None
+        if config.get("quantization"):
+            quantizer = load_quantizer(config["quantization"], {
+                name: np.load(os.path.join(snapshot, f"quantizer_{name}.npy"))
+                for name in config["quantizer_state"]
+            })
+        index = cls(
+            array("ids"),
+            None if quantizer else array("vectors"),
+            np.load(os.path.join(snapshot, "centroids.npy")),
+            np.load(os.path.join(snapshot, "offsets.npy")),
+            config["metric"],
+            n_probe or config["n_probe"],
+            config["metadata"],
+            quantizer,
+            array("codes") if quantizer else None,
+            config["rerank_factor"],
+            config["rerank_margin"],
+            norms=array("norms"),
+        )
+        index.path = snapshot
+        return index
+
+
+def _prune_snapshots(parent, base, keep):
+    """Remove all but the newest `keep` snapshot directories of the index `base`."""
+    snapshots = sorted(
+        entry for entry in os.listdir(parent)
+        if entry.startswith(f"{base}.") and not entry.endswith((".building", ".link", ".lock"))
+        and os.path.isdir(os.path.join(parent, entry))
+    )
+    for entry in snapshots[:-keep]:
+        shutil.rmtree(os.path.join(parent, entry), ignore_errors=True)
+
+
+class DeltaSegment:
+    """
+    Changes made after a snapshot was built, held in memory until the next
+    merge folds them into a new snapshot. Inserted and updated vectors are
+    searched exactly; every id touched here, including deleted ones, shadows
+    its stale entry in the snapshot. Safe to update from a watcher thread
+    while requests search it.
+    """
+
+    def __init__(self, metric="euclidean"):
+        self.metric = metric
+        self._lock = threading.Lock()
+        self._ids = []
+        self._vectors = None
+        self._live = np.zeros(0, dtype=bool)
+        self._rows = {}
+        # Every id changed here, with the time of its latest change
+        self._changed = {}
+
+    def __len__(self):
+        """Number of changed ids, which is what a merge would fold in."""
+        return len(self._changed)
+
+    def upsert(self, ids, vectors, changed_at=None):
+        """Add vectors for new ids or replace the vectors of existing ones."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        if not len(vectors):
+            return
+        changed_at = time.time() if changed_at is None else changed_at
+        with self._lock:
+            start = len(self._ids)
+            for offset, id_ in enumerate(ids):
+                id_ = str(id_)
+                if id_ in self._rows:
+                    self._live[self._rows[id_]] = False
+                self._rows[id_] = start + offset
+                self._changed[id_] = changed_at
+                self._ids.append(id_)
+            self._vectors = vectors if self._vectors is None else np.concatenate([self._vectors, vectors])
+            # A repeated id within one call leaves only its last row live
+            live = np.zeros(len(vectors), dtype=bool)
+            live[[self._rows[str(id_)] - start for id_ in ids]] = True
+            self._live = np.concatenate([self._live, live])
+
+    def remove(self, ids, changed_at=None):
+        """Mark ids as deleted, hiding them here and in the snapshot."""
+        changed_at = time.time() if changed_at is None else changed_at
+        with self._lock:
+            for id_ in ids:
+                id_ = str(id_)
+                row = self._rows.pop(id_, None)
+                if row is not None:
+                    self._live[row] = False
+                self._changed[id_] = changed_at
+
+    def shadows(self, id_) -> bool:
+        """Whether the snapshot entry for `id_` is stale because of a change here."""
+        return id_ in self._changed
+
+    def changes_since(self, since):
+        """(id, vector or None for a deletion) for changes made at or after `since`."""
+        with self._lock:
+            return [
+                (id_, self._vectors[self._rows[id_]] if id_ in self._rows else None, changed_at)
+                for id_, changed_at in self._changed.items()
+                if changed_at >= since
+            ]
+
+    def search(self, query, k=None, threshold=None):
+        """Return up to `k` (id, score) pairs scoring at least `threshold`, best first."""
+        with self._lock:
+            if not self._rows:
+                return []
+            rows = np.flatnonzero(self._live)
+            vectors, ids = self._vectors[rows], [self._ids[row] for row in rows]
+        scores = similarity_scores(query, vectors, self.metric)
+        order = np.argsort(-scores, kind="stable")
+        if threshold is not None:
+            order = order[scores[order] >= threshold]
+        if k is not None:
+            order = order[:k]
+        return [(ids[i], float(scores[i])) for i in order]
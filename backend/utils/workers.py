@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from fastapi import HTTPException
+from PIL import Image
+
+from backend.utils.common import image_to_png_bytes
+from backend.utils.steganography import decode_text_from_image, encode_text_in_image
+
+logger = logging.getLogger(__name__)
+
+
+# Tasks run inside the worker processes; they take and return plain bytes so
+# that only the upload and the result cross the process boundary.
+def encode_image_bytes(
+    image_bytes: bytes,
+    text: str,
+    channels: str,
+    bits_per_channel: int,
+    compression: str,
+    compress_level: int,
+) -> bytes:
+    """Decode an uploaded image, hide the text in it and serialize it to PNG."""
+    image = Image.open(BytesIO(image_bytes))
+    encoded_image = encode_text_in_image(
+        image,
+        text,
+        channels=channels,
+        bits_per_channel=bits_per_channel,
+        compression=compression,
+        in_place=True,
+    )
+    return image_to_png_bytes(encoded_image, compress_level)
+
+
+def decode_image_bytes(image_bytes: bytes, legacy_fallback: bool = True) -> str:
+    """Decode an uploaded image and extract the hidden text."""
+    image = Image.open(BytesIO(image_bytes))
+    return decode_text_from_image(image, legacy_fallback=legacy_fallback)
+
+
+class ImageWorkerPool:
+    """
+    Runs CPU-bound image work off the event loop in a pool of worker processes.
+    At most `max_workers + max_queue` tasks are accepted at once; further
+    requests are rejected with 503, and tasks that do not finish within
+    `timeout` seconds are answered with 504. If a worker process dies, e.g. when
+    it is killed for running out of memory, the pool is replaced and the tasks
+    it was running are answered with 500. With `max_workers` set to 0, or
+    before `start` is called, tasks run on a single background thread instead.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int, timeout: float):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self) -> int:
+        return max(self.max_workers, 1) + self.max_queue
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def start(self):
+        if self._executor is not None:
+            return
+        if self.max_workers > 0:
+            self._executor = self._process_pool()
+            logger.info(f"Started image worker pool with {self.max_workers} processes")
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def _process_pool(self) -> ProcessPoolExecutor:
+        # Spawn rather than fork so workers do not inherit the server's threads and sockets
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    def _replace_broken(self, executor):
+        """Swap a process pool that lost a worker for a fresh one, once per broken pool."""
+        with self._lock:
+            if self._executor is not executor:
+                # Another request already replaced it
+                return
+            self._executor = self._process_pool()
+        logger.error(f"An image worker process died; restarted the pool with {self.max_workers} processes")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, fn, *args):
+        """Run `fn(*args)` in the pool and return its result."""
+        if self._executor is None:
+            # Not started, e.g. when the app runs without its startup hook in tests
+            self._executor = ThreadPoolExecutor(max_workers=1)
+
+        with self._lock:
+            if self._pending >= self.capacity:
+                raise HTTPException(status_code=503, detail="Server is busy, try again later")
+            self._pending += 1
+
+        # The slot is released when the task itself finishes, not when the request gives up
+        executor = self._executor
+        try:
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                # The pool broke since the last task finished; retry once on its replacement
+                self._replace_broken(executor)
+                executor = self._executor
+                future = executor.submit(fn, *args)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise HTTPException(status_code=504, detail="Image processing timed out")
+        except BrokenProcessPool:
+            self._replace_broken(executor)
+            raise HTTPException(status_code=500, detail="Image worker process died")
+
+    async def map_unordered(self, fn, jobs):
+        """
+        Run `fn(*args)` for each (key, args) job and yield (key, result, error)
+        as each task finishes. At most one task per worker is in flight for the
+        batch; a failing task reports its error instead of stopping the others.
+        """
+        jobs = iter(jobs)
+        in_flight = {}
+
+        def submit_next():
+            for key, args in jobs:
+                in_flight[asyncio.ensure_future(self.run(fn, *args))] = key
+                return
+
+        for _ in range(max(self.max_workers, 1)):
+            submit_next()
+        try:
+            while in_flight:
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    key = in_flight.pop(task)
+                    submit_next()
+                    error = task.exception()
+                    if error is None:
+                        yield key, task.result(), None
+                    else:
+                        detail = error.detail if isinstance(error, HTTPException) else str(error)
+                        yield key, None, detail or type(error).__name__
+        finally:
+            # The client went away or the consumer stopped early
+            for task in in_flight:
+                task.cancel()